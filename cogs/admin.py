@@ -0,0 +1,208 @@
+import discord
+from discord import app_commands
+from discord.ext import commands
+import logging
+from utils.log import get_logger, set_guild_debug, guild_debug_enabled, set_level
+from utils import messages
+from utils.media import media
+from utils.budget import budget
+from utils.broadcast import broadcast
+from utils.memory import memory_guard
+
+log = get_logger('admin')
+
+LEVELS = ['DEBUG', 'INFO', 'WARNING', 'ERROR']
+
+
+def mb(value):
+    return "?" if value is None else f"{value / 1_048_576:.1f} MB"
+
+
+class Admin(commands.Cog):
+    """Operator-only diagnostics."""
+
+    debug = app_commands.Group(
+        name="debug",
+        description="Diagnostics for bot operators (Admin only)",
+        default_permissions=discord.Permissions(administrator=True),
+        guild_only=True
+    )
+
+    def __init__(self, bot):
+        self.bot = bot
+
+    @debug.command(name="logging", description="Turn detailed logging on or off for this server")
+    @app_commands.describe(enabled="Log DEBUG detail for this server only")
+    async def debug_logging(self, interaction: discord.Interaction, enabled: bool):
+        """Toggles per-guild DEBUG logging."""
+        set_guild_debug(interaction.guild.id, enabled)
+        log.info("Guild debug logging %s", "enabled" if enabled else "disabled",
+                 extra={'guild_id': interaction.guild.id, 'user_id': interaction.user.id})
+
+        embed = discord.Embed(
+            title="🪵 Debug Logging",
+            description=f"Detailed logging is now **{'on' if guild_debug_enabled(interaction.guild.id) else 'off'}** for this server.",
+            color=discord.Color.dark_gray()
+        )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
+    @debug.command(name="level", description="Change the log level of a subsystem")
+    @app_commands.describe(subsystem="Logger name, e.g. music, music.player, ytdl, discord", level="New level")
+    @app_commands.choices(level=[app_commands.Choice(name=name, value=name) for name in LEVELS])
+    async def debug_level(self, interaction: discord.Interaction, subsystem: str, level: app_commands.Choice[str]):
+        """Sets a subsystem's log level for the whole process."""
+        set_level(subsystem, level.value)
+        log.warning("Log level of %s set to %s", subsystem, level.value,
+                    extra={'guild_id': interaction.guild.id, 'user_id': interaction.user.id})
+        effective = logging.getLevelName(logging.getLogger(subsystem).getEffectiveLevel())
+        await interaction.response.send_message(f"✅ `{subsystem}` now logs at **{effective}**", ephemeral=True)
+
+    @debug.command(name="ratelimits", description="Show REST usage per rate-limit bucket")
+    async def debug_ratelimits(self, interaction: discord.Interaction):
+        """Shows how much of each message bucket the bot is using."""
+        snapshot = messages.stats.snapshot()
+        embed = discord.Embed(title="🚦 Rate Limit Buckets", color=discord.Color.dark_gray())
+
+        if snapshot:
+            busiest = sorted(snapshot.items(), key=lambda item: item[1][0], reverse=True)[:15]
+            lines = [f"`{bucket}` • {window}/min • {sent} sent • {dropped} merged"
+                     for bucket, (window, sent, dropped) in busiest]
+            embed.add_field(name="📨 Our Calls", value="\n".join(lines), inline=False)
+        else:
+            embed.description = "No messages sent yet."
+
+        limited = f"**{messages.stats.rate_limited}** 429 responses"
+        if messages.stats.rate_limited_routes:
+            top = sorted(messages.stats.rate_limited_routes.items(), key=lambda item: item[1], reverse=True)[:5]
+            limited += "\n" + "\n".join(f"`{route}` • {count}" for route, count in top)
+        embed.add_field(name="⛔ Rate Limited", value=limited, inline=False)
+
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
+    @debug.command(name="extractor", description="Show the YouTube circuit breaker and negative cache")
+    async def debug_extractor(self, interaction: discord.Interaction):
+        """Shows whether extractor calls are paused and how many videos are known to fail."""
+        # The guard that matters lives in the media daemon when one is configured
+        status = await media.status()
+        state = status['state']
+        if state == 'open':
+            state += f" (retry in {int(status['retry_after'])}s)"
+
+        embed = discord.Embed(title="🧯 Extractor", color=discord.Color.dark_gray())
+        embed.add_field(name="Circuit Breaker", value=f"**{state}** • {status['error_rate']:.0%} errors • {status['trips']} trips", inline=False)
+        embed.add_field(name="Negative Cache", value=f"{status['negative']} videos • {status['negative_hits']} instant answers", inline=False)
+
+        where = {True: "media daemon", False: "in process", None: "in process (daemon unreachable)"}[status['daemon']]
+        embed.add_field(
+            name="Pipeline",
+            value=f"{where} • {status['downloads']} downloads • {status['extractions']} lookups • {status['joined']} shared",
+            inline=False
+        )
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
+    @debug.command(name="budget", description="Show live audio pipelines and CPU admission control")
+    async def debug_budget(self, interaction: discord.Interaction):
+        """Shows ffmpeg slots, measured CPU and how often songs waited, played degraded or were refused."""
+        status = budget.status()
+        embed = discord.Embed(title="🎛️ Audio Budget", color=discord.Color.dark_gray())
+
+        embed.add_field(
+            name="Pipelines",
+            value=f"**{status['ffmpeg']}/{status['max_ffmpeg']}** ffmpeg for {status['ffmpeg_guilds']} servers"
+                  f" • {status['opus']} Opus passthrough • {status['degraded']} degraded • {status['queued']} waiting",
+            inline=False
+        )
+
+        shared = broadcast.status()
+        if shared['enabled']:
+            embed.add_field(
+                name="Shared Encodes",
+                value=f"{shared['feeds']} feeds for {shared['listeners']} servers • {mb(shared['buffered'])} buffered"
+                      f" • {shared['joined']} joined of {shared['joined'] + shared['started']} started",
+                inline=False
+            )
+        else:
+            embed.add_field(name="Shared Encodes", value="off (BROADCAST=0, or libopus missing)", inline=False)
+
+        if status['usage'] is None:
+            cpu = f"not measurable here • limit {status['limit']:.2f} cores"
+        else:
+            cpu = (f"**{status['usage']:.2f}** of {status['limit']:.2f} cores (budget {status['budget']:.2f})"
+                   f" • peak {status['peak']:.2f} • ~{status['stream_cost']:.3f} per ffmpeg song")
+        embed.add_field(name="CPU", value=cpu, inline=False)
+
+        counts = status['counts']
+        embed.add_field(
+            name="Admission",
+            value=f"{counts['play']} played • {counts['waited']} waited ({status['waited_seconds']:.0f}s total)"
+                  f" • {counts['degraded']} degraded • {counts['busy']} refused",
+            inline=False
+        )
+
+        if status['streams']:
+            lines = [f"`{guild_id}` • {kind} • {usage:.3f} cores{' • degraded' if degraded else ''}"
+                     for guild_id, kind, usage, degraded in status['streams'][:10]]
+            embed.add_field(name="Busiest Streams", value="\n".join(lines), inline=False)
+
+        await interaction.response.send_message(embed=embed, ephemeral=True)
+
+    @debug.command(name="memory", description="Show memory use per subsystem, or trace allocations")
+    @app_commands.describe(action="overview (default), snapshot to trace top allocators, stop to end tracing")
+    @app_commands.choices(action=[app_commands.Choice(name=name, value=name) for name in ('overview', 'snapshot', 'stop')])
+    async def debug_memory(self, interaction: discord.Interaction, action: app_commands.Choice[str] = None):
+        """Shows memory use against the limits, per-subsystem accounting and tracemalloc snapshots."""
+        action = action.value if action else 'overview'
+        embed = discord.Embed(title="🧠 Memory", color=discord.Color.dark_gray())
+
+        if action == 'snapshot':
+            await interaction.response.defer(ephemeral=True)
+            # Snapshots of a large heap take a moment; keep them off the event loop
+            top, growth, traced = await self.bot.loop.run_in_executor(None, memory_guard.take_snapshot)
+            embed.description = f"Tracing **{mb(traced)}** allocated since tracing started"
+            if top:
+                embed.add_field(name="Top Allocators", inline=False, value="\n".join(
+                    f"`{where}` • {mb(size)} • {count} blocks" for where, size, count in top
+                ))
+            if growth:
+                embed.add_field(name="Grown Since Last Snapshot", inline=False, value="\n".join(
+                    f"`{where}` • +{mb(size)} • {count:+d} blocks" for where, size, count in growth
+                ))
+            embed.set_footer(text="Tracing slows allocations down; /debug memory stop when done")
+            return await interaction.followup.send(embed=embed, ephemeral=True)
+
+        if action == 'stop':
+            memory_guard.stop_tracing()
+            return await interaction.response.send_message("✅ Allocation tracing stopped", ephemeral=True)
+
+        await interaction.response.defer(ephemeral=True)
+        status = memory_guard.status()
+        # Size walks over the index, history and queues would stall the event loop
+        accounts = await self.bot.loop.run_in_executor(None, memory_guard.measure)
+        state = "**shedding caches**" if status['shedding'] else "ok"
+        embed.add_field(
+            name="Usage",
+            value=f"{mb(status['working_set'] if status['working_set'] is not None else status['rss'])} in use"
+                  f" • RSS {mb(status['rss'])} • peak {mb(status['peak'])}\n"
+                  f"Soft limit {mb(status['soft_limit'])} • limit {mb(status['limit'])} • {state} ({status['sheds']} sheds)",
+            inline=False
+        )
+
+        lines = [f"`{name}` • {'?' if items is None else items} • "
+                 f"{'-' if size is None else ('' if complete else '≥ ') + mb(size)}"
+                 for name, (items, size, complete) in accounts.items()]
+        if lines:
+            embed.add_field(name="Subsystems (items • approx. size)", value="\n".join(lines), inline=False)
+        notes = []
+        if not all(complete for _, _, complete in accounts.values()):
+            notes.append("≥: too large to walk completely, at least this much")
+
+        tasks = "\n".join(f"`{name}` • {count}" for name, count in status['tasks'])
+        embed.add_field(name="Running Tasks", value=tasks or "none", inline=False)
+        if status['tracing']:
+            notes.append("Allocation tracing is on")
+        if notes:
+            embed.set_footer(text=" • ".join(notes))
+        await interaction.followup.send(embed=embed, ephemeral=True)
+
+async def setup(bot):
+    await bot.add_cog(Admin(bot))
@@ -41,8 +41,10 @@ class Help(commands.Cog):
             # Playback Controls
             playback_cmds = [
                 ("play", "Play a song from YouTube (URL or search)"),
+                ("playmany", "Queue several songs at once (separate with |)"),
                 ("pause", "Pause the current song"),
                 ("resume", "Resume playback"),
+                ("seek", "Jump to a time in the song (1:30, +15, -15)"),
                 ("skip", "Skip to the next song"),
                 ("stop", "Stop playback and clear the queue")
             ]
@@ -52,6 +54,9 @@ class Help(commands.Cog):
             # Queue Management
             queue_cmds = [
                 ("queue", "View the current song queue"),
+                ("remove", "Remove a song from the queue"),
+                ("move", "Move a song to another position in the queue"),
+                ("shuffle", "Shuffle the queue"),
                 ("cache", "View cache statistics and recent downloads")
             ]
             queue_text = "\n".join([f"`/{cmd}` - {desc}" for cmd, desc in queue_cmds])
@@ -60,6 +65,7 @@ class Help(commands.Cog):
             # Utility
             utility_cmds = [
                 ("sync", "Sync commands to the server (Admin only)"),
+                ("debug", "Logging and diagnostics for operators (Admin only)"),
                 ("help", "Show this help message")
             ]
             utility_text = "\n".join([f"`/{cmd}` - {desc}" for cmd, desc in utility_cmds])
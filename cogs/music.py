@@ -2,39 +2,34 @@ import discord
 from discord import app_commands, ui
 from discord.ext import commands
 import asyncio
-import yt_dlp
 import os
 import json
-import re
 import random
 import time
-
-# YouTube DL options
-ytdl_format_options = {
-    'format': 'bestaudio/best',
-    'outtmpl': 'songs/%(id)s.%(ext)s',
-    'writeinfojson': True,
-    'restrictfilenames': True,
-    'noplaylist': True,
-    'nocheckcertificate': True,
-    'ignoreerrors': False,
-    'logtostderr': False,
-    'quiet': False,
-    'no_warnings': False,
-    'default_search': 'auto',
-    'source_address': '0.0.0.0',
-    'cookiefile': os.getenv('COOKIES_FILE_PATH', '/app/cookies.txt'),
-    'verbose': True,
-    'extractor_args': {
-        'youtube': {
-            'player_client': ['tv']
-        }
-    },
-    'js_runtimes': {
-        'node': {}
-    },
-    'remote_components': ['ejs:github']
-}
+import itertools
+from collections import Counter
+from utils.log import get_logger
+from utils.track_queue import TrackQueue
+from utils.track import Track, load_info
+from utils.presence import PresenceManager
+from utils.messages import InteractionStatus, ChannelPublisher, PRIORITY_STATUS, install_rate_limit_counter
+from utils.history import PlayHistory, HISTORY_FLUSH_INTERVAL
+from utils.warmer import CacheWarmer
+from utils.search_index import SearchIndex, MAX_CHOICES
+from utils.hot_cache import HotCache
+from utils.opus_source import OpusFileSource, NotDemuxable, load_seek_index, OPUS_PASSTHROUGH
+from utils.budget import budget, BUSY, DEGRADED, DEGRADED_BITRATE
+from utils.broadcast import broadcast, BroadcastSource
+from utils.trace import trace
+from utils.memory import memory_guard, approx_size
+from utils.restart import (RestartReport, read_checkpoint, write_checkpoint, VOICE_DISCONNECT_TIMEOUT,
+                           RESTART_REPORT_AFTER, RESTARTING_MESSAGE)
+from utils.extract_guard import guard as extractor_guard, Unplayable, ExtractorUnavailable
+from utils.ytdl import ytdl_flat, shed_caches as shed_ytdl_caches
+from utils.media import media, collect_partials, extract_video_id, is_playlist_url, split_queries, MEDIAD_URL, MAX_DURATION
+from utils import storage
+
+log = get_logger('music')
 
 ffmpeg_options_stream = {
     'options': '-vn',
@@ -45,20 +40,232 @@ ffmpeg_options_local = {
     'options': '-vn'
 }
 
-ytdl = yt_dlp.YoutubeDL(ytdl_format_options)
-
-class YTDLSource(discord.PCMVolumeTransformer):
-    def __init__(self, source, *, data, volume=0.5, is_cached=False):
-        super().__init__(source, volume)
-        self.data = data
-        self.title = data.get('title')
-        self.url = data.get('url')
-        self.thumbnail = data.get('thumbnail')
-        self.duration = data.get('duration')
-        self.uploader = data.get('uploader')
-        self.requested_by = data.get('requested_by')
+# Playlist ingestion: max tracks taken from one playlist, and entries fetched per batch
+MAX_PLAYLIST_TRACKS = int(os.getenv('MAX_PLAYLIST_TRACKS', '500'))
+PLAYLIST_BATCH_SIZE = 25
+
+# Placeholders this close to the head of the queue get resolved ahead of time
+PREFETCH_DEPTH = int(os.getenv('PREFETCH_DEPTH', '3'))
+
+# Max concurrent full extractions for placeholders, across all guilds
+RESOLVE_CONCURRENCY = int(os.getenv('RESOLVE_CONCURRENCY', '3'))
+
+# Voice channels reconnected at once when restoring saved queues on startup
+RESTORE_CONCURRENCY = int(os.getenv('RESTORE_CONCURRENCY', '5'))
+
+# Seconds a song can stay paused before its ffmpeg process / file mapping is released
+PAUSE_RELEASE_AFTER = int(os.getenv('PAUSE_RELEASE_AFTER', '60'))
+
+# /playmany: max songs per command and concurrent lookups per command
+BULK_MAX_TRACKS = 25
+BULK_CONCURRENCY = int(os.getenv('BULK_CONCURRENCY', '4'))
+
+# Hot tier: upcoming songs per guild kept in memory, how often (seconds) the hot set is
+# checked for changes, and how many of the most played songs compete for the remaining room
+HOT_QUEUE_DEPTH = int(os.getenv('HOT_QUEUE_DEPTH', '2'))
+HOT_REBALANCE_INTERVAL = 2
+HOT_POPULAR_COUNT = 20
+HOT_POPULAR_INTERVAL = 300
+
+# Songs per /queue page
+QUEUE_PAGE_SIZE = 15
+
+def too_long_message(duration):
+    return f"❌ **Song Too Long**: This video is {int(duration//60)}m {int(duration%60):02d}s, but the limit is 10 minutes. Please choose a shorter song."
+
+def parse_position(text, current=0):
+    """Seconds for '1:30', '90' or '1:02:03', or relative to `current` for '+15' / '-15'. None if unreadable."""
+    text = text.strip()
+    sign = {'+': 1, '-': -1}.get(text[:1])
+    parts = (text[1:] if sign else text).split(':')
+    if not 1 <= len(parts) <= 3 or not all(part.strip().isdigit() for part in parts):
+        return None
+    seconds = 0
+    for part in parts:
+        seconds = seconds * 60 + int(part)
+    return current + sign * seconds if sign else seconds
+
+def ffmpeg_source(filename, *, stream=False, seek_offset=0, track_id=None):
+    """FFmpeg PCM output for a file or stream URL, starting `seek_offset` seconds in."""
+    options = ffmpeg_options_stream.copy() if stream else ffmpeg_options_local.copy()
+    
+    # Apply seek if resuming from a position
+    if seek_offset > 0:
+        before_opts = options.get('before_options', '')
+        if before_opts:
+            before_opts += f" -ss {seek_offset:.2f}"
+        else:
+            before_opts = f"-ss {seek_offset:.2f}"
+        options['before_options'] = before_opts
+        log.debug("Applied seek offset %.2f seconds to FFmpeg options", seek_offset, extra={'track_id': track_id})
+    
+    return discord.FFmpegPCMAudio(filename, **options)
+
+def playable_path(track, filename, stream=False):
+    """`filename`, or the track's disk copy if it was a hot tier copy that has been demoted since."""
+    if stream or os.path.exists(filename):
+        return filename
+    return track.cached_path() or filename
+
+def pipeline_kind(track, volume=1.0):
+    """'opus' for cached songs create_from_track() will likely pass through, else 'ffmpeg'."""
+    return 'opus' if OPUS_PASSTHROUGH and volume == 1.0 and track.ext in ('webm', 'opus', 'ogg') else 'ffmpeg'
+
+class YTDLSource(discord.AudioSource):
+    """A track being played, wrapping ffmpeg PCM output, passed-through Opus packets or a shared feed.
+
+    Opus packets are sent as encoded, so files are only passed through at
+    unity volume (the default) and every path plays at the same level.
+    A shared feed (BroadcastSource) is one ffmpeg decode and Opus encode that
+    every guild playing the track in step reads from. The playback position
+    is counted from what was actually sent: packet timestamps for Opus and
+    shared feeds, 20 ms per frame read for ffmpeg.
+    """
+
+    def __init__(self, source, *, track, volume=1.0, is_cached=False, filename=None, stream=False, start=0):
+        self.original = source
+        self._pcm = None if source.is_opus() else discord.PCMVolumeTransformer(source, volume)
+        self.track = track
+        self.title = track.title
+        self.thumbnail = track.thumbnail
+        self.duration = track.duration
+        self.uploader = track.uploader
+        self.requested_by = track.requested_by
         self.is_cached = is_cached
-        self.webpage_url = data.get('webpage_url')
+        self.webpage_url = track.webpage_url
+        self.filename = filename
+        self.stream = stream
+        self.start = start   # seconds; where the ffmpeg frame count starts
+        self.frames = 0
+        self._volume = volume  # the player's volume, kept for Opus that falls back to ffmpeg on reopen()
+        self.released = False  # inner source freed during a long pause, see release()
+
+    @property
+    def shared(self):
+        return isinstance(self.original, BroadcastSource)
+
+    @property
+    def kind(self):
+        """'opus' for passed-through files, else 'ffmpeg' (shared feeds included)."""
+        return 'opus' if self._pcm is None and not self.shared else 'ffmpeg'
+
+    @property
+    def volume(self):
+        if self.shared:
+            return self.original.volume
+        return self._pcm.volume if self._pcm else 1.0
+
+    @volume.setter
+    def volume(self, value):
+        self._volume = value
+        if self.shared:
+            # Another volume is another feed
+            self.original.set_volume(value)
+        elif self._pcm:
+            self._pcm.volume = value
+
+    @property
+    def position(self):
+        """Seconds into the track of the audio sent last."""
+        if self.released:
+            return self.start
+        if self._pcm is None:
+            return self.original.position_ms / 1000
+        return self.start + self.frames * 0.02
+
+    @property
+    def pid(self):
+        """The ffmpeg process id (a shared feed's, for every guild on it); None for passed-through Opus and released sources."""
+        if self.released:
+            return None
+        if self.shared:
+            return self.original.pid
+        if self._pcm is None:
+            return None
+        process = getattr(self.original, '_process', None)
+        return getattr(process, 'pid', None)
+
+    def read(self):
+        data = (self._pcm or self.original).read()
+        if data:
+            self.frames += 1
+        return data
+
+    def seek(self, seconds):
+        """Jumps to `seconds` while playing.
+
+        Opus files jump to the packet through their seek index; the ffmpeg
+        path needs a new ffmpeg process, swapped in once it has started.
+        """
+        seconds = max(0.0, seconds)
+        if self.duration:
+            seconds = min(seconds, max(0.0, self.duration - 1))
+        if self.released:
+            # Nothing to move while released; reopen() starts here
+            self.start = seconds
+            return seconds
+        if self._pcm is None:
+            self.original.seek(seconds)
+            return seconds
+
+        old = self.original
+        # The hot tier may have dropped the file this song started from
+        self.filename = playable_path(self.track, self.filename, self.stream)
+        source = ffmpeg_source(self.filename, stream=self.stream, seek_offset=seconds, track_id=self.track.id)
+        self.original = source
+        self._pcm = discord.PCMVolumeTransformer(source, self._pcm.volume)
+        self.start, self.frames = seconds, 0
+        # The player thread may be in the middle of a read from the old process
+        asyncio.get_running_loop().call_later(1, old.cleanup)
+        return seconds
+
+    def release(self):
+        """Frees the ffmpeg process or file mapping of a paused track, keeping its position.
+
+        Only call while the voice client is paused (nothing reads); reopen()
+        continues from the exact same packet or frame.
+        """
+        if self.released:
+            return
+        if self._pcm is None and self.frames:
+            # Shared feeds count packets like Opus files
+            # Continue with the packet after the one sent last
+            self.start = (self.original.position_ms + 20) / 1000
+        else:
+            self.start = self.position
+        self.original.cleanup()
+        self.released = True
+
+    def reopen(self):
+        """Recreates the inner source released by release(), at the recorded position."""
+        if not self.released:
+            return
+        # A hot tier copy may have been demoted meanwhile
+        self.filename = playable_path(self.track, self.filename, self.stream)
+        if self.shared:
+            # Joins whichever feed is at this position, starting one if none is
+            self.original.move(self.start)
+            self.released = False
+            return
+        if self._pcm is None:
+            try:
+                self.original = OpusFileSource(self.filename, start=self.start, index=self.original.index)
+                self.released = False
+                return
+            except (NotDemuxable, OSError) as e:
+                log.debug("Falling back to FFmpeg for %s: %s", self.filename, e, extra={'track_id': self.track.id})
+        volume = self._pcm.volume if self._pcm else self._volume
+        self.original = ffmpeg_source(self.filename, stream=self.stream, seek_offset=self.start, track_id=self.track.id)
+        self._pcm = discord.PCMVolumeTransformer(self.original, volume)
+        self.frames = 0
+        self.released = False
+
+    def is_opus(self):
+        return self.original.is_opus()
+
+    def cleanup(self):
+        if not self.released:
+            self.original.cleanup()
 
     @classmethod
     async def from_url(cls, url, *, loop=None, stream=False):
@@ -66,61 +273,147 @@ class YTDLSource(discord.PCMVolumeTransformer):
         # Useful for the player loop if it encounters a raw string
         loop = loop or asyncio.get_event_loop()
         data = await cls.get_info(url, loop=loop, stream=stream)
-        return cls.create_from_data(data, stream=stream)
+        return cls.create_from_track(Track.from_info(data), stream_url=data['url'] if stream else None)
 
     @classmethod
     async def get_info(cls, url, *, loop=None, stream=False):
-        loop = loop or asyncio.get_event_loop()
-        data = await loop.run_in_executor(None, lambda: ytdl.extract_info(url, download=not stream))
+        """Extracts a video's metadata (downloading it unless `stream`), via the media backend.
 
-        if 'entries' in data:
-            # take first item from a playlist
-            data = data['entries'][0]
-        return data
+        Raises Unplayable straight away for videos that recently failed or were
+        too long, and ExtractorUnavailable while YouTube is throttling us.
+        """
+        if stream:
+            return await media.extract(url)
+        return await media.download(extract_video_id(url), url)
 
     @classmethod
-    def create_from_data(cls, data, stream=False, is_cached=False, seek_offset=0):
+    def create_from_track(cls, track, stream_url=None, path=None, is_cached=False, seek_offset=0, volume=1.0, bitrate=None):
+        """Builds the audio source for a track: `stream_url` when given, else `path` or the cached file.
+
+        Songs that need ffmpeg go through a shared feed when broadcasting is on;
+        `bitrate` (kbps) is what the feed encodes at, None for the default.
+        """
         # Max length check (10 minutes = 600 seconds)
-        duration = data.get('duration')
-        if duration and duration > 600:
-            raise ValueError(f"❌ **Song Too Long**: This video is {int(duration//60)}m {int(duration%60)}s, but the limit is 10 minutes. Please choose a shorter song.")
+        duration = track.duration
+        if duration and duration > MAX_DURATION:
+            raise ValueError(too_long_message(duration))
 
-        filename = data['url'] if stream else ytdl.prepare_filename(data)
-        options = ffmpeg_options_stream.copy() if stream else ffmpeg_options_local.copy()
-        
-        # Apply seek if resuming from a position
-        if seek_offset > 0:
-            before_opts = options.get('before_options', '')
-            if before_opts:
-                before_opts += f" -ss {int(seek_offset)}"
-            else:
-                before_opts = f"-ss {int(seek_offset)}"
-            options['before_options'] = before_opts
-            print(f"DEBUG: Applied seek offset {int(seek_offset)} seconds to FFmpeg options", flush=True)
-        
-        return cls(discord.FFmpegPCMAudio(filename, **options), data=data, is_cached=is_cached)
+        stream = stream_url is not None
+        filename = stream_url if stream else (path or track.cached_path() or storage.audio_path(track.id, track.ext))
+
+        # Cached Opus files are demuxed in process, without an ffmpeg subprocess. Their packets
+        # can't be scaled, so any other volume goes through ffmpeg like every other song
+        if not stream and OPUS_PASSTHROUGH and volume == 1.0:
+            try:
+                index = load_seek_index(storage.seek_path(track.id), filename)
+                source = OpusFileSource(filename, start=seek_offset, index=index)
+                return cls(source, track=track, volume=volume, is_cached=is_cached, filename=filename, start=seek_offset)
+            except (NotDemuxable, OSError) as e:
+                log.debug("Falling back to FFmpeg for %s: %s", filename, e, extra={'track_id': track.id})
+
+        # Shared feeds open ffmpeg again on seeks and rejoins, by then the hot copy may be gone
+        opener = lambda start: ffmpeg_source(playable_path(track, filename, stream), stream=stream,
+                                             seek_offset=start, track_id=track.id)
+        source = broadcast.open(track.id, opener, seek_offset, volume, bitrate)
+        if source is not None:
+            return cls(source, track=track, volume=volume, is_cached=is_cached, filename=filename, stream=stream, start=seek_offset)
+
+        source = opener(seek_offset)
+        return cls(source, track=track, volume=volume, is_cached=is_cached, filename=filename, stream=stream, start=seek_offset)
 
 class MusicPlayer:
     def __init__(self, bot, guild, channel):
         self.bot = bot
         self.guild = guild
         self.channel = channel
-        self.queue = asyncio.Queue()
+        self.queue = TrackQueue()
         self.next = asyncio.Event()
 
-        self.np = None  # Now playing message
-        self.volume = .5
+        self.volume = 1.0  # Unity gain, the level passed-through Opus plays at
         self.current = None
-        self.playback_start_time = None  # Track when playback started
         self.seek_position = 0  # Position to seek to when resuming (in seconds)
+        self.release_timer = None  # Frees the paused source's resources, see pause()
+        self.log = get_logger('music.player', guild_id=guild.id)
+
+        # Rendered /queue pages, valid while queue_pages_key matches
+        self.queue_pages = {}
+        self.queue_pages_key = None
+
+        # Placeholder resolutions in flight, keyed by id() of the queued Track
+        self.resolving = {}
+
+        self.task = self.bot.loop.create_task(self.player_loop())
+
+    def pause(self):
+        """Pauses playback; the source's resources are released if it stays paused long enough."""
+        self.guild.voice_client.pause()
+        if self.release_timer:
+            self.release_timer.cancel()
+        source = self.current
+        self.release_timer = self.bot.loop.call_later(PAUSE_RELEASE_AFTER, self.release_paused, source)
+
+    def release_paused(self, source):
+        self.release_timer = None
+        vc = self.guild.voice_client
+        if source is not None and source is self.current and vc and vc.is_paused():
+            source.release()
+            self.log.debug("Released paused source at %.1f seconds", source.position)
+
+    def resume(self):
+        """Resumes playback, reopening a released source at the exact paused position."""
+        if self.release_timer:
+            self.release_timer.cancel()
+            self.release_timer = None
+        if self.current is not None and self.current.released:
+            self.current.reopen()
+            self.log.debug("Reopened source at %.1f seconds", self.current.position)
+        self.guild.voice_client.resume()
+
+    def prefetch(self):
+        """Starts resolving playlist placeholders that are close to playing."""
+        if memory_guard.shedding:
+            # Entries still resolve when they come up, just not ahead of time
+            return
+        for item in self.queue.slice(0, PREFETCH_DEPTH):
+            if item.placeholder and id(item) not in self.resolving:
+                self.resolving[id(item)] = self.bot.loop.create_task(self.resolve(item))
+
+    async def resolve(self, item):
+        """Replaces a placeholder with full metadata and starts its download.
+
+        Returns the resolved Track, or None if the entry is unplayable (it is
+        then dropped from the queue).
+        """
+        cog = self.bot.get_cog("Music")
+        track_log = self.log.bind(track_id=item.id)
+        data = None
+        try:
+            async with cog.resolve_slots:
+                data = await YTDLSource.get_info(item.webpage_url, loop=self.bot.loop, stream=True)
+        except Exception as e:
+            track_log.warning("Failed to resolve playlist entry %s: %s", item.title, e)
+        finally:
+            self.resolving.pop(id(item), None)
+
+        duration = data.get('duration') if data else None
+        if data is None or (duration and duration > MAX_DURATION):
+            self.queue.remove(item)
+            return None
 
-        self.bot.loop.create_task(self.player_loop())
+        track = Track.from_info(data, requested_by=item.requested_by)
+        self.queue.replace(item, track)
+        if not track.cached_path():
+            cog.download(track, track_log)
+        return track
 
     async def player_loop(self):
         await self.bot.wait_until_ready()
 
         while not self.bot.is_closed():
             self.next.clear()
+            # The previous song's audio pipeline (or a failed attempt's reservation) is done
+            budget.release(self.guild.id)
+            admission = None
 
             try:
                 # Wait for the next song. If we timeout cancel the player and disconnect...
@@ -129,63 +422,87 @@ class MusicPlayer:
             except asyncio.TimeoutError:
                 return self.destroy(self.guild)
 
-            if isinstance(source, dict):
-                # It's pre-fetched data
+            # Keep the next few playlist entries resolving while this one plays
+            self.prefetch()
+
+            if isinstance(source, Track) and source.placeholder:
+                # Playlist entry that hasn't been resolved yet, finish that first
+                task = self.resolving.get(id(source)) or self.bot.loop.create_task(self.resolve(source))
+                source = await task
+                if source is None:
+                    continue
+
+            if isinstance(source, Track):
                 try:
-                    # Check if we need to download (Cache Logic)
-                    filename = ytdl.prepare_filename(source)
-                    is_cached = os.path.exists(filename)
+                    # Check if we need to download (Cache Logic); the hot tier is tried before the disk
+                    hot_path = self.bot.get_cog("Music").hot_cache.lookup(source.id)
+                    is_cached = hot_path is not None or source.cached_path() is not None
                     
                     if not is_cached:
-                        # Cleanup cache if needed
-                        self.bot.get_cog("Music").cleanup_cache()
-                        
-                        # Download
-                        await self.bot.loop.run_in_executor(None, lambda: ytdl.extract_info(source['webpage_url'], download=True))
+                        # Download (joins a background download of the same song if one is running,
+                        # and resumes from a partial file if an earlier attempt was interrupted)
+                        await self.bot.get_cog("Music").download(source, self.log.bind(track_id=source.id))
+
+                    # ffmpeg songs need a slot in the global audio budget, and wait in line for one;
+                    # joining a feed another guild already decodes costs none
+                    kind = pipeline_kind(source, self.volume)
+                    if kind == 'ffmpeg' and broadcast.joinable(source.id, self.seek_position, self.volume):
+                        kind = 'shared'
+                    if kind == 'ffmpeg' and budget.decide() == BUSY:
+                        self.bot.get_cog("Music").messages.send(self.channel, content=f"⏳ The bot is at capacity, **{source.title or 'Unknown'}** starts as soon as an audio slot frees up...")
+                    admission = await budget.acquire(self.guild.id, kind)
+                    if admission == BUSY:
+                        self.bot.get_cog("Music").messages.send(self.channel, content=f"🚦 The bot is too busy to play **{source.title or 'Unknown'}** right now, skipped it. Try again in a few minutes.")
+                        continue
                     
-                    # Create source from local file (stream=False), applying seek if resuming
-                    source = YTDLSource.create_from_data(source, stream=False, is_cached=is_cached, seek_offset=self.seek_position)
+                    # Create source from the local file, applying seek if resuming
+                    bitrate = DEGRADED_BITRATE if admission == DEGRADED else None
+                    source = YTDLSource.create_from_track(source, path=hot_path, is_cached=is_cached, seek_offset=self.seek_position,
+                                                          volume=self.volume, bitrate=bitrate)
                     # Reset seek position after applying
                     if self.seek_position > 0:
-                        print(f"DEBUG: Resumed from {self.seek_position} seconds", flush=True)
+                        self.log.info("Resumed from %s seconds", self.seek_position)
                         self.seek_position = 0
                 except ValueError as e:
-                    await self.channel.send(f"{e}")
+                    self.bot.get_cog("Music").messages.send(self.channel, content=f"{e}")
+                    continue
+                except (Unplayable, ExtractorUnavailable) as e:
+                    self.bot.get_cog("Music").messages.send(self.channel, content=f"❌ Skipping **{source.title or 'Unknown'}**: {e}")
                     continue
                 except Exception as e:
-                    print(f"Error converting data: {e}", flush=True)
-                    await self.channel.send(f'Error creating audio source: {e}')
+                    self.log.exception("Error converting data: %s", e)
+                    self.bot.get_cog("Music").messages.send(self.channel, content=f'Error creating audio source: {e}')
                     continue
             
             # Now we have a YTDLSource object
             self.current = source
 
-            print(f"DEBUG: source type: {type(source)}", flush=True)
-            if hasattr(source, 'title'):
-                print(f"DEBUG: source.title: {source.title}", flush=True)
-
-            # YTDLSource is already a PCMVolumeTransformer, we can use it directly
-            # But we need to apply volume
+            # Passed-through Opus is only used at unity volume, see create_from_track()
             source.volume = self.volume
 
             try:
-                print(f"DEBUG: Playing {source.title}", flush=True)
+                track_log = self.log.bind(track_id=source.track.id)
+                track_log.info("Playing %s", source.title)
                 
                 def after_callback(error):
                     if error:
-                        print(f"DEBUG: Player error: {error}", flush=True)
-                    print("DEBUG: Song finished/stopped, triggering next...", flush=True)
+                        track_log.error("Player error: %s", error)
+                    track_log.debug("Song finished/stopped, triggering next...")
                     self.bot.loop.call_soon_threadsafe(self.next.set)
 
-                # Track when playback starts
-                self.playback_start_time = time.time()
-                
-                self.guild.voice_client.play(source, after=after_callback)
-                
-                # Set bot status to "Listening to [Song Name]"
-                await self.bot.change_presence(activity=discord.Activity(type=discord.ActivityType.listening, name=source.title))
+                # Over the CPU budget, the Opus encoder runs at a lower bitrate (passed-through Opus isn't
+                # encoded, and a shared feed was already created at that bitrate)
+                degraded = admission == DEGRADED and source.kind == 'ffmpeg'
+                encoder = {'bitrate': DEGRADED_BITRATE} if degraded and not source.shared else {}
+                self.guild.voice_client.play(source, after=after_callback, **encoder)
+                budget.attach(self.guild.id, source)
+                self.bot.get_cog("Music").audio_started(self.guild.id)
                 
-                # Save state AFTER playback has started (so playback_start_time is set)
+                # Report the song; the presence manager decides what the bot shows
+                self.bot.get_cog("Music").presence.track_started(self.guild.id, source.title)
+
+                # Play history feeds the background cache warmer
+                self.bot.get_cog("Music").history.record(self.guild.id, source.track)
                 
                 # Create Embed for Now Playing (Purple, Large Image)
                 embed = discord.Embed(title="Now Playing", description=f"[{source.title}]({source.webpage_url})", color=discord.Color.purple())
@@ -202,53 +519,62 @@ class MusicPlayer:
                 
                 if source.requested_by:
                     embed.add_field(name="Requested By", value=source.requested_by, inline=True)
+
+                if degraded:
+                    embed.add_field(name="Quality", value=f"🔉 Reduced to {DEGRADED_BITRATE} kbps (bot busy)", inline=True)
                 
                 # Check if this is a resumed playback after bot restart
                 # Only show footer if we actually resumed from a position (not just started from beginning)
                 show_resumed_footer = False
                 if hasattr(self, '_resumed_from_state') and self._resumed_from_state:
                     # Check if this song had a resume position marker
-                    if isinstance(source, YTDLSource) and hasattr(source, 'data'):
-                        if '_resume_position' in source.data and source.data['_resume_position'] > 0:
-                            show_resumed_footer = True
+                    if isinstance(source, YTDLSource) and source.track.resume_position > 0:
+                        show_resumed_footer = True
                     # Clear the flag after first song (whether resumed or not)
                     self._resumed_from_state = False
                 
                 if show_resumed_footer:
-                    resume_pos = source.data['_resume_position']
+                    resume_pos = source.track.resume_position
                     mins = int(resume_pos // 60)
                     secs = int(resume_pos % 60)
                     embed.set_footer(text=f"🔄 Resumed after bot restart at {mins}:{secs:02d}", icon_url=None)
                 
-                self.np = await self.channel.send(embed=embed)
+                # Only the newest now-playing embed is sent if several are waiting on the rate limit
+                view = NowPlayingView(self.bot.get_cog("Music"), self.guild.id, source.track.id, timeout=(source.duration or 600) + 60)
+                self.bot.get_cog("Music").messages.send(self.channel, embed=embed, view=view, key='now_playing')
                 
                 # Start periodic state saving (every 10 seconds during playback)
                 async def periodic_save():
                     await asyncio.sleep(10)  # Wait 10 seconds before first save
-                    while self.guild.voice_client and self.guild.voice_client.is_playing():
-                        self.bot.get_cog("Music").save_state()
+                    # Runs for as long as this song is current; a paused song's position doesn't change
+                    while self.current is source and self.guild.voice_client:
+                        if self.guild.voice_client.is_playing():
+                            self.bot.get_cog("Music").save_state()
                         await asyncio.sleep(10)  # Save every 10 seconds
                 
                 self.bot.loop.create_task(periodic_save())
             except Exception as e:
-                print(f"DEBUG: Exception in play: {e}", flush=True)
-                await self.channel.send(f"Error starting playback: {e}")
+                self.log.exception("Exception in play: %s", e)
+                self.bot.get_cog("Music").messages.send(self.channel, content=f"Error starting playback: {e}")
                 self.next.set() # Ensure we don't get stuck
 
             await self.next.wait()
-            print("DEBUG: Wait finished, cleaning up...", flush=True)
+            self.log.debug("Wait finished, cleaning up...")
 
             # Make sure the FFmpeg process is cleaned up.
             try:
                 source.cleanup()
             except ValueError:
-                print("DEBUG: Source already cleaned up (ValueError ignored)", flush=True)
+                self.log.debug("Source already cleaned up (ValueError ignored)")
             except Exception as e:
-                print(f"DEBUG: Error cleaning up source: {e}", flush=True)
+                self.log.warning("Error cleaning up source: %s", e)
             
             self.current = None
-            # Reset status to default when song ends
-            await self.bot.get_cog("Music").set_default_status()
+            if self.release_timer:
+                self.release_timer.cancel()
+                self.release_timer = None
+            # Song ended, the presence manager falls back to the default status
+            self.bot.get_cog("Music").presence.track_stopped(self.guild.id)
             
             # Save state when song ends
             self.bot.get_cog("Music").save_state()
@@ -259,6 +585,20 @@ class MusicPlayer:
         if cog:
             return self.bot.loop.create_task(cog.cleanup(guild))
 
+class MusicView(ui.View):
+    """Base for the cog's button views: clicks are refused once the bot is shutting down.
+
+    Slash commands are refused by the bot's command tree; buttons go straight
+    to their view, and could otherwise queue or move songs after the state
+    was saved for the restart.
+    """
+
+    async def interaction_check(self, interaction: discord.Interaction):
+        if getattr(interaction.client, 'shutting_down', False):
+            await interaction.response.send_message(RESTARTING_MESSAGE, ephemeral=True)
+            return False
+        return True
+
 class SearchButton(ui.Button):
     def __init__(self, title, url, is_cached, cog, interaction_user):
         # Button labels can be max 80 chars, truncate smartly
@@ -288,13 +628,13 @@ class SearchButton(ui.Button):
         # Queue the song
         await self.cog.queue_song(interaction, self.video_url)
 
-class SearchView(ui.View):
+class SearchView(MusicView):
     def __init__(self, cog, interaction_user):
         super().__init__(timeout=60)
         self.cog = cog
         self.interaction_user = interaction_user
 
-    @ui.button(label="Cancel", style=discord.ButtonStyle.red, emoji="❌")
+    @ui.button(label="Cancel", style=discord.ButtonStyle.red, emoji="❌", custom_id="search:cancel")
     async def cancel_button(self, interaction: discord.Interaction, button: ui.Button):
         # Only the requester can cancel
         if interaction.user != self.interaction_user:
@@ -319,49 +659,293 @@ class SearchView(ui.View):
             except:
                 pass
 
+class QueueView(MusicView):
+    def __init__(self, cog, guild_id):
+        super().__init__(timeout=180)
+        self.cog = cog
+        self.guild_id = guild_id
+        self.page = 0
+
+    def update_buttons(self, page, page_count):
+        self.page = page
+        self.prev_button.disabled = page <= 0
+        self.next_button.disabled = page >= page_count - 1
+        self.page_label.label = f"{page + 1}/{page_count}"
+
+    async def show_page(self, interaction: discord.Interaction, page):
+        player = self.cog.players.get(self.guild_id)
+        if not player:
+            self.stop()
+            return await interaction.response.edit_message(content="📭 The queue is gone.", embed=None, view=None)
+
+        embed, page, page_count = self.cog.render_queue_page(player, page)
+        self.update_buttons(page, page_count)
+        await interaction.response.edit_message(embed=embed, view=self)
+
+    @ui.button(emoji="◀️", style=discord.ButtonStyle.gray, custom_id="queue:prev")
+    async def prev_button(self, interaction: discord.Interaction, button: ui.Button):
+        await self.show_page(interaction, self.page - 1)
+
+    @ui.button(label="1/1", style=discord.ButtonStyle.gray, disabled=True, custom_id="queue:page")
+    async def page_label(self, interaction: discord.Interaction, button: ui.Button):
+        pass
+
+    @ui.button(emoji="▶️", style=discord.ButtonStyle.gray, custom_id="queue:next")
+    async def next_button(self, interaction: discord.Interaction, button: ui.Button):
+        await self.show_page(interaction, self.page + 1)
+
+class NowPlayingView(MusicView):
+    """Jump buttons under a now-playing embed. They only act on the song the embed is about."""
+
+    STEP = 15
+
+    def __init__(self, cog, guild_id, track_id, timeout):
+        super().__init__(timeout=timeout)
+        self.cog = cog
+        self.guild_id = guild_id
+        self.track_id = track_id
+
+    async def jump(self, interaction: discord.Interaction, delta):
+        player = self.cog.players.get(self.guild_id)
+        source = player.current if player else None
+        if source is None or source.track.id != self.track_id:
+            self.stop()
+            return await interaction.response.send_message("❌ That song isn't playing anymore.", ephemeral=True)
+
+        position = self.cog.seek_player(player, source.position + delta)
+        emoji = "⏩" if delta > 0 else "⏪"
+        await interaction.response.send_message(f"{emoji} Jumped to `{int(position // 60)}:{int(position % 60):02d}`", ephemeral=True)
+
+    @ui.button(label="15s", emoji="⏪", style=discord.ButtonStyle.gray, custom_id="np:back")
+    async def back_button(self, interaction: discord.Interaction, button: ui.Button):
+        await self.jump(interaction, -self.STEP)
+
+    @ui.button(label="15s", emoji="⏩", style=discord.ButtonStyle.gray, custom_id="np:forward")
+    async def forward_button(self, interaction: discord.Interaction, button: ui.Button):
+        await self.jump(interaction, self.STEP)
+
 class Music(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         self.players = {}
-        self.cleanup_partial_files()
+        self.presence = PresenceManager(bot)
+        self.messages = ChannelPublisher()
+        install_rate_limit_counter()
+        self.resolve_slots = asyncio.Semaphore(RESOLVE_CONCURRENCY)
+        self.downloads = {}  # video id -> download task
+        self.download_urls = {}  # video id -> (url, warm) of running downloads, checkpointed on shutdown
+        self.state_frozen = False  # set once shutdown() saved the final state
+        self.restart = None  # RestartReport while guilds resume after a graceful restart
+        self.history = PlayHistory(storage.state_path('history.jsonl'))
+        self.warmer = CacheWarmer(
+            bot, self.history,
+            is_busy=self.is_busy,
+            cached_path=self.cached_audio_path,
+            download=self.warm_download
+        )
+        self.search_index = SearchIndex(storage.state_path('search_index.jsonl'))
+        self.hot_cache = HotCache()
+        self.popular = []  # (video_id, ext) of the most played cached songs, for the hot tier
+        self.bot.loop.create_task(self.load_history())
+        storage.migrate_state_files()
+        self.bot.loop.create_task(self.prepare_cache())
+        if not MEDIAD_URL:
+            # With a media daemon, partial downloads are its business
+            self.bot.loop.create_task(collect_partials(lambda: frozenset(self.downloads)))
+        if self.hot_cache.enabled:
+            self.bot.loop.create_task(self.manage_hot_cache())
         self.bot.loop.create_task(self.load_state())
+        budget.start(self.bot.loop)
+        self.track_memory()
+        memory_guard.start(self.bot.loop)
     
-    def cleanup_cache(self):
-        self.cleanup_partial_files()
+    def download(self, track, track_log=log, warm=False):
+        """Downloads a track into the cache, sharing one task per video id."""
+        video_id = track.id
+        task = self.downloads.get(video_id)
+        if task is None:
+            task = self.bot.loop.create_task(self._download(track, track_log, warm))
+            self.downloads[video_id] = task
+            self.download_urls[video_id] = (track.webpage_url, warm)
+            task.add_done_callback(lambda t: self._download_done(video_id, t, track_log))
+        return task
+
+    def _download_done(self, video_id, task, track_log):
+        self.downloads.pop(video_id, None)
+        self.download_urls.pop(video_id, None)
+        # Retrieve the exception so fire-and-forget callers don't leak "never retrieved" warnings
+        if not task.cancelled() and task.exception():
+            track_log.warning("Download failed: %s", task.exception())
+
+    async def _download(self, track, track_log, warm):
+        track_log.debug("Starting download for %s", track.title or 'Unknown')
+        # In process, or joined with other bots' requests for the same song by the media daemon
+        info = await media.download(track.id, track.webpage_url, warm=warm)
+        if info:
+            self.search_index.add(info)
+        track_log.info("Download complete for %s", track.title or 'Unknown')
+
+    def is_busy(self):
+        """True while user-facing downloads or lookups are in flight, or memory is short."""
+        return (bool(self.downloads) or any(player.resolving for player in self.players.values())
+                or memory_guard.shedding)
+
+    def track_memory(self):
+        """Registers the cog's memory accounts and what to drop when memory runs short."""
+        players = lambda: list(self.players.values())
+        memory_guard.account('players', lambda: (len(players()), *approx_size([
+            (player.current, player.resolving) for player in players()
+        ])))
+        memory_guard.account('queues', lambda: (
+            sum(len(player.queue) for player in players()),
+            *approx_size([player.queue.snapshot() for player in players()])
+        ))
+        memory_guard.account('queue pages', lambda: (
+            sum(len(player.queue_pages) for player in players()),
+            *approx_size([player.queue_pages for player in players()])
+        ))
+        memory_guard.account('search index', lambda: (len(self.search_index), *approx_size(self.search_index)))
+        memory_guard.account('play history', lambda: (self.history.lines, *approx_size(self.history)))
+        memory_guard.account('hot cache', lambda: (len(self.hot_cache.files), self.hot_cache.used))
+        memory_guard.account('negative cache', lambda: (
+            len(extractor_guard.negative), *approx_size(extractor_guard.negative)
+        ))
+        memory_guard.account('downloads', lambda: (len(self.downloads), None))
+        memory_guard.account('broadcast buffers', broadcast.usage)
+
+        memory_guard.on_pressure(self.shed_memory)
+
+    def shed_memory(self):
+        """Drops what can be rebuilt: rendered queue pages and yt-dlp's player code.
+
+        The hot tier shrinks to the songs playing now on its next rebalance,
+        see hot_candidates().
+        """
+        for player in self.players.values():
+            player.queue_pages = {}
+            player.queue_pages_key = None
+        shed_ytdl_caches()
+
+    def cached_audio_path(self, video_id):
+        """Returns the cached audio file for a video id, or None."""
+        data = self.load_cached_info(video_id)
+        if data is None:
+            return None
+        return storage.find_audio(video_id, data.get('ext'))
+
+    async def warm_download(self, video_id, url):
+        """Low priority download used by the cache warmer."""
+        await self.download(Track(video_id, webpage_url=url), log.bind(track_id=video_id), warm=True)
+
+    def flush_files(self):
+        """Appends the play history, search index entries and traced commands buffered on the loop. Blocking."""
+        self.history.flush()
+        self.search_index.flush()
+        trace.flush()
+
+    async def load_history(self):
+        await self.bot.loop.run_in_executor(None, self.history.load)
+        self.warmer.start()
+        while not self.bot.is_closed():
+            await asyncio.sleep(HISTORY_FLUSH_INTERVAL)
+            try:
+                await self.bot.loop.run_in_executor(None, self.flush_files)
+            except Exception as e:
+                log.warning("Failed to save buffered writes: %s", e)
 
-    def cleanup_partial_files(self):
-        """Clean up .part, .ytdl, and .temp files on startup."""
-        if not os.path.exists('songs'):
-            return
-            
-        for filename in os.listdir('songs'):
-            if filename.endswith(('.part', '.ytdl', '.temp')):
-                try:
-                    os.remove(os.path.join('songs', filename))
-                except Exception as e:
-                    print(f"Failed to delete {filename}: {e}")
+    async def prepare_cache(self):
+        """Finishes any cache layout migration, then builds the autocomplete index from cached metadata."""
+        await storage.migrate_flat_layout(self.bot.loop)
+        try:
+            built = await self.bot.loop.run_in_executor(None, self.search_index.load)
+            self.search_index.install(built)
+        except Exception as e:
+            log.exception("Failed to build search index: %s", e)
+            # Start empty rather than holding back every song added from now on
+            self.search_index.install(SearchIndex(self.search_index.path))
+
+    def hot_candidates(self):
+        """Songs that should be in the hot tier, best first: now playing, next up, then most played."""
+        wanted = [(player.current.track.id, player.current.track.ext)
+                  for player in self.players.values() if player.current]
+        if memory_guard.shedding:
+            # The tier lives in RAM; while memory is short only the songs playing now stay
+            return wanted
+        upcoming = [player.queue.slice(0, HOT_QUEUE_DEPTH) for player in self.players.values()]
+        # Position 1 of every guild before position 2 of any
+        for position in range(HOT_QUEUE_DEPTH):
+            for tracks in upcoming:
+                if position < len(tracks) and not tracks[position].placeholder:
+                    wanted.append((tracks[position].id, tracks[position].ext))
+        wanted.extend(self.popular)
+        return wanted
+
+    def most_played(self):
+        """Video ids by total plays across guilds, most played first.
+
+        Runs on the event loop, where the history is updated, so the counters
+        can't change while they are summed.
+        """
+        plays = Counter()
+        for counter in self.history.plays.values():
+            plays.update(counter)
+        return [video_id for video_id, _ in plays.most_common()]
+
+    def find_popular(self, ranked):
+        """The first HOT_POPULAR_COUNT songs of `ranked` that are in the disk cache. Blocking."""
+        popular = []
+        for video_id in ranked:
+            if len(popular) >= HOT_POPULAR_COUNT:
+                break
+            info = self.load_cached_info(video_id)
+            if info and storage.find_audio(video_id, info.get('ext')):
+                popular.append((video_id, info.get('ext')))
+        return popular
+
+    async def manage_hot_cache(self):
+        """Keeps the hot tier in line with what is playing, queued and popular.
+
+        The queues are checked every couple of seconds and the tier is only
+        rebalanced when something relevant changed.
+        """
+        await self.bot.wait_until_ready()
+        last_signature = None
+        popular_at = 0
+        while not self.bot.is_closed():
+            try:
+                if time.monotonic() - popular_at > HOT_POPULAR_INTERVAL:
+                    self.popular = await self.bot.loop.run_in_executor(None, self.find_popular, self.most_played())
+                    popular_at = time.monotonic()
+                wanted = self.hot_candidates()
+                # Downloads finishing can make wanted songs available, so they count as a change too
+                signature = (tuple(wanted), len(self.downloads))
+                if signature != last_signature:
+                    last_signature = signature
+                    await self.hot_cache.rebalance(self.bot.loop, wanted)
+            except Exception as e:
+                log.warning("Hot cache rebalance failed: %s", e)
+            await asyncio.sleep(HOT_REBALANCE_INTERVAL)
 
     def save_state(self):
         """Saves the current queue and playback state to disk."""
+        if self.state_frozen:
+            # Shutting down: the final state is saved, players being torn down mustn't overwrite it
+            return
         state = {}
         for guild_id, player in self.players.items():
             queue_list = []
             
-            # Calculate current playback position if playing
-            current_position = 0
-            if player.current and player.playback_start_time:
-                elapsed = time.time() - player.playback_start_time
-                current_position = int(elapsed)
+            # Position of the audio actually sent, so seeks are accounted for; to the packet,
+            # so a restart resumes where it stopped
+            current_position = round(player.current.position, 2) if player.current else 0
             
             # Add currently playing song to the front of the queue with position
             if player.current:
                 if isinstance(player.current, YTDLSource):
-                    current_song_data = player.current.data.copy()
-                    current_song_data['_resume_position'] = current_position  # Special marker
-                    queue_list.append(current_song_data)
+                    queue_list.append(player.current.track.copy(resume_position=current_position).to_dict())
             
             # Add rest of queue
-            queue_list.extend(list(player.queue._queue))
+            queue_list.extend(track.to_dict() for track in player.queue.snapshot())
             
             # Only save if there's something in the queue
             if queue_list:
@@ -372,133 +956,237 @@ class Music(commands.Cog):
                 }
         
         try:
-            with open('songs/state.json', 'w') as f:
-                json.dump(state, f)
-            print("DEBUG: State saved with playback position.", flush=True)
+            storage.write_json(storage.state_path('state.json'), state)
+            log.debug("State saved with playback position.")
         except Exception as e:
-            print(f"Error saving state: {e}", flush=True)
+            log.error("Error saving state: %s", e)
 
     async def load_state(self):
-        """Loads the queue from file on startup."""
+        """Restores saved queues on startup. Runs once per process, however often the bot reconnects."""
+        # The flag lives on the bot so reloading the cog doesn't restore (and duplicate queues) again
+        if getattr(self.bot, 'music_state_restored', False):
+            return
+        self.bot.music_state_restored = True
+
+        # After a graceful shutdown, downloads it cut off resume (from their partial files) straight away
+        checkpoint = await self.bot.loop.run_in_executor(None, read_checkpoint)
+        if checkpoint:
+            for item in checkpoint.get('downloads', []):
+                self.download(Track(item['id'], webpage_url=item['url']), log.bind(track_id=item['id']))
+
         await self.bot.wait_until_ready()
-        if not os.path.exists('songs/state.json'):
+        if checkpoint:
+            self.restart = RestartReport(checkpoint, time.time())
+            self.bot.loop.call_later(RESTART_REPORT_AFTER, self.restart.finish)
+        if not os.path.exists(storage.state_path('state.json')):
             return
-            
-        print("DEBUG: Loading state...", flush=True)
+
+        log.info("Loading state...")
         try:
-            with open('songs/state.json', 'r') as f:
-                state = json.load(f)
-                
-            for guild_id_str, data in state.items():
-                guild_id = int(guild_id_str)
-                guild = self.bot.get_guild(guild_id)
-                if not guild:
-                    continue
-                    
-                voice_channel = guild.get_channel(data['voice_channel'])
-                text_channel = guild.get_channel(data['text_channel'])
-                
-                if voice_channel and text_channel:
-                    # Connect
-                    if not guild.voice_client or not guild.voice_client.is_connected():
-                        try:
-                            await voice_channel.connect()
-                            print(f"DEBUG: Reconnected to voice channel {voice_channel.name}", flush=True)
-                        except Exception as e:
-                            print(f"Failed to reconnect voice: {e}", flush=True)
-                            continue
-                    
-                    # Get player
-                    if guild.id not in self.players:
-                         player = MusicPlayer(self.bot, guild, text_channel)
-                         self.players[guild.id] = player
-                    else:
-                        player = self.players[guild.id]
-
-                    # Populate queue
-                    for song_data in data['queue']:
-                        await player.queue.put(song_data)
-                    
-                    # Only send resume notification if we actually have songs to resume
-                    if not data['queue']:
-                        print(f"DEBUG: Queue was empty, skipping resume notification", flush=True)
-                        continue
-                    
-                    # Check if first song has a resume position marker
-                    if data['queue'] and '_resume_position' in data['queue'][0]:
-                        resume_pos = data['queue'][0]['_resume_position']
-                        if resume_pos > 0:
-                            player.seek_position = resume_pos
-                            print(f"DEBUG: Will resume from {resume_pos} seconds", flush=True)
-                    
-                    # Set flag to indicate this is a resumed session
-                    player._resumed_from_state = True
-                    
-                    # Build queue preview (up to 10 songs)
-                    queue_preview = ""
-                    songs_to_show = min(10, len(data['queue']))
-                    for i, song in enumerate(data['queue'][:songs_to_show], 1):
-                        title = song.get('title', 'Unknown')
-                        # Truncate long titles
-                        if len(title) > 50:
-                            title = title[:47] + "..."
-                        
-                        # Show resume indicator for first song
-                        if i == 1 and '_resume_position' in song:
-                            mins = int(song['_resume_position'] // 60)
-                            secs = int(song['_resume_position'] % 60)
-                            queue_preview += f"`{i}.` {title} `(resuming at {mins}:{secs:02d})`\n"
-                        else:
-                            queue_preview += f"`{i}.` {title}\n"
-                    
-                    if len(data['queue']) > 10:
-                        queue_preview += f"\n*...and {len(data['queue']) - 10} more songs*"
-                    
-                    # Send resume notification
-                    resume_embed = discord.Embed(
-                        title="🔄 Bot Resumed",
-                        description="I'm back! Resuming playback from where we left off...",
-                        color=discord.Color.blue()
-                    )
-                    
-                    resume_embed.add_field(name="📋 Queue Status", value=f"**{len(data['queue'])}** song(s) queued", inline=False)
-                    
-                    if queue_preview:
-                        resume_embed.add_field(name="🎵 Up Next", value=queue_preview, inline=False)
-                    
-                    resume_embed.set_footer(text="▶️ Starting playback now")
-                    await text_channel.send(embed=resume_embed)
-                    
-                    print(f"DEBUG: Restored queue for guild {guild.name}", flush=True)
-                        
+            state = await self.bot.loop.run_in_executor(None, self.read_state)
         except Exception as e:
-            print(f"Error loading state: {e}", flush=True)
+            log.exception("Error loading state: %s", e)
+            return
+
+        # Voice connections are made concurrently, a few at a time
+        slots = asyncio.Semaphore(RESTORE_CONCURRENCY)
+        started = time.monotonic()
+        results = await asyncio.gather(
+            *(self.restore_guild(int(guild_id), data, slots) for guild_id, data in state.items()),
+            return_exceptions=True
+        )
+        for guild_id, result in zip(state, results):
+            if isinstance(result, Exception):
+                log.error("Error restoring guild: %s", result, extra={'guild_id': int(guild_id)})
+        restored = sum(1 for result in results if result is True)
+        log.info("Restored %d of %d guilds in %.1fs", restored, len(state), time.monotonic() - started)
+
+    def read_state(self):
+        with open(storage.state_path('state.json'), 'r') as f:
+            return json.load(f)
+
+    def prewarm(self, song, track_log):
+        """Gets the first restored song ready: starts its download, or pulls a cached file into the page cache."""
+        if song.placeholder:
+            return
+        path = song.cached_path()
+        if path is None:
+            self.download(song, track_log)
+            return
+
+        def readahead():
+            try:
+                fd = os.open(path, os.O_RDONLY)
+                try:
+                    os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+                finally:
+                    os.close(fd)
+            except (OSError, AttributeError):
+                pass
+        self.bot.loop.run_in_executor(None, readahead)
+
+    async def restore_guild(self, guild_id, data, slots):
+        """Reconnects one guild and refills its queue. Returns True if anything was restored."""
+        guild = self.bot.get_guild(guild_id)
+        if not guild or not data.get('queue'):
+            return False
+        songs = [Track.from_dict(song) for song in data['queue']]
+
+        voice_channel = guild.get_channel(data['voice_channel'])
+        text_channel = guild.get_channel(data['text_channel'])
+        if not (voice_channel and text_channel):
+            return False
+
+        # Start fetching the first song while we wait for the voice connection
+        self.prewarm(songs[0], log.bind(guild_id=guild.id, track_id=songs[0].id))
+
+        if not guild.voice_client or not guild.voice_client.is_connected():
+            async with slots:
+                try:
+                    await voice_channel.connect()
+                    log.info("Reconnected to voice channel %s", voice_channel.name, extra={'guild_id': guild.id})
+                except Exception as e:
+                    log.warning("Failed to reconnect voice: %s", e, extra={'guild_id': guild.id})
+                    return False
+
+        # Get player
+        if guild.id not in self.players:
+            player = MusicPlayer(self.bot, guild, text_channel)
+            self.players[guild.id] = player
+        else:
+            player = self.players[guild.id]
+
+        # Populate queue, skipping songs that are already there (e.g. queued while we were reconnecting)
+        queued_ids = {song.id for song in player.queue}
+        if player.current is not None:
+            queued_ids.add(player.current.track.id)
+        restored = [song for song in songs if song.id not in queued_ids]
+        if not restored:
+            return False
+        player.queue.extend(restored)
+        player.prefetch()
+
+        # Check if first song has a resume position
+        resume_pos = restored[0].resume_position
+        if resume_pos > 0:
+            player.seek_position = resume_pos
+            player.log.debug("Will resume from %s seconds", resume_pos)
+        
+        # Set flag to indicate this is a resumed session
+        player._resumed_from_state = True
+        
+        # Build queue preview (up to 10 songs)
+        queue_preview = ""
+        songs_to_show = min(10, len(restored))
+        for i, song in enumerate(restored[:songs_to_show], 1):
+            title = song.title or 'Unknown'
+            # Truncate long titles
+            if len(title) > 50:
+                title = title[:47] + "..."
+            
+            # Show resume indicator for first song
+            if i == 1 and song.resume_position:
+                mins = int(song.resume_position // 60)
+                secs = int(song.resume_position % 60)
+                queue_preview += f"`{i}.` {title} `(resuming at {mins}:{secs:02d})`\n"
+            else:
+                queue_preview += f"`{i}.` {title}\n"
+        
+        if len(restored) > 10:
+            queue_preview += f"\n*...and {len(restored) - 10} more songs*"
+        
+        # Send resume notification
+        resume_embed = discord.Embed(
+            title="🔄 Bot Resumed",
+            description="I'm back! Resuming playback from where we left off...",
+            color=discord.Color.blue()
+        )
+        
+        resume_embed.add_field(name="📋 Queue Status", value=f"**{len(restored)}** song(s) queued", inline=False)
+        
+        if queue_preview:
+            resume_embed.add_field(name="🎵 Up Next", value=queue_preview, inline=False)
+        
+        resume_embed.set_footer(text="▶️ Starting playback now")
+        self.messages.send(text_channel, embed=resume_embed, priority=PRIORITY_STATUS)
+        
+        player.log.info("Restored queue for guild %s", guild.name)
+        return True
+
+    def audio_started(self, guild_id):
+        if self.restart is not None:
+            self.restart.resumed(guild_id)
+
+    async def shutdown(self):
+        """Gets ready for the process to exit (SIGTERM): saves exact positions and running downloads, leaves voice.
+
+        Audio is paused first so the saved positions are where it actually
+        stopped. The next process restores the queues and resumes the
+        downloads, see load_state(), and reports how long the audio was down.
+        """
+        stopped_at = time.time()
+        playing = []
+        for guild_id, player in self.players.items():
+            vc = player.guild.voice_client
+            if vc and vc.is_playing():
+                vc.pause()
+                playing.append(guild_id)
+            player.task.cancel()
+            if player.release_timer:
+                player.release_timer.cancel()
+                player.release_timer = None
+
+        # State and checkpoint are small and written right here: the executor may be full of
+        # downloads, and waiting behind them could use up the whole SHUTDOWN_TIMEOUT
+        self.save_state()
+        self.state_frozen = True
+        # Warm downloads are the warmer's to redo
+        downloads = [{'id': video_id, 'url': url} for video_id, (url, warm) in self.download_urls.items() if not warm]
+        try:
+            write_checkpoint(stopped_at, playing, downloads)
+        except OSError as e:
+            log.error("Error writing shutdown checkpoint: %s", e)
+        log.info("Saved state for %d guilds (%d playing) and %d downloads", len(self.players), len(playing), len(downloads))
+        await self.bot.loop.run_in_executor(None, self.flush_files)
+
+        # Leaving voice properly lets the next process connect without waiting for a stale session
+        voice_clients = [player.guild.voice_client for player in self.players.values() if player.guild.voice_client]
+        if voice_clients:
+            await asyncio.wait([asyncio.ensure_future(vc.disconnect(force=True)) for vc in voice_clients],
+                               timeout=VOICE_DISCONNECT_TIMEOUT)
+        for player in self.players.values():
+            if player.current is not None:
+                try:
+                    player.current.cleanup()
+                except Exception as e:
+                    player.log.debug("Error cleaning up source: %s", e)
 
     async def cleanup(self, guild):
         try:
             await guild.voice_client.disconnect()
         except AttributeError:
             pass
+        budget.release(guild.id)
 
         try:
             del self.players[guild.id]
         except KeyError:
             pass
             
-        # Reset status if no other guilds are playing
-        if not any(p.guild.voice_client and p.guild.voice_client.is_playing() for p in self.players.values()):
-            await self.set_default_status()
+        # Status reverts once no other guild is playing
+        self.presence.track_stopped(guild.id)
 
-    async def set_default_status(self):
-        """Sets the bot's status to the default 'The Don'ju'."""
-        await self.bot.change_presence(activity=discord.Game(name="The Don'ju | /help"))
+    @commands.Cog.listener()
+    async def on_interaction(self, interaction: discord.Interaction):
+        # Opt-in (COMMAND_TRACE); a sanitised line per command, autocomplete and button click
+        trace.record(interaction)
 
     @commands.Cog.listener()
     async def on_ready(self):
-        """Sets default status when cog is ready."""
-        await self.set_default_status()
-        # Load state if exists
-        await self.load_state()
+        """Sets status when cog is ready."""
+        # A fresh gateway session starts without our presence, resend it.
+        # Saved queues are restored by the load_state task started in __init__, once per process
+        self.presence.invalidate()
 
     async def __local_check(self, interaction: discord.Interaction):
         # A local check which applies to all commands in this cog.
@@ -513,6 +1201,43 @@ class Music(commands.Cog):
         return player
 
 
+    def seek_player(self, player, seconds):
+        """Moves the current song to `seconds`; returns the position actually jumped to."""
+        position = player.current.seek(seconds)
+        player.log.debug("Seeked to %.1f seconds", position)
+        self.save_state()
+        return position
+
+    def cached_info(self, query):
+        """Returns the cached metadata for a video URL, or None if it isn't cached."""
+        video_id = extract_video_id(query)
+        if video_id is None:
+            return None
+        return self.load_cached_info(video_id)
+
+    def load_cached_info(self, video_id):
+        """Reads a video's cached .info.json, or returns None."""
+        return load_info(video_id)
+
+    async def connect_voice(self, interaction: discord.Interaction):
+        """Joins the requester's voice channel if needed. Returns False if they aren't in one."""
+        if interaction.guild.voice_client is not None:
+            return True
+        if not interaction.user.voice:
+            await interaction.followup.send("❌ You need to be in a voice channel to play music!")
+            return False
+
+        # Send modern connection message
+        connecting_embed = discord.Embed(
+            title="🔗 Establishing Connection",
+            description=f"**Joining:** {interaction.user.voice.channel.name}\n\n🎵 Getting ready to play music...",
+            color=discord.Color.green()
+        )
+        connecting_embed.set_footer(text="✅ Connected! Ready to play")
+        await interaction.followup.send(embed=connecting_embed, ephemeral=True)
+        await interaction.user.voice.channel.connect()
+        return True
+
     async def queue_song(self, interaction: discord.Interaction, query: str):
         """Helper to queue a song from URL."""
         # Flavor Messages
@@ -532,22 +1257,8 @@ class Music(commands.Cog):
         }
 
         # Try to find in cache first (Optimization)
-        video_id = None
-        cached_data = None
-        is_cache_hit = False
-
-        # Extract Video ID
-        match = re.search(r'(?:v=|\/)([0-9A-Za-z_-]{11}).*', query)
-        if match:
-            video_id = match.group(1)
-            info_path = f'songs/{video_id}.info.json'
-            if os.path.exists(info_path):
-                try:
-                    with open(info_path, 'r') as f:
-                        cached_data = json.load(f)
-                    is_cache_hit = True
-                except Exception as e:
-                    print(f"Failed to load cache for {video_id}: {e}")
+        cached_data = self.cached_info(query)
+        is_cache_hit = cached_data is not None
 
         # Determine initial message content
         initial_msg = ""
@@ -557,64 +1268,64 @@ class Music(commands.Cog):
         else:
             initial_msg = f"� **Establishing Connection...**\n\nAccessing: `{query}`"
 
-        # Send/Update status using edit_original_response (works for both deferred commands and button interactions)
-        try:
-            await interaction.edit_original_response(content=initial_msg, view=None, embed=None)
-        except discord.NotFound:
-            # Fallback if original response is gone (rare)
-            await interaction.followup.send(initial_msg)
+        # Status edits go through a coalescer (works for both deferred commands and button interactions):
+        # intermediate states are merged and skipped entirely if the final state is ready first
+        status = InteractionStatus(interaction)
+        status.update(content=initial_msg, view=None, embed=None)
 
         if not (is_cache_hit and cached_data):
             # Fetch info
             try:
                 data = await YTDLSource.get_info(query, loop=self.bot.loop, stream=True)
+            except Unplayable as e:
+                content = too_long_message(e.duration) if e.duration else f"❌ **Can't play this video**: {e}"
+                await status.finish(content=content, view=None, embed=None)
+                return
+            except ExtractorUnavailable as e:
+                await status.finish(content=f"⏳ {e}", view=None, embed=None)
+                return
             except Exception as e:
-                await interaction.edit_original_response(content=f"Error finding song: {e}")
+                await status.finish(content=f"Error finding song: {e}", view=None, embed=None)
                 return
             
             # Now check if audio file exists (Legacy Cache Check)
-            filename = ytdl.prepare_filename(data)
-            if os.path.exists(filename):
+            if storage.find_audio(data['id'], data.get('ext')):
                 is_cache_hit = True
                 # Update message to Cache Hit
                 new_msg = random.choice(flavor_texts["cache"]).format(query=data.get('title', query))
-                await interaction.edit_original_response(content=new_msg)
+                status.update(content=new_msg, view=None, embed=None)
             else:
                 # Update message to Downloading
                 new_msg = random.choice(flavor_texts["download"]).format(query=data.get('title', query))
-                await interaction.edit_original_response(content=new_msg)
+                status.update(content=new_msg, view=None, embed=None)
 
         try:
             player = self.get_player(interaction)
             
             # Check duration before queueing
             duration = data.get('duration')
-            if duration and duration > 600:
-                raise ValueError(f"❌ **Song Too Long**: This video is {int(duration//60)}m {int(duration%60):02d}s, but the limit is 10 minutes. Please choose a shorter song.")
+            if duration and duration > MAX_DURATION:
+                raise ValueError(too_long_message(duration))
             
-            # Add requester info
-            data['requested_by'] = interaction.user.name
+            # Only the fields we use are kept; the full info dict is dropped here
+            track = Track.from_info(data, requested_by=interaction.user.name)
             
             # Check if this will play immediately or be queued
             vc = interaction.guild.voice_client
             will_play_immediately = (player.queue.empty() and (not vc or not vc.is_playing()))
             
-            await player.queue.put(data)
+            player.queue.append(track)
             
             # Start background download if not cached and not playing immediately
             if not is_cache_hit and not will_play_immediately:
                 # Download in background without blocking
+                dl_log = player.log.bind(track_id=track.id)
+
                 async def background_download():
                     try:
-                        print(f"DEBUG: Starting background download for {data.get('title', 'Unknown')}", flush=True)
-                        # This will download and cache the file
-                        await self.bot.loop.run_in_executor(
-                            None,
-                            lambda: ytdl.extract_info(data['webpage_url'], download=True)
-                        )
-                        print(f"DEBUG: Background download complete for {data.get('title', 'Unknown')}", flush=True)
+                        await self.download(track, dl_log)
                     except Exception as e:
-                        print(f"DEBUG: Background download failed: {e}", flush=True)
+                        dl_log.warning("Background download failed: %s", e)
                 
                 # Start download task without awaiting (fire and forget)
                 self.bot.loop.create_task(background_download())
@@ -622,14 +1333,14 @@ class Music(commands.Cog):
             # Only show "Queued" message if song won't play immediately
             if not will_play_immediately:
                 # Create Embed for Public Queue Log
-                embed = discord.Embed(title="Queued", description=f"[{data['title']}]({data['webpage_url']})", color=discord.Color.green())
-                if data.get('thumbnail'):
-                    embed.set_image(url=data['thumbnail'])
-                if data.get('duration'):
-                    embed.add_field(name="Duration", value=f"{int(data['duration']//60)}:{int(data['duration']%60):02d}")
+                embed = discord.Embed(title="Queued", description=f"[{track.title}]({track.webpage_url})", color=discord.Color.green())
+                if track.thumbnail:
+                    embed.set_image(url=track.thumbnail)
+                if track.duration:
+                    embed.add_field(name="Duration", value=f"{int(track.duration//60)}:{int(track.duration%60):02d}")
                 
                 # Add position info
-                queue_pos = player.queue.qsize()
+                queue_pos = len(player.queue)
                 embed.add_field(name="Position in Queue", value=f"#{queue_pos}", inline=True)
                 embed.add_field(name="Requested By", value=interaction.user.mention, inline=True)
 
@@ -639,25 +1350,86 @@ class Music(commands.Cog):
                     embed.set_footer(text="☁️ New Download")
 
                 # Send Public Embed
-                await interaction.channel.send(embed=embed)
+                self.messages.send(interaction.channel, embed=embed)
 
             # Close Ephemeral Interaction (Delete it so it vanishes)
-            try:
-                await interaction.delete_original_response()
-            except:
-                # Fallback if delete fails (e.g. too old), just edit to empty
-                await interaction.edit_original_response(content="✅ Queued", embed=None, view=None)
+            await status.delete(fallback="✅ Queued")
             
             # Save state
             self.save_state()
             
         except ValueError as e:
-             await interaction.edit_original_response(content=f"{e}")
+             await status.finish(content=f"{e}", view=None, embed=None)
+        except Exception as e:
+             await status.finish(content=f"An error occurred: {e}", view=None, embed=None)
+
+    async def queue_playlist(self, interaction: discord.Interaction, url: str):
+        """Streams a playlist into the queue as lightweight placeholders.
+
+        Entries are listed with a flat extraction in batches and queued as soon
+        as each batch arrives; the player resolves each one to full metadata
+        shortly before it plays.
+        """
+        status = InteractionStatus(interaction)
+        status.update(content=f"📥 **Importing playlist...**\n\nAccessing: `{url}`", view=None, embed=None)
+
+        try:
+            info = await self.bot.loop.run_in_executor(
+                None,
+                lambda: ytdl_flat.extract_info(url, download=False, process=False)
+            )
         except Exception as e:
-             await interaction.edit_original_response(content=f"An error occurred: {e}")
+            return await status.finish(content=f"Error loading playlist: {e}", view=None, embed=None)
+
+        entries = iter(info.get('entries') or [])
+        player = self.get_player(interaction)
+        queued = 0
+        skipped = 0
+        first_position = len(player.queue) + 1
+
+        while queued + skipped < MAX_PLAYLIST_TRACKS:
+            # Pull the next page of entries off the (lazy) playlist in the executor
+            batch_size = min(PLAYLIST_BATCH_SIZE, MAX_PLAYLIST_TRACKS - queued - skipped)
+            try:
+                batch = await self.bot.loop.run_in_executor(None, lambda: list(itertools.islice(entries, batch_size)))
+            except Exception as e:
+                log.warning("Playlist listing stopped early: %s", e, extra={'guild_id': interaction.guild_id})
+                break
+            if not batch:
+                break
+
+            placeholders = []
+            for entry in batch:
+                if not entry:
+                    continue
+                duration = entry.get('duration')
+                if (duration and duration > MAX_DURATION) or extractor_guard.negative.get(entry.get('id')):
+                    skipped += 1
+                    continue
+                placeholders.append(Track.from_entry(entry, requested_by=interaction.user.name))
+
+            player.queue.extend(placeholders)
+            player.prefetch()
+            queued += len(placeholders)
+            status.update(content=f"📥 **Importing playlist...** {queued} songs queued so far", view=None, embed=None)
+
+        if not queued:
+            return await status.finish(content="❌ No playable songs found in that playlist.", view=None, embed=None)
+
+        title = info.get('title') or "Playlist"
+        embed = discord.Embed(title="Playlist Queued", description=f"[{title}]({info.get('webpage_url') or url})", color=discord.Color.green())
+        embed.add_field(name="Songs", value=f"**{queued}** queued", inline=True)
+        embed.add_field(name="Position in Queue", value=f"#{first_position}", inline=True)
+        embed.add_field(name="Requested By", value=interaction.user.mention, inline=True)
+        if skipped:
+            embed.set_footer(text=f"⏭️ Skipped {skipped} song(s) over the 10 minute limit")
+        self.messages.send(interaction.channel, embed=embed)
+
+        await status.delete(fallback=f"✅ Queued {queued} songs")
+        self.save_state()
 
     @app_commands.command(name="play", description="Plays a song from YouTube")
-    @app_commands.describe(search="The YouTube URL or search query (use 'random' for a random cached song)")
+    @app_commands.describe(search="The YouTube URL, playlist URL or search query (use 'random' for a random cached song)")
     async def play(self, interaction: discord.Interaction, search: str):
         """Plays a song."""
         # Check if user is in voice channel first
@@ -666,23 +1438,20 @@ class Music(commands.Cog):
         
         # Handle "random" keyword - play random cached song
         if search.lower() == 'random':
-            if not os.path.exists('songs'):
-                return await interaction.response.send_message('❌ No cached songs available!', ephemeral=True)
-            
-            # Get all cached audio files with their info
+            # Get all cached audio files (directory walk runs in the executor)
+            cached_ids = await self.bot.loop.run_in_executor(
+                None, lambda: [video_id for video_id, _, _ in storage.iter_audio()]
+            )
+            random.shuffle(cached_ids)
+
+            # Only read metadata for the songs we actually try
             cached_songs = []
-            for filename in os.listdir('songs'):
-                if not filename.endswith(('.json', '.part', '.ytdl', '.temp')):
-                    video_id = filename.rsplit('.', 1)[0]
-                    info_path = os.path.join('songs', f'{video_id}.info.json')
-                    
-                    if os.path.exists(info_path):
-                        try:
-                            with open(info_path, 'r') as f:
-                                info = json.load(f)
-                                cached_songs.append(info['webpage_url'])
-                        except:
-                            pass
+            for video_id in cached_ids[:5]:
+                info = self.load_cached_info(video_id)
+                if info:
+                    # Seeded local files have no page; a URL carrying their id still finds them in the cache
+                    cached_songs.append(info.get('webpage_url') or f"https://www.youtube.com/watch?v={video_id}")
+                    break
             
             if not cached_songs:
                 return await interaction.response.send_message('❌ No cached songs available!', ephemeral=True)
@@ -707,20 +1476,13 @@ class Music(commands.Cog):
         
         player = self.get_player(interaction)
 
-        if interaction.guild.voice_client is None:
-            if interaction.user.voice:
-                # Send modern connection message
-                connecting_embed = discord.Embed(
-                    title="🔗 Establishing Connection",
-                    description=f"**Joining:** {interaction.user.voice.channel.name}\n\n🎵 Getting ready to play music...",
-                    color=discord.Color.green()
-                )
-                connecting_embed.set_footer(text="✅ Connected! Ready to play")
-                await interaction.followup.send(embed=connecting_embed, ephemeral=True)
-                await interaction.user.voice.channel.connect()
-            else:
-                await interaction.followup.send("❌ You need to be in a voice channel to play music!")
-                return
+        if not await self.connect_voice(interaction):
+            return
+
+        # Playlists are streamed into the queue
+        if is_url and is_playlist_url(search):
+            await self.queue_playlist(interaction, search)
+            return
 
         # If URL, queue directly
         if is_url:
@@ -728,7 +1490,7 @@ class Music(commands.Cog):
             return
 
         # If Search Query, show menu
-        search_query = f"ytsearch5:{search}"
+        self.search_index.remember_search(interaction.guild_id, search)
         
         # Send modern scanning message with blue theme
         embed = discord.Embed(
@@ -740,12 +1502,9 @@ class Music(commands.Cog):
         scan_msg = await interaction.followup.send(embed=embed)
 
         try:
-            data = await self.bot.loop.run_in_executor(
-                None, 
-                lambda: ytdl.extract_info(search_query, download=False, process=False)
-            )
+            entries = await media.search(search, 5)
             
-            if 'entries' not in data or not data['entries']:
+            if not entries:
                 error_embed = discord.Embed(
                     title="❌ No Results Found",
                     description=f"Couldn't find anything for: **{search}**\n\n💡 Try a different search term!",
@@ -757,20 +1516,19 @@ class Music(commands.Cog):
             view = SearchView(self, interaction.user)
             
             # Process top 5 results and check cache status
-            entries = list(data['entries'])
             songs_with_cache_status = []
             cached_count = 0
             new_count = 0
             
             for entry in entries[:5]:
-                title = entry.get('title', 'Unknown Title')
-                url = entry.get('url', '')
+                title = entry.get('title') or 'Unknown Title'
+                url = entry.get('url') or ''
                 video_id = entry.get('id')
                 
                 # Check cache status
                 is_cached = False
                 if video_id:
-                     if os.path.exists(f'songs/{video_id}.info.json'):
+                     if storage.find_info(video_id):
                          is_cached = True
                          cached_count += 1
                      else:
@@ -790,6 +1548,8 @@ class Music(commands.Cog):
                 button = SearchButton(song['title'], song['url'], song['is_cached'], self, interaction.user)
                 # Assign each button to its own row for vertical stacking
                 button.row = i
+                # Stable ids (instead of random ones) keep clicks comparable in command traces
+                button.custom_id = f"search:{i}"
                 view.add_item(button)
 
             # Edit the scanning message to show clean bubble list
@@ -814,10 +1574,129 @@ class Music(commands.Cog):
             )
             error_embed.add_field(name="🔍 Error Details", value=f"```{str(e)[:200]}```", inline=False)
             await scan_msg.edit(embed=error_embed)
+
+    @play.autocomplete('search')
+    async def play_autocomplete(self, interaction: discord.Interaction, current: str):
+        """Suggests cached songs and this server's recent searches while typing.
+
+        Answered from the in-memory index only, well inside Discord's
+        autocomplete deadline. A cached song's value is its URL, so picking it
+        takes the cache-hit path in queue_song.
+        """
+        if current.startswith(('http://', 'https://')):
+            return []
+        index = self.search_index
+        plays = self.history.plays.get(interaction.guild_id)
+
+        choices = [app_commands.Choice(name=f"🔍 {query}"[:100], value=query[:100])
+                   for query in index.recent_searches(interaction.guild_id, current)[:5]]
+        if current.strip():
+            ids = index.search(current, limit=MAX_CHOICES - len(choices), plays=plays)
+        else:
+            ids = index.top(plays, limit=MAX_CHOICES - len(choices))
+        for video_id in ids:
+            name, value = index.choice(video_id)
+            choices.append(app_commands.Choice(name=name, value=value))
+        return choices
+
+    async def resolve_query(self, query, slots):
+        """Resolves one /playmany entry. Returns (track, is_cached, error)."""
+        cached_data = self.cached_info(query)
+        if cached_data is not None:
+            return Track.from_info(cached_data), True, None
+
+        try:
+            async with slots:
+                data = await YTDLSource.get_info(query, loop=self.bot.loop, stream=True)
+        except Exception as e:
+            return None, False, str(e)
+
+        duration = data.get('duration')
+        if duration and duration > MAX_DURATION:
+            return None, False, f"too long ({int(duration//60)}m {int(duration%60):02d}s)"
+        track = Track.from_info(data)
+        return track, track.cached_path() is not None, None
+
+    @app_commands.command(name="playmany", description="Queues several songs at once")
+    @app_commands.describe(songs="URLs or search terms separated by |")
+    async def play_many(self, interaction: discord.Interaction, songs: str):
+        """Resolves several songs concurrently and queues them in order."""
+        if not interaction.user.voice:
+            return await interaction.response.send_message('❌ You need to be in a voice channel to play music!', ephemeral=True)
+
+        queries = split_queries(songs)
+        if not queries:
+            return await interaction.response.send_message('❌ Give me at least one song!', ephemeral=True)
+        if len(queries) > BULK_MAX_TRACKS:
+            return await interaction.response.send_message(f'❌ You can queue up to {BULK_MAX_TRACKS} songs at once.', ephemeral=True)
+
+        await interaction.response.defer(ephemeral=True)
+        player = self.get_player(interaction)
+        if not await self.connect_voice(interaction):
+            return
+
+        status = InteractionStatus(interaction)
+        status.update(content=f"📡 **Acquiring {len(queries)} signals...**", view=None, embed=None)
+
+        # All lookups run at once (bounded), so the total is close to the slowest one
+        slots = asyncio.Semaphore(BULK_CONCURRENCY)
+        results = await asyncio.gather(*(self.resolve_query(query, slots) for query in queries))
+
+        vc = interaction.guild.voice_client
+        first_plays_now = player.queue.empty() and (not vc or not vc.is_playing())
+        first_position = len(player.queue) + 1
+
+        queued = []
+        failed = []
+        for query, (track, is_cached, error) in zip(queries, results):
+            if track is None:
+                failed.append((query, error))
+                continue
+            track.requested_by = interaction.user.name
+            queued.append((track, is_cached))
+
+        # Enqueue in input order, in one go
+        player.queue.extend(track for track, _ in queued)
+
+        # Download everything that isn't cached, except a song the player is about to fetch itself
+        for index, (track, is_cached) in enumerate(queued):
+            if not is_cached and not (index == 0 and first_plays_now):
+                self.download(track, player.log.bind(track_id=track.id))
+
+        if not queued:
+            details = "\n".join(f"• `{query[:60]}`: {error[:100]}" for query, error in failed[:10])
+            return await status.finish(content=f"❌ Couldn't queue any of those songs.\n{details}", view=None, embed=None)
+
+        # One summary embed for the whole batch
+        lines = []
+        for offset, (track, is_cached) in enumerate(queued[:15]):
+            title = track.title or 'Unknown'
+            display_title = title[:45] + "..." if len(title) > 45 else title
+            lines.append(f"`{first_position + offset}.` {'💾' if is_cached else '☁️'} [{display_title}]({track.webpage_url or ''})")
+        if len(queued) > 15:
+            lines.append(f"*...and {len(queued) - 15} more*")
+
+        embed = discord.Embed(
+            title=f"Queued {len(queued)} Song{'s' if len(queued) != 1 else ''}",
+            description="\n".join(lines),
+            color=discord.Color.green()
+        )
+        embed.add_field(name="Requested By", value=interaction.user.mention, inline=True)
+        if failed:
+            embed.add_field(
+                name=f"⚠️ Skipped {len(failed)}",
+                value="\n".join(f"`{query[:40]}`: {error[:60]}" for query, error in failed[:5]),
+                inline=False
+            )
+        self.messages.send(interaction.channel, embed=embed)
+
+        await status.delete(fallback=f"✅ Queued {len(queued)} songs")
+        self.save_state()
+
     @app_commands.command(name="skip", description="Skips the song")
     async def skip(self, interaction: discord.Interaction):
         """Skip the song."""
-        print(f"DEBUG: Skip requested by {interaction.user}", flush=True)
+        log.debug("Skip requested by %s", interaction.user, extra={'guild_id': interaction.guild_id})
         vc = interaction.guild.voice_client
         if not vc or not vc.is_connected():
             return await interaction.response.send_message('❌ I\'m not currently playing anything!', ephemeral=True)
@@ -825,13 +1704,13 @@ class Music(commands.Cog):
         if vc.is_paused():
             pass
         elif not vc.is_playing():
-            print("DEBUG: Skip called but not playing", flush=True)
+            log.debug("Skip called but not playing", extra={'guild_id': interaction.guild_id})
             return await interaction.response.send_message('❌ Nothing is playing right now!', ephemeral=True)
 
         # Get player and current song info
         player = self.get_player(interaction)
         current_song = player.current
-        queue_size = player.queue.qsize()
+        queue_size = len(player.queue)
         
         # Get song details
         if current_song:
@@ -851,7 +1730,6 @@ class Music(commands.Cog):
             song_thumbnail = None
             song_duration = None
 
-        print("DEBUG: Calling vc.stop()", flush=True)
         vc.stop()
         self.save_state()
         
@@ -881,6 +1759,81 @@ class Music(commands.Cog):
         
         await interaction.response.send_message(embed=embed)
 
+    @app_commands.command(name="pause", description="Pauses the current song")
+    async def pause(self, interaction: discord.Interaction):
+        """Pauses playback, keeping the exact position."""
+        vc = interaction.guild.voice_client
+        player = self.players.get(interaction.guild.id)
+        if not vc or not vc.is_playing() or not player or not player.current:
+            return await interaction.response.send_message('❌ Nothing is playing right now!', ephemeral=True)
+
+        player.pause()
+        self.save_state()
+
+        source = player.current
+        position = source.position
+        embed = discord.Embed(
+            title="⏸️ Paused",
+            description=f"**[{source.title}]({source.webpage_url})** at `{int(position // 60)}:{int(position % 60):02d}`",
+            color=discord.Color.orange()
+        )
+        embed.add_field(name="👤 Paused By", value=interaction.user.mention, inline=True)
+        embed.set_footer(text="▶️ Use /resume to continue")
+        await interaction.response.send_message(embed=embed)
+
+    @app_commands.command(name="resume", description="Resumes the paused song")
+    async def resume(self, interaction: discord.Interaction):
+        """Resumes playback from where it was paused."""
+        vc = interaction.guild.voice_client
+        player = self.players.get(interaction.guild.id)
+        if not vc or not vc.is_paused() or not player or not player.current:
+            return await interaction.response.send_message('❌ Nothing is paused right now!', ephemeral=True)
+
+        try:
+            player.resume()
+        except Exception as e:
+            player.log.exception("Failed to resume: %s", e)
+            return await interaction.response.send_message(f'❌ Couldn\'t resume this song: {e}', ephemeral=True)
+
+        source = player.current
+        position = source.position
+        embed = discord.Embed(
+            title="▶️ Resumed",
+            description=f"**[{source.title}]({source.webpage_url})** from `{int(position // 60)}:{int(position % 60):02d}`",
+            color=discord.Color.green()
+        )
+        embed.add_field(name="👤 Resumed By", value=interaction.user.mention, inline=True)
+        await interaction.response.send_message(embed=embed)
+
+    @app_commands.command(name="seek", description="Jumps to a position in the current song")
+    @app_commands.describe(position="Time like 1:30 or 90, or +15 / -15 to jump ahead or back")
+    async def seek(self, interaction: discord.Interaction, position: str):
+        """Seeks within the playing song."""
+        vc = interaction.guild.voice_client
+        player = self.players.get(interaction.guild.id)
+        if not vc or not vc.is_connected() or not player or not player.current:
+            return await interaction.response.send_message('❌ Nothing is playing right now!', ephemeral=True)
+
+        source = player.current
+        before = source.position
+        target = parse_position(position, before)
+        if target is None:
+            return await interaction.response.send_message('❌ Use a time like `1:30` or `90`, or `+15` / `-15`.', ephemeral=True)
+
+        target = self.seek_player(player, target)
+
+        embed = discord.Embed(
+            title="⏩ Seeked" if target >= before else "⏪ Seeked",
+            description=f"**[{source.title}]({source.webpage_url})**",
+            color=discord.Color.blue()
+        )
+        progress = f"{int(target // 60)}:{int(target % 60):02d}"
+        if source.duration:
+            progress += f" / {int(source.duration // 60)}:{int(source.duration % 60):02d}"
+        embed.add_field(name="⏱️ Position", value=progress, inline=True)
+        embed.add_field(name="👤 Requested By", value=interaction.user.mention, inline=True)
+        await interaction.response.send_message(embed=embed)
+
     @app_commands.command(name="stop", description="Stops the song and clears the queue")
     async def stop(self, interaction: discord.Interaction):
         """Stops playing song and clears the queue."""
@@ -892,11 +1845,7 @@ class Music(commands.Cog):
         player = self.get_player(interaction)
         
         # Clear the queue
-        while not player.queue.empty():
-            try:
-                player.queue.get_nowait()
-            except:
-                break
+        player.queue.clear()
         
         vc.stop()
         
@@ -908,26 +1857,88 @@ class Music(commands.Cog):
         )
         await interaction.response.send_message(embed=embed)
 
-    @app_commands.command(name="queue", description="Shows the queue")
-    async def queue_info(self, interaction: discord.Interaction):
-        """Retrieve a basic queue of upcoming songs."""
-        vc = interaction.guild.voice_client
-        if not vc or not vc.is_connected():
-            return await interaction.response.send_message('❌ I\'m not currently connected to a voice channel!', ephemeral=True)
+    @app_commands.command(name="remove", description="Removes a song from the queue")
+    @app_commands.describe(position="Position in the queue (as shown by /queue)")
+    async def remove(self, interaction: discord.Interaction, position: app_commands.Range[int, 1]):
+        """Removes a queued song by position."""
+        player = self.players.get(interaction.guild.id)
+        if not player or position > len(player.queue):
+            return await interaction.response.send_message('❌ There is no song at that position!', ephemeral=True)
+
+        song = player.queue.pop(position - 1)
+        self.save_state()
+
+        embed = discord.Embed(
+            title="🗑️ Removed from Queue",
+            description=f"[{song.title or 'Unknown'}]({song.webpage_url or ''})",
+            color=discord.Color.orange()
+        )
+        embed.add_field(name="👤 Removed By", value=interaction.user.mention, inline=True)
+        embed.add_field(name="📋 Songs in Queue", value=f"{len(player.queue)} remaining", inline=True)
+        await interaction.response.send_message(embed=embed)
+
+    @app_commands.command(name="move", description="Moves a song to another position in the queue")
+    @app_commands.describe(source="Current position (as shown by /queue)", destination="New position")
+    async def move(self, interaction: discord.Interaction, source: app_commands.Range[int, 1], destination: app_commands.Range[int, 1]):
+        """Reorders the queue."""
+        player = self.players.get(interaction.guild.id)
+        if not player or source > len(player.queue):
+            return await interaction.response.send_message('❌ There is no song at that position!', ephemeral=True)
+
+        destination = min(destination, len(player.queue))
+        song = player.queue.move(source - 1, destination - 1)
+        self.save_state()
+
+        embed = discord.Embed(
+            title="↕️ Queue Reordered",
+            description=f"[{song.title or 'Unknown'}]({song.webpage_url or ''}) is now **#{destination}**",
+            color=discord.Color.blue()
+        )
+        await interaction.response.send_message(embed=embed)
+
+    @app_commands.command(name="shuffle", description="Shuffles the queue")
+    async def shuffle(self, interaction: discord.Interaction):
+        """Shuffles the upcoming songs."""
+        player = self.players.get(interaction.guild.id)
+        if not player or len(player.queue) < 2:
+            return await interaction.response.send_message('❌ Not enough songs in the queue to shuffle!', ephemeral=True)
+
+        player.queue.shuffle()
+        self.save_state()
+
+        embed = discord.Embed(
+            title="🔀 Queue Shuffled",
+            description=f"Shuffled **{len(player.queue)}** songs for {interaction.user.mention}",
+            color=discord.Color.blue()
+        )
+        await interaction.response.send_message(embed=embed)
+
+    def render_queue_page(self, player, page):
+        """Builds (or reuses) the embed for one page of a guild's queue.
+
+        Pages are cached on the player and only rebuilt after the queue or the
+        current song changes, so flipping pages costs a dict lookup.
+        """
+        key = (player.queue.version, id(player.current))
+        if player.queue_pages_key != key:
+            player.queue_pages = {}
+            player.queue_pages_key = key
+
+        page_count = max(1, -(-len(player.queue) // QUEUE_PAGE_SIZE))
+        page = max(0, min(page, page_count - 1))
+        if page in player.queue_pages:
+            return player.queue_pages[page], page, page_count
 
-        player = self.get_player(interaction)
-        
-        # Build formatted queue list with better presentation
         fmt = ""
-        total_duration = 0
-        
+        total_duration = player.queue.total_duration
+
         # Show currently playing song first
         if player.current:
             current = player.current
             if isinstance(current, YTDLSource):
                 title = current.title
                 url = current.webpage_url
-                duration = current.duration
+                duration = current.duration or 0
             else:
                 title = "Unknown"
                 url = None
@@ -948,47 +1959,17 @@ class Music(commands.Cog):
                 fmt += f"▶️ **Now Playing:** [{display_title}]({url}) • `{duration_str}`\n\n"
             else:
                 fmt += f"▶️ **Now Playing:** {display_title} • `{duration_str}`\n\n"
-        
-        # Check if queue has upcoming songs
-        if not player.queue._queue:
-            if not player.current:
-                empty_embed = discord.Embed(
-                    title="📭 Queue is Empty",
-                    description="No songs are currently queued.\n\n💡 Use `/play` to add some tracks!",
-                    color=discord.Color.light_gray()
-                )
-                return await interaction.response.send_message(embed=empty_embed)
-            else:
-                # Only current song, no upcoming
-                embed = discord.Embed(
-                    title='📜 Queue — 1 Track',
-                    description=fmt,
-                    color=discord.Color.blue()
-                )
-                
-                if total_duration > 0:
-                    total_mins = int(total_duration // 60)
-                    total_secs = int(total_duration % 60)
-                    time_str = f"{total_mins}m {total_secs}s"
-                    embed.set_footer(text=f"⏱️ Total Duration: {time_str}")
-                
-                return await interaction.response.send_message(embed=embed)
 
-        upcoming = list(player.queue._queue)
-        fmt += "**Up Next:**\n"
+        # Only the songs on this page are formatted
+        start = page * QUEUE_PAGE_SIZE
+        upcoming = player.queue.slice(start, start + QUEUE_PAGE_SIZE)
+        if upcoming:
+            fmt += "**Up Next:**\n"
         
-        for i, song in enumerate(upcoming):
-            # Handle both dict (pre-download) and YTDLSource (legacy)
-            if isinstance(song, dict):
-                title = song.get('title', 'Unknown Title')
-                url = song.get('webpage_url', '')
-                duration = song.get('duration', 0)
-            else:
-                title = song.title
-                url = song.webpage_url
-                duration = song.duration
-            
-            total_duration += duration
+        for i, song in enumerate(upcoming, start + 1):
+            title = song.title or 'Unknown Title'
+            url = song.webpage_url or ''
+            duration = song.duration or 0
             
             # Format duration cleanly
             mins = int(duration // 60)
@@ -999,24 +1980,29 @@ class Music(commands.Cog):
             display_title = title[:45] + "..." if len(title) > 45 else title
             
             # Clean numbered list with duration
-            line = f"`{i + 1}.` [{display_title}]({url}) • `{duration_str}`\n"
-            
-            if len(fmt) + len(line) > 3800:  # Leave room for footer
-                fmt += f"\n*...and {len(upcoming) - i} more*"
-                break
-            fmt += line
+            fmt += f"`{i}.` [{display_title}]({url}) • `{duration_str}`\n"
 
         # Create modern queue embed
         total_tracks = 1 if player.current else 0
-        total_tracks += len(upcoming)
+        total_tracks += len(player.queue)
         
         embed = discord.Embed(
             title=f'📜 Queue — {total_tracks} Track{"s" if total_tracks != 1 else ""}',
             description=fmt,
             color=discord.Color.blue()
         )
+
+        # Who filled the queue, from the counts the queue maintains
+        requesters = player.queue.requester_counts.most_common(3)
+        if requesters:
+            others = len(player.queue.requester_counts) - len(requesters)
+            value = " • ".join(f"{name} ({count})" for name, count in requesters)
+            if others > 0:
+                value += f" • {others} more"
+            embed.add_field(name="👥 Queued By", value=value[:1024], inline=False)
         
         # Format total duration nicely
+        footer = f"📄 Page {page + 1}/{page_count}"
         if total_duration > 0:
             total_mins = int(total_duration // 60)
             total_secs = int(total_duration % 60)
@@ -1029,46 +2015,47 @@ class Music(commands.Cog):
             else:
                 time_str = f"{total_mins}m {total_secs}s"
             
-            embed.set_footer(text=f"⏱️ Total Duration: {time_str}")
-        
-        await interaction.response.send_message(embed=embed)
+            footer = f"⏱️ Total Duration: {time_str} • {footer}"
+        embed.set_footer(text=footer)
+
+        player.queue_pages[page] = embed
+        return embed, page, page_count
+
+    @app_commands.command(name="queue", description="Shows the queue")
+    async def queue_info(self, interaction: discord.Interaction):
+        """Shows the queue one page at a time."""
+        vc = interaction.guild.voice_client
+        if not vc or not vc.is_connected():
+            return await interaction.response.send_message('❌ I\'m not currently connected to a voice channel!', ephemeral=True)
+
+        player = self.get_player(interaction)
+
+        if not player.queue and not player.current:
+            empty_embed = discord.Embed(
+                title="📭 Queue is Empty",
+                description="No songs are currently queued.\n\n💡 Use `/play` to add some tracks!",
+                color=discord.Color.light_gray()
+            )
+            return await interaction.response.send_message(embed=empty_embed)
+
+        embed, page, page_count = self.render_queue_page(player, 0)
+        if page_count > 1:
+            view = QueueView(self, interaction.guild.id)
+            view.update_buttons(page, page_count)
+            await interaction.response.send_message(embed=embed, view=view)
+        else:
+            await interaction.response.send_message(embed=embed)
 
 
     @app_commands.command(name="cache", description="Shows cache statistics")
     async def cache_info(self, interaction: discord.Interaction):
         """Display cache statistics."""
-        if not os.path.exists('songs'):
-            return await interaction.response.send_message('❌ Cache directory not found!', ephemeral=True)
-        
-        # Count files
-        total_songs = 0
-        total_size = 0
-        audio_files = []
-        
-        for filename in os.listdir('songs'):
-            filepath = os.path.join('songs', filename)
-            if os.path.isfile(filepath):
-                file_size = os.path.getsize(filepath)
-                total_size += file_size
-                
-                # Count only audio files (not .json or .part files)
-                if not filename.endswith(('.json', '.part', '.ytdl', '.temp')):
-                    total_songs += 1
-                    
-                    # Try to get friendly name from .info.json
-                    video_id = filename.rsplit('.', 1)[0]  # Remove extension
-                    info_path = os.path.join('songs', f'{video_id}.info.json')
-                    friendly_name = filename  # Default to filename
-                    
-                    if os.path.exists(info_path):
-                        try:
-                            with open(info_path, 'r') as f:
-                                info = json.load(f)
-                                friendly_name = info.get('title', filename)
-                        except:
-                            pass  # Use filename if JSON reading fails
-                    
-                    audio_files.append((friendly_name, file_size, video_id))
+        # Walk the sharded cache in the executor
+        def scan():
+            return list(storage.iter_audio()), storage.total_size()
+
+        audio, total_size = await self.bot.loop.run_in_executor(None, scan)
+        total_songs = len(audio)
         
         # Format size
         if total_size >= 1_073_741_824:  # >= 1 GB
@@ -1086,24 +2073,21 @@ class Music(commands.Cog):
         )
         
         # Show top 5 largest files
-        if audio_files:
-            audio_files.sort(key=lambda x: x[1], reverse=True)
+        if audio:
+            audio.sort(key=lambda x: x[2], reverse=True)
             top_files = ""
-            for i, (song_title, size, video_id) in enumerate(audio_files[:5], 1):
-                # Get duration from info file
-                info_path = os.path.join('songs', f'{video_id}.info.json')
+            for i, (video_id, filepath, size) in enumerate(audio[:5], 1):
+                # Get friendly name and duration from info file
+                song_title = os.path.basename(filepath)
                 duration_str = "?"
-                if os.path.exists(info_path):
-                    try:
-                        with open(info_path, 'r') as f:
-                            info = json.load(f)
-                            duration = info.get('duration', 0)
-                            if duration:
-                                mins = int(duration // 60)
-                                secs = int(duration % 60)
-                                duration_str = f"{mins}:{secs:02d}"
-                    except:
-                        pass
+                info = self.load_cached_info(video_id)
+                if info:
+                    song_title = info.get('title', song_title)
+                    duration = info.get('duration', 0)
+                    if duration:
+                        mins = int(duration // 60)
+                        secs = int(duration % 60)
+                        duration_str = f"{mins}:{secs:02d}"
                 
                 # Truncate long titles
                 display_name = song_title[:40] + "..." if len(song_title) > 40 else song_title
@@ -1113,6 +2097,14 @@ class Music(commands.Cog):
             if top_files:
                 embed.add_field(name="📊 Largest Files", value=top_files, inline=False)
         
+        if self.hot_cache.enabled:
+            hot = self.hot_cache
+            embed.add_field(
+                name="🔥 Hot Tier (RAM)",
+                value=f"**{len(hot.files)}** songs • {hot.used / 1_048_576:.1f} / {hot.capacity / 1_048_576:.0f} MB • {hot.hits} hits",
+                inline=False
+            )
+
         embed.set_footer(text="💡 Use /play to cache more songs automatically")
         await interaction.response.send_message(embed=embed)
 
@@ -1136,17 +2128,8 @@ class Music(commands.Cog):
             embed.set_image(url=source.thumbnail)
             
         if source.duration:
-            # Calculate progress
-            current_pos = 0
-            if player.playback_start_time:
-                current_pos = int(time.time() - player.playback_start_time)
-            
-            # Adjust for seek position if resumed
-            if hasattr(player, 'seek_position') and player.seek_position > 0:
-                 # This is tricky because seek_position is reset after play starts
-                 # But we can try to estimate if we track it better. 
-                 # For now, simple elapsed time is best effort.
-                 pass
+            # Calculate progress from what has been played
+            current_pos = int(source.position)
 
             total_mins = int(source.duration // 60)
             total_secs = int(source.duration % 60)
@@ -1168,6 +2151,5 @@ class Music(commands.Cog):
         await interaction.response.send_message(embed=embed)
 
 async def setup(bot):
-    if not os.path.exists('songs'):
-        os.makedirs('songs')
+    storage.ensure_dirs()
     await bot.add_cog(Music(bot))
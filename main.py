@@ -3,54 +3,124 @@ from discord.ext import commands
 from discord import app_commands
 import os
 from dotenv import load_dotenv
+import asyncio
+import hashlib
+import json
 import shutil
+import signal
 import subprocess
+from utils.log import setup_logging, get_logger, flush_logging
+from utils.restart import SHUTDOWN_TIMEOUT, RESTARTING_MESSAGE
+from utils import storage
 
 # Load environment variables
 load_dotenv()
 TOKEN = os.getenv('DISCORD_TOKEN')
 
+setup_logging()
+log = get_logger('bot')
+
 # Debug: Check environment and node availability
 os.environ['PATH'] = os.environ.get('PATH', '') + ':/usr/bin:/usr/local/bin'
-print(f"DEBUG: PATH={os.environ.get('PATH')}", flush=True)
-print(f"DEBUG: node path={shutil.which('node')}", flush=True)
+log.debug("PATH=%s", os.environ.get('PATH'))
+log.debug("node path=%s", shutil.which('node'))
 try:
     node_version = subprocess.check_output(['node', '-v'], stderr=subprocess.STDOUT).decode().strip()
-    print(f"DEBUG: node version={node_version}", flush=True)
+    log.info("node version=%s", node_version)
 except Exception as e:
-    print(f"DEBUG: node execution failed: {e}", flush=True)
+    log.warning("node execution failed: %s", e)
+
+class MusicTree(app_commands.CommandTree):
+    async def interaction_check(self, interaction: discord.Interaction):
+        # Between SIGTERM and exit no new work is taken on; the state is being saved
+        if interaction.client.shutting_down:
+            await interaction.response.send_message(RESTARTING_MESSAGE, ephemeral=True)
+            return False
+        return True
 
 class MusicBot(commands.Bot):
     def __init__(self):
         intents = discord.Intents.default()
         intents.message_content = True
-        super().__init__(command_prefix='!', intents=intents)
+        super().__init__(command_prefix='!', intents=intents, tree_cls=MusicTree)
+        self.shutting_down = False
 
     async def setup_hook(self):
         # Load extensions
-        print(f"Current working directory: {os.getcwd()}", flush=True)
+        log.debug("Current working directory: %s", os.getcwd())
         if os.path.exists('./cogs'):
-            print(f"Contents of ./cogs: {os.listdir('./cogs')}", flush=True)
+            log.debug("Contents of ./cogs: %s", os.listdir('./cogs'))
             for filename in os.listdir('./cogs'):
                 if filename.endswith('.py'):
                     try:
                         await self.load_extension(f'cogs.{filename[:-3]}')
-                        print(f'Loaded extension: cogs.{filename[:-3]}', flush=True)
+                        log.info("Loaded extension: cogs.%s", filename[:-3])
                     except Exception as e:
-                        print(f'Failed to load extension cogs.{filename[:-3]}: {e}', flush=True)
+                        log.exception("Failed to load extension cogs.%s: %s", filename[:-3], e)
         else:
-            print("Error: ./cogs directory not found!", flush=True)
+            log.error("./cogs directory not found!")
+
+        # Deploys send SIGTERM; save state and leave voice instead of dying mid-song
+        self.loop.add_signal_handler(signal.SIGTERM, lambda: self.loop.create_task(self.shutdown()))
+
+        await self.sync_commands()
+
+    async def sync_commands(self):
+        """Syncs commands globally, skipped when they haven't changed since the last sync.
+
+        Restarts then don't wait on the sync (or its rate limit) before connecting.
+        Delete songs/state/commands.sha1 to force one.
+        """
+        payload = json.dumps([command.to_dict(self.tree) for command in self.tree.get_commands()], sort_keys=True)
+        digest = hashlib.sha1(payload.encode()).hexdigest()
+        path = storage.state_path('commands.sha1')
+        try:
+            with open(path, 'r') as f:
+                if f.read().strip() == digest:
+                    log.info("Commands unchanged, skipping sync")
+                    return
+        except OSError:
+            pass
 
         # Sync commands globally ONLY
         try:
             synced = await self.tree.sync()
-            print(f"Synced {len(synced)} command(s) globally", flush=True)
+            log.info("Synced %d command(s) globally", len(synced))
+        except Exception as e:
+            log.error("Failed to sync commands: %s", e)
+            return
+        try:
+            with open(path, 'w') as f:
+                f.write(digest)
+        except OSError as e:
+            log.warning("Failed to record command sync: %s", e)
+
+    async def shutdown(self):
+        """Stops taking commands, lets the music cog save its state and leave voice, then exits."""
+        if self.shutting_down:
+            return
+        self.shutting_down = True
+        log.info("SIGTERM received, shutting down")
+        music = self.get_cog('Music')
+        if music:
+            try:
+                await asyncio.wait_for(music.shutdown(), SHUTDOWN_TIMEOUT)
+            except asyncio.TimeoutError:
+                log.warning("Shutdown took over %ds, exiting anyway", SHUTDOWN_TIMEOUT)
+            except Exception as e:
+                log.exception("Error during shutdown: %s", e)
+        try:
+            await asyncio.wait_for(self.close(), 5)
         except Exception as e:
-            print(f"Failed to sync commands: {e}", flush=True)
+            log.warning("Error closing the connection: %s", e)
+        log.info("Shutdown complete")
+        flush_logging()
+        # Executor threads (downloads, lookups) would hold up a normal exit until they finish;
+        # their partial files resume in the next process
+        os._exit(0)
 
     async def on_ready(self):
-        print(f'Logged in as {self.user} (ID: {self.user.id})', flush=True)
-        print('------', flush=True)
+        log.info("Logged in as %s (ID: %s)", self.user, self.user.id)
 
 bot = MusicBot()
 
@@ -72,6 +142,7 @@ async def sync_command(interaction: discord.Interaction):
 
 if __name__ == "__main__":
     if not TOKEN:
-        print("Error: DISCORD_TOKEN not found in .env file.", flush=True)
+        log.error("DISCORD_TOKEN not found in .env file.")
     else:
-        bot.run(TOKEN)
+        # Logging is already configured by setup_logging()
+        bot.run(TOKEN, log_handler=None)
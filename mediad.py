@@ -0,0 +1,123 @@
+import asyncio
+import os
+from aiohttp import web
+from dotenv import load_dotenv
+
+# Same environment as the bot; loaded before the modules that read it
+load_dotenv()
+
+from utils.log import setup_logging, get_logger
+from utils.media import MediaPipeline, collect_partials, encode_error, MEDIAD_URL
+from utils import storage
+
+setup_logging()
+log = get_logger('mediad')
+
+# Address used when MEDIAD_URL is unset
+DEFAULT_URL = 'http://127.0.0.1:8765'
+
+
+class BadRequest(Exception):
+    """A request without the JSON object and fields its route needs."""
+
+
+async def read_payload(request, *fields):
+    """The request's JSON object, raising BadRequest unless every field in `fields` is a non-empty string."""
+    try:
+        payload = await request.json()
+    except ValueError:
+        raise BadRequest("body is not JSON")
+    if not isinstance(payload, dict):
+        raise BadRequest("body is not a JSON object")
+    for field in fields:
+        if not isinstance(payload.get(field), str) or not payload[field]:
+            raise BadRequest(f"missing {field}")
+    return payload
+
+
+@web.middleware
+async def bad_requests(request, handler):
+    """Answers malformed requests with a 400 carrying the encoded error, instead of a 500."""
+    try:
+        return await handler(request)
+    except BadRequest as e:
+        log.warning("Bad request to %s: %s", request.path, e)
+        return web.json_response(encode_error(e), status=400)
+
+
+class MediaDaemon:
+    """Serves the media pipeline to bot processes sharing one songs/ cache.
+
+    Requests are JSON POSTs (/extract, /download, /search, /status) over a Unix
+    socket or localhost HTTP; answers are {"result": ...} or an encoded error.
+    A song requested by several bots at once is extracted and downloaded once.
+    """
+
+    def __init__(self):
+        self.pipeline = MediaPipeline()
+        self.app = web.Application(middlewares=[bad_requests])
+        self.app.add_routes([
+            web.post('/extract', self.extract),
+            web.post('/download', self.download),
+            web.post('/search', self.search),
+            web.post('/status', self.status),
+        ])
+        self.app.on_startup.append(self.start_upkeep)
+        self.app.on_cleanup.append(self.stop_upkeep)
+        self._tasks = []
+
+    async def _answer(self, call):
+        try:
+            result = await call()
+        except Exception as e:
+            return web.json_response(encode_error(e))
+        return web.json_response({'result': result})
+
+    async def extract(self, request):
+        payload = await read_payload(request, 'url')
+        return await self._answer(lambda: self.pipeline.extract(payload['url']))
+
+    async def download(self, request):
+        payload = await read_payload(request, 'url')
+        log.debug("Download requested", extra={'track_id': payload.get('id')})
+        return await self._answer(
+            lambda: self.pipeline.download(payload.get('id'), payload['url'], warm=payload.get('warm', False))
+        )
+
+    async def search(self, request):
+        payload = await read_payload(request, 'query')
+        return await self._answer(lambda: self.pipeline.search(payload['query'], payload.get('count', 5)))
+
+    async def status(self, request):
+        async def daemon_status():
+            return {**await self.pipeline.status(), 'daemon': True}
+        return await self._answer(daemon_status)
+
+    async def start_upkeep(self, app):
+        loop = asyncio.get_running_loop()
+        storage.ensure_dirs()
+        self._tasks = [
+            loop.create_task(storage.migrate_flat_layout(loop)),
+            loop.create_task(collect_partials(self.pipeline.active_downloads)),
+        ]
+
+    async def stop_upkeep(self, app):
+        for task in self._tasks:
+            task.cancel()
+
+    def run(self, url):
+        if url.startswith('unix:'):
+            path = url[len('unix:'):]
+            # A socket left by a previous run would make the bind fail
+            if os.path.exists(path):
+                os.remove(path)
+            log.info("Media daemon listening on %s", path)
+            web.run_app(self.app, path=path, print=None)
+        else:
+            host, _, port = url.split('://', 1)[-1].rstrip('/').rpartition(':')
+            log.info("Media daemon listening on %s:%s", host, port)
+            web.run_app(self.app, host=host, port=int(port), print=None)
+
+
+if __name__ == "__main__":
+    MediaDaemon().run(MEDIAD_URL or DEFAULT_URL)
@@ -0,0 +1,667 @@
+"""Replays a recorded command trace against the Music cog, without Discord or YouTube.
+
+    COMMAND_TRACE=songs/state/trace.jsonl        (on the bot, to record traffic)
+    python scripts/replay_trace.py trace.jsonl [--speed 10] [--audio song.opus] [--json]
+
+Commands, autocompletes and button clicks are fed to the real cog at their
+recorded times (--speed 10 plays an hour of traffic in six minutes). Discord
+is replaced by in-memory guilds, channels and interactions, and voice
+connections by a player thread that reads the audio source every 20 ms (sped
+up like the trace) the way discord.py does. yt-dlp is replaced by a stand-in
+that answers lookups and "downloads" the --audio file after the configured
+delays, so the same trace always asks for the same songs.
+
+Everything runs in a scratch directory (--workdir, a new temporary one by
+default), so the bot's own cache and state are never touched. The report
+gives latency distributions per command (time to the first response and to
+completion), how long /play took to start the audio, event loop lag, CPU
+time, peak memory and the audio budget's decisions. --json prints the same
+numbers for comparing two runs.
+"""
+import argparse
+import asyncio
+import ctypes.util
+import hashlib
+import itertools
+import json
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# The replay must not reach the media daemon, warm the real cache or record itself
+os.environ['MEDIAD_URL'] = ''
+os.environ['CACHE_WARMER'] = '0'
+os.environ['HOT_CACHE_DIR'] = ''
+os.environ['COMMAND_TRACE'] = ''
+os.environ.setdefault('LOG_FORMAT', 'text')
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+from dotenv import load_dotenv
+
+load_dotenv(os.path.join(ROOT, '.env'))
+
+import discord
+from utils.log import setup_logging
+from utils import ytdl as ytdl_module, media as media_module, storage
+from utils.media import extract_video_id, is_playlist_url
+from utils.budget import budget
+from utils.trace import load_trace
+from cogs import music as music_module
+from cogs.music import Music
+
+
+# Loop lag is sampled this often (seconds)
+LAG_INTERVAL = 0.05
+
+# Songs a stand-in playlist lists
+PLAYLIST_SIZE = 20
+
+# Seconds a button click waits for its message; sped up, a click can arrive before the reply it was on
+COMPONENT_WAIT = 5
+
+
+def percentiles(values):
+    if not values:
+        return None
+    values = sorted(values)
+    pick = lambda q: values[min(len(values) - 1, int(q * len(values)))]
+    return {'n': len(values), 'p50': pick(0.5), 'p90': pick(0.9), 'p99': pick(0.99), 'max': values[-1]}
+
+
+def fake_id(*parts):
+    """A stable 11 character id, shaped like a YouTube video id."""
+    digest = hashlib.sha1('/'.join(map(str, parts)).encode()).hexdigest()
+    return 'R' + digest[:10]
+
+
+class FakeYoutubeDL:
+    """Answers the bot's yt-dlp calls from a local audio file, after fixed delays."""
+
+    def __init__(self, audio, duration, extract_delay, download_delay):
+        self.audio = audio
+        self.ext = audio.rsplit('.', 1)[-1]
+        self.duration = duration
+        self.extract_delay = extract_delay
+        self.download_delay = download_delay
+
+    def add_post_processor(self, *args, **kwargs):
+        pass
+
+    def _info(self, video_id):
+        return {
+            'id': video_id,
+            'title': f"Track {video_id}",
+            'webpage_url': f"https://www.youtube.com/watch?v={video_id}",
+            'duration': self.duration,
+            'uploader': 'replay',
+            'ext': self.ext,
+            'url': self.audio,
+        }
+
+    def extract_info(self, url, download=False, process=True):
+        time.sleep(self.extract_delay)
+        if url.startswith('ytsearch'):
+            count, _, query = url[len('ytsearch'):].partition(':')
+            entries = [self._info(fake_id(query, i)) for i in range(int(count or 1))]
+            return {'entries': entries}
+        if is_playlist_url(url):
+            entries = ({**self._info(fake_id(url, i)), 'url': f"https://www.youtube.com/watch?v={fake_id(url, i)}"}
+                       for i in range(PLAYLIST_SIZE))
+            return {'title': 'Replay playlist', 'webpage_url': url, 'entries': entries}
+        info = self._info(extract_video_id(url) or fake_id(url))
+        if download:
+            self._download(info)
+        return info
+
+    def _download(self, info):
+        time.sleep(self.download_delay)
+        path = storage.audio_path(info['id'], self.ext)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            try:
+                os.link(self.audio, path)
+            except OSError:
+                shutil.copyfile(self.audio, path)
+        meta = storage.info_path(info['id'])
+        os.makedirs(os.path.dirname(meta), exist_ok=True)
+        with open(meta, 'w') as f:
+            json.dump(info, f)
+
+
+class FakeMessage:
+    ids = itertools.count(1)
+
+    def __init__(self, replay, guild_id, kwargs):
+        self.id = next(self.ids)
+        self.replay = replay
+        self.guild_id = guild_id
+        replay.register_view(guild_id, kwargs.get('view'))
+
+    async def edit(self, **kwargs):
+        self.replay.register_view(self.guild_id, kwargs.get('view'))
+        return self
+
+    async def delete(self):
+        pass
+
+
+class FakeChannel:
+    def __init__(self, replay, guild, channel_id, name):
+        self.replay = replay
+        self.guild = guild
+        self.id = channel_id
+        self.name = name
+
+    async def send(self, content=None, **kwargs):
+        return FakeMessage(self.replay, self.guild.id, kwargs)
+
+    async def connect(self, **kwargs):
+        self.guild.voice_client = FakeVoiceClient(self.replay, self.guild, self)
+        return self.guild.voice_client
+
+
+class FakeGuild:
+    def __init__(self, replay, guild_id):
+        self.id = guild_id
+        self.name = f"guild {guild_id}"
+        self.voice_client = None
+        self.text = FakeChannel(replay, self, guild_id * 10 + 1, 'music')
+        self.voice = FakeChannel(replay, self, guild_id * 10 + 2, 'Voice')
+
+    def get_channel(self, channel_id):
+        return {self.text.id: self.text, self.voice.id: self.voice}.get(channel_id)
+
+
+class FakeVoiceClient:
+    """Reads the audio source on its own thread, one frame every 20 ms / speed, like discord.py's player."""
+
+    def __init__(self, replay, guild, channel):
+        self.replay = replay
+        self.guild = guild
+        self.channel = channel
+        self.source = None
+        self._thread = None
+        self._stopped = threading.Event()
+        self._resumed = threading.Event()
+        self._resumed.set()
+
+    def is_connected(self):
+        return self.guild.voice_client is self
+
+    def is_playing(self):
+        return self._thread is not None and self._thread.is_alive() and self._resumed.is_set()
+
+    def is_paused(self):
+        return self._thread is not None and self._thread.is_alive() and not self._resumed.is_set()
+
+    def play(self, source, *, after=None, **encoder_options):
+        self.source = source
+        self._stopped = threading.Event()
+        self._resumed.set()
+        encoder = None
+        if not source.is_opus() and discord.opus.is_loaded():
+            encoder = discord.opus.Encoder(**encoder_options)
+        self.replay.audio_started(self.guild.id)
+        self._thread = threading.Thread(target=self._run, args=(source, after, encoder, self._stopped), daemon=True)
+        self._thread.start()
+
+    def _run(self, source, after, encoder, stopped):
+        interval = 0.02 / self.replay.speed
+        error = None
+        next_frame = time.perf_counter()
+        try:
+            while not stopped.is_set():
+                if not self._resumed.is_set():
+                    self._resumed.wait()
+                    next_frame = time.perf_counter()
+                    continue
+                data = source.read()
+                if not data:
+                    break
+                if encoder is not None:
+                    encoder.encode(data, encoder.SAMPLES_PER_FRAME)
+                next_frame += interval
+                delay = next_frame - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                else:
+                    self.replay.late_frames += 1
+        except Exception as e:
+            error = e
+        if after is not None:
+            after(error)
+
+    def pause(self):
+        self._resumed.clear()
+
+    def resume(self):
+        self._resumed.set()
+
+    def stop(self):
+        self._stopped.set()
+        self._resumed.set()
+
+    async def disconnect(self, *, force=False):
+        self.stop()
+        self.guild.voice_client = None
+
+    async def move_to(self, channel):
+        self.channel = channel
+
+
+class FakeUser:
+    def __init__(self, user_hash):
+        self.id = int(user_hash, 16) if user_hash else 0
+        self.name = f"user-{user_hash}"
+        self.mention = f"<@{self.id}>"
+        self.voice = None
+
+    def __str__(self):
+        return self.name
+
+
+class FakeVoiceState:
+    def __init__(self, channel):
+        self.channel = channel
+
+
+class FakeResponse:
+    def __init__(self, interaction):
+        self.interaction = interaction
+        self._done = False
+
+    def is_done(self):
+        return self._done
+
+    def _respond(self, kwargs=None):
+        if not self._done:
+            self._done = True
+            self.interaction.acked = time.perf_counter()
+        if kwargs:
+            self.interaction.replay.register_view(self.interaction.guild_id, kwargs.get('view'))
+
+    async def send_message(self, content=None, **kwargs):
+        self._respond(kwargs)
+
+    async def defer(self, **kwargs):
+        self._respond()
+
+    async def edit_message(self, **kwargs):
+        self._respond(kwargs)
+
+    async def autocomplete(self, choices):
+        self._respond()
+
+
+class FakeFollowup:
+    def __init__(self, interaction):
+        self.interaction = interaction
+
+    async def send(self, content=None, **kwargs):
+        return FakeMessage(self.interaction.replay, self.interaction.guild_id, kwargs)
+
+
+class FakeInteraction:
+    def __init__(self, replay, guild, user):
+        self.replay = replay
+        self.client = replay.bot
+        self.guild = guild
+        self.guild_id = guild.id
+        self.channel = guild.text
+        self.channel_id = guild.text.id
+        self.user = user
+        self.response = FakeResponse(self)
+        self.followup = FakeFollowup(self)
+        self.acked = None
+
+    async def edit_original_response(self, **kwargs):
+        return FakeMessage(self.replay, self.guild_id, kwargs)
+
+    async def delete_original_response(self):
+        pass
+
+    async def original_response(self):
+        return FakeMessage(self.replay, self.guild_id, {})
+
+
+class FakeBot:
+    def __init__(self, replay):
+        self.replay = replay
+        self.loop = asyncio.get_running_loop()
+        self.cogs = {}
+        self.closed = False
+
+    def get_cog(self, name):
+        return self.cogs.get(name)
+
+    def get_guild(self, guild_id):
+        return self.replay.guilds.get(guild_id)
+
+    def is_closed(self):
+        return self.closed
+
+    async def wait_until_ready(self):
+        pass
+
+    async def change_presence(self, **kwargs):
+        pass
+
+
+class Replay:
+    """Feeds trace events to the cog and collects latencies and resource use."""
+
+    def __init__(self, events, speed, audio):
+        self.events = events
+        self.speed = speed
+        self.audio = audio
+        self.guilds = {}
+        self.users = {}
+        self.views = {}  # guild_id -> views that were sent, newest last
+        self.ack = {}  # command name -> seconds to the first response
+        self.done = {}  # command name -> seconds to completion
+        self.errors = {}
+        self.skipped = {}
+        self.audio_start = []  # seconds from /play to its song starting
+        self.waiting_play = {}  # guild_id -> perf_counter of the /play still waiting for audio
+        self.lag = []
+        self.late_frames = 0
+        self.peak_ffmpeg = 0
+        self.peak_threads = 0
+        self.bot = None
+        self.cog = None
+
+    def guild(self, guild_id):
+        guild_id = guild_id or 0
+        if guild_id not in self.guilds:
+            self.guilds[guild_id] = FakeGuild(self, guild_id)
+        return self.guilds[guild_id]
+
+    def user(self, user_hash):
+        if user_hash not in self.users:
+            self.users[user_hash] = FakeUser(user_hash)
+        return self.users[user_hash]
+
+    def register_view(self, guild_id, view):
+        if view is not None:
+            views = self.views.setdefault(guild_id, [])
+            views.append(view)
+            del views[:-20]
+
+    def audio_started(self, guild_id):
+        started = self.waiting_play.pop(guild_id, None)
+        if started is not None:
+            self.audio_start.append(time.perf_counter() - started)
+
+    def query(self, value):
+        """The text a sanitised query option is replayed as."""
+        if not isinstance(value, dict):
+            return str(value)
+        if value.get('random'):
+            return 'random'
+        if 'video' in value:
+            return f"https://www.youtube.com/watch?v={value['video']}"
+        if 'playlist' in value:
+            return f"https://www.youtube.com/playlist?list=PL{value['playlist']}"
+        if 'query' in value:
+            # Same length as what was typed, for the autocomplete index
+            text = f"replay {value['query']} "
+            return (text * (value.get('length', len(text)) // len(text) + 1))[:max(1, value.get('length', len(text)))]
+        return f"replay {value.get('hash') or value.get('url')}"
+
+    def options(self, options):
+        values = {}
+        for name, value in (options or {}).items():
+            if name == 'songs' and isinstance(value, list):
+                # Recorded with the same split /playmany uses, so each part is one song again
+                values[name] = ' | '.join(self.query(part) for part in value)
+            elif name in ('search', 'current'):
+                values[name] = self.query(value)
+            elif isinstance(value, dict):
+                values[name] = self.query(value)
+            else:
+                values[name] = value
+        return values
+
+    async def dispatch(self, event):
+        guild = self.guild(event.get('guild'))
+        user = self.user(event.get('user'))
+        user.voice = FakeVoiceState(guild.voice) if event.get('voice') else None
+        interaction = FakeInteraction(self, guild, user)
+
+        kind = event['kind']
+        if kind == 'component':
+            name = f"button {event.get('id')}"
+            call = await self.component(guild.id, event.get('id'))
+        elif kind == 'autocomplete':
+            name = f"autocomplete {event.get('name')}"
+            call = self.autocomplete(event.get('name'), self.options(event.get('options')))
+        else:
+            name = f"/{event.get('name')}"
+            call = self.command(event.get('name'), self.options(event.get('options')))
+        if call is None:
+            self.skipped[name] = self.skipped.get(name, 0) + 1
+            return
+
+        if name == '/play' and not (guild.voice_client and guild.voice_client.is_playing()):
+            self.waiting_play[guild.id] = time.perf_counter()
+        started = time.perf_counter()
+        try:
+            await call(interaction)
+        except Exception as e:
+            self.errors.setdefault(name, []).append(f"{type(e).__name__}: {e}")
+        finished = time.perf_counter()
+        self.done.setdefault(name, []).append(finished - started)
+        self.ack.setdefault(name, []).append((interaction.acked or finished) - started)
+
+    def command(self, name, options):
+        command = self.commands.get(name)
+        if command is None:
+            return None
+        return lambda interaction: command.callback(self.cog, interaction, **options)
+
+    def autocomplete(self, name, options):
+        if name != 'play':
+            return None
+        current = options.get('search', '')
+
+        async def call(interaction):
+            await self.cog.play_autocomplete(interaction, current)
+            await interaction.response.autocomplete([])
+        return call
+
+    async def component(self, guild_id, custom_id):
+        """The callback of the newest button with this id in the guild, once one was sent."""
+        deadline = time.perf_counter() + COMPONENT_WAIT
+        while True:
+            for view in reversed(self.views.get(guild_id, [])):
+                if view.is_finished():
+                    continue
+                for item in view.children:
+                    if getattr(item, 'custom_id', None) == custom_id:
+                        return item.callback
+            if time.perf_counter() >= deadline:
+                return None
+            await asyncio.sleep(LAG_INTERVAL)
+
+    async def measure(self):
+        """Samples event loop lag and the audio pipelines while the replay runs."""
+        while True:
+            expected = time.perf_counter() + LAG_INTERVAL
+            await asyncio.sleep(LAG_INTERVAL)
+            self.lag.append(max(0.0, time.perf_counter() - expected))
+            self.peak_ffmpeg = max(self.peak_ffmpeg, budget.ffmpeg_count())
+            self.peak_threads = max(self.peak_threads, threading.active_count())
+
+    async def run(self, tail):
+        self.bot = FakeBot(self)
+        self.cog = Music(self.bot)
+        self.bot.cogs['Music'] = self.cog
+        self.commands = {command.qualified_name: command for command in self.cog.walk_app_commands()}
+        sampler = asyncio.get_running_loop().create_task(self.measure())
+
+        started_cpu = os.times()
+        started = time.perf_counter()
+        first = self.events[0]['t'] if self.events else 0
+        tasks = []
+        for event in self.events:
+            delay = (event['t'] - first) / self.speed - (time.perf_counter() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            tasks.append(asyncio.get_running_loop().create_task(self.dispatch(event)))
+        await asyncio.gather(*tasks)
+        # Let queued songs start and downloads settle before measuring the end
+        await asyncio.sleep(tail)
+        elapsed = time.perf_counter() - started
+        ended_cpu = os.times()
+
+        sampler.cancel()
+        self.bot.closed = True
+        for guild in list(self.guilds.values()):
+            if guild.voice_client:
+                await guild.voice_client.disconnect()
+
+        return self.report(elapsed, started_cpu, ended_cpu)
+
+    def report(self, elapsed, started_cpu, ended_cpu):
+        names = sorted(set(self.done) | set(self.errors))
+        return {
+            'events': len(self.events),
+            'speed': self.speed,
+            'elapsed': elapsed,
+            'commands': {
+                name: {
+                    'ack': percentiles(self.ack.get(name, [])),
+                    'done': percentiles(self.done.get(name, [])),
+                    'errors': len(self.errors.get(name, [])),
+                    'first_error': (self.errors.get(name) or [None])[0],
+                } for name in names
+            },
+            'skipped': self.skipped,
+            'audio_start': percentiles(self.audio_start),
+            'loop_lag': percentiles(self.lag),
+            'late_frames': self.late_frames,
+            'cpu': {
+                'user': ended_cpu.user - started_cpu.user,
+                'system': ended_cpu.system - started_cpu.system,
+                'children': (ended_cpu.children_user + ended_cpu.children_system
+                             - started_cpu.children_user - started_cpu.children_system),
+            },
+            'peak_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            'peak_ffmpeg': self.peak_ffmpeg,
+            'peak_threads': self.peak_threads,
+            'budget': budget.status()['counts'],
+            'guilds': len(self.guilds),
+        }
+
+
+def ms(stats, key):
+    return f"{stats[key] * 1000:8.1f}" if stats else f"{'-':>8}"
+
+
+def print_report(report):
+    print(f"Replayed {report['events']} events at {report['speed']}x in {report['elapsed']:.1f}s "
+          f"across {report['guilds']} guilds")
+    print()
+    print(f"{'command':<28}{'n':>6}{'ack p50':>10}{'p90':>8}{'p99':>8}{'done p50':>10}{'p90':>8}{'p99':>8}{'max':>8}{'err':>5}")
+    for name, stats in report['commands'].items():
+        ack, done = stats['ack'], stats['done']
+        n = done['n'] if done else 0
+        print(f"{name:<28}{n:>6}  {ms(ack, 'p50')}{ms(ack, 'p90')}{ms(ack, 'p99')}  {ms(done, 'p50')}"
+              f"{ms(done, 'p90')}{ms(done, 'p99')}{ms(done, 'max')}{stats['errors']:>5}")
+    print("(milliseconds)")
+    for name, stats in report['commands'].items():
+        if stats['first_error']:
+            print(f"  {name}: {stats['errors']} errors, first: {stats['first_error']}")
+    if report['skipped']:
+        print("Not replayable: " + ", ".join(f"{name} x{count}" for name, count in report['skipped'].items()))
+    print()
+
+    start, lag = report['audio_start'], report['loop_lag']
+    if start:
+        print(f"/play to audio      p50 {start['p50']:.2f}s  p90 {start['p90']:.2f}s  max {start['max']:.2f}s  ({start['n']} songs)")
+    if lag:
+        print(f"Event loop lag      p50 {lag['p50'] * 1000:.1f}ms  p99 {lag['p99'] * 1000:.1f}ms  max {lag['max'] * 1000:.1f}ms")
+    print(f"Late audio frames   {report['late_frames']}")
+    cpu = report['cpu']
+    print(f"CPU                 {cpu['user']:.2f}s user  {cpu['system']:.2f}s system  {cpu['children']:.2f}s ffmpeg "
+          f"({(cpu['user'] + cpu['system'] + cpu['children']) / max(report['elapsed'], 1e-9):.2f} cores)")
+    print(f"Peak memory         {report['peak_rss_mb']:.0f} MB  •  {report['peak_ffmpeg']} ffmpeg  •  {report['peak_threads']} threads")
+    counts = report['budget']
+    print(f"Audio budget        {counts['play']} played  {counts['waited']} waited  {counts['degraded']} degraded  {counts['busy']} refused")
+
+
+def make_audio(workdir, duration):
+    """A sine tone in 20 ms Ogg Opus, so replays need no real music."""
+    path = os.path.join(workdir, 'replay.opus')
+    subprocess.run(
+        ['ffmpeg', '-v', 'error', '-y', '-f', 'lavfi', '-i', f"sine=frequency=440:duration={duration}",
+         '-ac', '2', '-ar', '48000', '-c:a', 'libopus', '-b:a', '96k', '-frame_duration', '20', path],
+        check=True
+    )
+    return path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a recorded command trace against the Music cog")
+    parser.add_argument('trace', help="JSON-lines trace recorded with COMMAND_TRACE")
+    parser.add_argument('--speed', type=float, default=1.0, help="Time compression, e.g. 10 for ten times faster (default 1)")
+    parser.add_argument('--audio', help="Audio file every song is played from (default: a generated tone, needs ffmpeg)")
+    parser.add_argument('--duration', type=int, default=180, help="Song length in seconds for the generated tone and metadata")
+    parser.add_argument('--extract-delay', type=float, default=0.3, help="Seconds a stand-in lookup takes (default 0.3)")
+    parser.add_argument('--download-delay', type=float, default=1.0, help="Seconds a stand-in download takes (default 1.0)")
+    parser.add_argument('--limit', type=int, help="Only replay the first N events")
+    parser.add_argument('--tail', type=float, default=5.0, help="Seconds to keep running after the last event")
+    parser.add_argument('--workdir', help="Scratch directory for the cache and state (default: a new temporary one)")
+    parser.add_argument('--seed', type=int, default=0, help="Random seed (shuffle, random songs)")
+    parser.add_argument('--json', action='store_true', help="Print the report as JSON")
+    args = parser.parse_args()
+    setup_logging()
+
+    events = load_trace(os.path.abspath(args.trace))
+    if args.limit:
+        events = events[:args.limit]
+    if not events:
+        parser.error("the trace has no events")
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='replay-')
+    os.makedirs(workdir, exist_ok=True)
+    audio = os.path.abspath(args.audio) if args.audio else None
+    # songs/ is relative to the working directory
+    os.chdir(workdir)
+    if audio is None:
+        if not shutil.which('ffmpeg'):
+            parser.error("ffmpeg isn't installed; pass an audio file with --audio")
+        audio = make_audio(workdir, args.duration)
+
+    random.seed(args.seed)
+    if not discord.opus.is_loaded() and ctypes.util.find_library('opus'):
+        # PCM songs are encoded like the real voice client does; skipped without libopus
+        discord.opus.load_opus(ctypes.util.find_library('opus'))
+
+    stand_in = FakeYoutubeDL(audio, args.duration, args.extract_delay, args.download_delay)
+    for module in (ytdl_module, media_module):
+        module.ytdl = stand_in
+        module.ytdl_warm = stand_in
+    ytdl_module.ytdl_flat = stand_in
+    music_module.ytdl_flat = stand_in
+
+    replay = Replay(events, args.speed, audio)
+    report = asyncio.run(replay.run(args.tail))
+    report['workdir'] = workdir
+    if args.json:
+        print(json.dumps(report, indent=2))
+    else:
+        print_report(report)
+
+
+if __name__ == "__main__":
+    main()
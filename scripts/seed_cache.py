@@ -0,0 +1,422 @@
+"""Pre-seeds the song cache without playing anything through Discord.
+
+    python scripts/seed_cache.py urls.txt [more.txt ...] [--workers 4]
+    python scripts/seed_cache.py --local ~/Music [--workers 4] [--bitrate 128]
+
+URL lists have one video or playlist URL per line (blank lines and # comments
+are ignored, - reads stdin). Downloads use the bot's yt-dlp settings, or the
+media daemon when MEDIAD_URL is set, so a song a bot is fetching at the same
+time is only downloaded once.
+
+--local imports audio files from directories. Files from another node's cache
+(a songs/ tree with audio/ and meta/, or the old flat layout with <id>.<ext>
+next to <id>.info.json) are copied as they are, under their id; anything else is
+transcoded by ffmpeg to 20 ms Opus in Ogg, which the bot plays without ffmpeg,
+and gets a stable id derived from the file's content.
+
+Files are written to a temporary name and renamed into the cache, audio
+before metadata, so a running bot never sees half a song. Songs already in
+the cache are skipped, so an interrupted run can simply be restarted.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+# songs/ is relative to the bot's working directory
+os.chdir(ROOT)
+
+from dotenv import load_dotenv
+
+load_dotenv()
+os.environ.setdefault('LOG_FORMAT', 'text')
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+from utils.log import setup_logging
+from utils.media import media, extract_video_id, is_playlist_url, write_seek_index, MAX_DURATION
+from utils.extract_guard import Unplayable, ExtractorUnavailable, short_reason
+from utils.track import load_info
+from utils.ytdl import ytdl_flat
+from utils import storage
+
+AUDIO_EXTENSIONS = ('.mp3', '.flac', '.wav', '.m4a', '.aac', '.ogg', '.opus', '.webm', '.mka', '.wma', '.aiff')
+
+# A partial download touched this recently (seconds) belongs to someone else, e.g. the live bot
+BUSY_WINDOW = 60
+
+# Throttled downloads are retried this many times, after the breaker's cooldown
+THROTTLE_RETRIES = 3
+
+# Local files already imported: (path, size, mtime) -> id, so a rerun doesn't hash them again
+MANIFEST = storage.state_path('seeded.jsonl')
+
+
+class Report:
+    """Counts outcomes and prints one line per song."""
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.total = 0
+        self.seen = 0
+        self.seeded = 0
+        self.bytes = 0
+        self.cached = 0
+        self.busy = 0
+        self.failures = []
+
+    def line(self, status, name, detail=''):
+        self.seen += 1
+        print(f"[{self.seen}/{self.total}] {status:<8} {name}{f'  ({detail})' if detail else ''}", flush=True)
+
+    def done(self, name, size):
+        self.seeded += 1
+        self.bytes += size
+        self.line('seeded', name, f"{size / 1_048_576:.1f} MB")
+
+    def skip(self, name):
+        self.cached += 1
+        self.line('cached', name)
+
+    def defer(self, name):
+        self.busy += 1
+        self.line('busy', name, "being downloaded elsewhere, rerun later")
+
+    def fail(self, name, reason):
+        self.failures.append((name, reason))
+        self.line('failed', name, reason)
+
+    def summary(self):
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        print()
+        print(f"Seeded {self.seeded} songs ({self.bytes / 1_048_576:.1f} MB) in {elapsed:.1f}s: "
+              f"{self.seeded / elapsed:.2f} songs/s, {self.bytes / 1_048_576 / elapsed:.2f} MB/s")
+        print(f"Skipped {self.cached} already cached, {self.busy} busy; {len(self.failures)} failed")
+        for name, reason in self.failures:
+            print(f"  {name}: {reason}")
+
+
+def cached_audio(video_id):
+    """The cached audio file for a video id, if both audio and metadata are in the cache."""
+    info = load_info(video_id)
+    if info is None:
+        return None
+    return storage.find_audio(video_id, info.get('ext'))
+
+
+def downloading_elsewhere(video_id):
+    """True if a partial download of this video was written to in the last BUSY_WINDOW seconds."""
+    directory = os.path.dirname(storage.audio_path(video_id, ''))
+    cutoff = time.time() - BUSY_WINDOW
+    try:
+        with os.scandir(directory) as entries:
+            return any(entry.name.startswith(video_id + '.') and storage.is_partial(entry.name)
+                       and entry.stat().st_mtime > cutoff for entry in entries)
+    except FileNotFoundError:
+        return False
+
+
+def write_json(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, path)
+
+
+def copy_into(source, target):
+    """Copies a file into the cache under a partial name, then renames it into place."""
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    tmp_path = target + '.part'
+    shutil.copyfile(source, tmp_path)
+    os.replace(tmp_path, target)
+
+
+# URL lists -----------------------------------------------------------------
+
+def read_urls(paths):
+    urls = []
+    for path in paths:
+        f = sys.stdin if path == '-' else open(path, 'r')
+        with f:
+            for line in f:
+                line = line.strip()
+                if line and not line.startswith('#'):
+                    urls.append(line)
+    return list(dict.fromkeys(urls))
+
+
+def expand_playlist(url):
+    """(video_id, url) of every entry of a playlist URL. Blocking."""
+    info = ytdl_flat.extract_info(url, download=False, process=False)
+    songs = []
+    for entry in info.get('entries') or []:
+        if not entry or not entry.get('id'):
+            continue
+        entry_url = entry.get('url') or entry.get('webpage_url')
+        if not entry_url or not entry_url.startswith(('http://', 'https://')):
+            entry_url = f"https://www.youtube.com/watch?v={entry['id']}"
+        songs.append((entry['id'], entry_url))
+    return songs
+
+
+async def seed_url(video_id, url, args, slots, report):
+    name = video_id or url
+    if video_id and cached_audio(video_id):
+        return report.skip(name)
+    if video_id and downloading_elsewhere(video_id):
+        return report.defer(name)
+
+    async with slots:
+        for attempt in range(THROTTLE_RETRIES + 1):
+            try:
+                info = await media.download(video_id, url, warm=args.warm)
+                break
+            except ExtractorUnavailable as e:
+                if attempt == THROTTLE_RETRIES:
+                    return report.fail(name, str(e))
+                await asyncio.sleep(e.retry_after + 1)
+            except Unplayable as e:
+                return report.fail(name, e.reason)
+            except Exception as e:
+                return report.fail(name, short_reason(e))
+
+    video_id = info.get('id') or video_id
+    path = storage.find_audio(video_id, info.get('ext'))
+    if path is None:
+        return report.fail(name, "downloaded, but no audio file in the cache")
+    if info.get('duration') and info['duration'] > args.max_duration:
+        # Kept (it is in the cache now), but the bot won't play it
+        return report.fail(name, f"too long ({int(info['duration'] // 60)}m), the bot won't play it")
+    report.done(f"{video_id} {info.get('title') or ''}".strip(), os.path.getsize(path))
+
+
+async def seed_urls(args, slots, report):
+    loop = asyncio.get_running_loop()
+    songs = []
+    for url in read_urls(args.sources):
+        if is_playlist_url(url):
+            try:
+                entries = await loop.run_in_executor(None, expand_playlist, url)
+            except Exception as e:
+                report.fail(url, f"playlist: {e}")
+                continue
+            songs.extend(entries)
+        else:
+            songs.append((extract_video_id(url), url))
+    songs = list(dict.fromkeys(songs))
+    report.total += len(songs)
+    await asyncio.gather(*(seed_url(video_id, url, args, slots, report) for video_id, url in songs))
+
+
+# Local files ---------------------------------------------------------------
+
+def find_files(directories):
+    files = []
+    for directory in directories:
+        for root, _, names in os.walk(directory):
+            for name in sorted(names):
+                if name.lower().endswith(AUDIO_EXTENSIONS):
+                    files.append(os.path.abspath(os.path.join(root, name)))
+    return files
+
+
+def load_manifest():
+    known = {}
+    try:
+        with open(MANIFEST, 'r') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                    known[(record['path'], record['size'], record['mtime'])] = record['id']
+                except (ValueError, KeyError):
+                    continue
+    except FileNotFoundError:
+        pass
+    return known
+
+
+def content_id(path):
+    """An 11 character id from the file's content, shaped like a YouTube id so URL lookups find it."""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1_048_576), b''):
+            digest.update(block)
+    return 'L' + digest.hexdigest()[:10]
+
+
+def probe(path):
+    """(duration, tags) of an audio file via ffprobe."""
+    result = subprocess.run(
+        ['ffprobe', '-v', 'error', '-show_format', '-of', 'json', path],
+        capture_output=True, text=True, check=True
+    )
+    fmt = json.loads(result.stdout).get('format', {})
+    tags = {key.lower(): value for key, value in (fmt.get('tags') or {}).items()}
+    duration = float(fmt['duration']) if fmt.get('duration') else None
+    return duration, tags
+
+
+def cached_copy_info(path):
+    """(video_id, .info.json path) if a file comes from another node's cache, else None.
+
+    Sharded caches keep <songs>/audio/ab/cd/<id>.<ext> with the metadata in
+    <songs>/meta/ab/cd/; flat ones keep <id>.info.json next to the audio.
+    """
+    stem, ext = os.path.splitext(os.path.basename(path))
+    if len(stem) != 11:
+        return None
+    candidates = [os.path.join(os.path.dirname(path), f"{stem}.info.json")]
+    # The same paths below the other node's songs/ as below ours
+    relative = os.path.relpath(storage.audio_path(stem, ext[1:]), storage.SONGS_DIR)
+    if path.endswith(os.sep + relative):
+        songs_root = path[:-len(relative)]
+        candidates.append(os.path.join(songs_root, os.path.relpath(storage.info_path(stem), storage.SONGS_DIR)))
+    for info_file in candidates:
+        if os.path.exists(info_file):
+            return stem, info_file
+    return None
+
+
+def import_cached_copy(path, video_id, info_file):
+    """Copies a song from another node's cache (audio, seek index and .info.json). Blocking."""
+    with open(info_file, 'r') as f:
+        info = json.load(f)
+    ext = info.get('ext') or path.rsplit('.', 1)[-1]
+    target = storage.audio_path(video_id, ext)
+    copy_into(path, target)
+    # The seek index sits next to the metadata in both layouts
+    seek_file = info_file[:-len('.info.json')] + '.seek.json'
+    if os.path.exists(seek_file):
+        copy_into(seek_file, storage.seek_path(video_id))
+    else:
+        write_seek_index(video_id, ext)
+    # Metadata last: a song counts as cached once its .info.json exists
+    copy_into(info_file, storage.info_path(video_id))
+    return info, os.path.getsize(target)
+
+
+def transcode(path, video_id, args):
+    """Transcodes a local file into the cache as Ogg Opus and writes its metadata. Blocking."""
+    duration, tags = probe(path)
+    if duration and duration > args.max_duration:
+        raise ValueError(f"too long ({int(duration // 60)}m)")
+
+    target = storage.audio_path(video_id, 'opus')
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    tmp_path = target + '.part'
+    try:
+        subprocess.run(
+            ['ffmpeg', '-nostdin', '-v', 'error', '-y', '-i', path, '-map', '0:a:0', '-vn',
+             '-c:a', 'libopus', '-b:a', f"{args.bitrate}k", '-ar', '48000', '-ac', '2',
+             '-frame_duration', '20', '-f', 'opus', tmp_path],
+            capture_output=True, text=True, check=True
+        )
+        os.replace(tmp_path, target)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+    info = {
+        'id': video_id,
+        'title': tags.get('title') or os.path.splitext(os.path.basename(path))[0],
+        'uploader': tags.get('artist') or tags.get('album_artist'),
+        'duration': duration,
+        'ext': 'opus',
+        'extractor': 'local',
+        'filename': os.path.basename(path),
+    }
+    write_seek_index(video_id, 'opus')
+    # Metadata last: a song counts as cached once its .info.json exists
+    write_json(storage.info_path(video_id), info)
+    return info, os.path.getsize(target)
+
+
+def seed_file(path, args, manifest):
+    """Imports one local file. Returns (status, video_id, title, size). Blocking."""
+    cached_copy = cached_copy_info(path)
+    if cached_copy:
+        video_id, info_file = cached_copy
+        if cached_audio(video_id):
+            return 'cached', video_id, None, 0
+        info, size = import_cached_copy(path, video_id, info_file)
+        return 'seeded', video_id, info.get('title'), size
+
+    stat = os.stat(path)
+    key = (path, stat.st_size, stat.st_mtime_ns)
+    video_id = manifest.get(key) or content_id(path)
+    if cached_audio(video_id):
+        return 'cached', video_id, None, 0
+    info, size = transcode(path, video_id, args)
+    manifest[key] = video_id
+    with open(MANIFEST, 'a') as f:
+        f.write(json.dumps({'path': path, 'size': stat.st_size, 'mtime': stat.st_mtime_ns, 'id': video_id}) + '\n')
+    return 'seeded', video_id, info.get('title'), size
+
+
+async def seed_local(args, slots, report):
+    loop = asyncio.get_running_loop()
+    if not shutil.which('ffmpeg'):
+        print("ffmpeg not found; only files from another bot's cache can be imported", file=sys.stderr)
+    files = await loop.run_in_executor(None, find_files, args.sources)
+    manifest = await loop.run_in_executor(None, load_manifest)
+    report.total += len(files)
+
+    async def one(path):
+        async with slots:
+            try:
+                status, video_id, title, size = await loop.run_in_executor(None, seed_file, path, args, manifest)
+            except subprocess.CalledProcessError as e:
+                lines = (e.stderr or '').strip().splitlines()
+                return report.fail(path, lines[-1] if lines else f"{e.cmd[0]} exited with {e.returncode}")
+            except Exception as e:
+                return report.fail(path, str(e) or type(e).__name__)
+        if status == 'cached':
+            report.skip(f"{video_id} {path}")
+        else:
+            report.done(f"{video_id} {title or path}", size)
+
+    await asyncio.gather(*(one(path) for path in files))
+
+
+async def main(args):
+    # Downloads and transcodes run in the default executor, one thread per worker
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=args.workers))
+    storage.ensure_dirs()
+    slots = asyncio.Semaphore(args.workers)
+    report = Report()
+    try:
+        if args.local:
+            await seed_local(args, slots, report)
+        else:
+            await seed_urls(args, slots, report)
+    finally:
+        report.summary()
+        if hasattr(media, 'close'):
+            await media.close()
+    return 1 if report.failures else 0
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Pre-seed the song cache from URL lists or local audio files.")
+    parser.add_argument('sources', nargs='+', help="URL list files (- for stdin), or directories with --local")
+    parser.add_argument('--local', action='store_true', help="import audio files from the given directories")
+    parser.add_argument('--workers', type=int, default=4, help="parallel downloads or transcodes (default 4)")
+    parser.add_argument('--bitrate', type=int, default=128, help="Opus bitrate in kbit/s for local files (default 128)")
+    parser.add_argument('--max-duration', type=int, default=MAX_DURATION,
+                        help=f"skip songs longer than this many seconds (default {MAX_DURATION}, the bot's limit)")
+    parser.add_argument('--warm', action='store_true', help="use the rate limited downloader of the cache warmer")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    setup_logging()
+    sys.exit(asyncio.run(main(parse_args())))
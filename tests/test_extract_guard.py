@@ -0,0 +1,39 @@
+import pytest
+from utils.extract_guard import classify
+
+
+@pytest.mark.parametrize('message', [
+    "ERROR: [youtube] abcdefghijk: Video unavailable",
+    "ERROR: [youtube] abcdefghijk: Private video. Sign in if you've been granted access to this video",
+    "ERROR: [youtube] abcdefghijk: Sign in to confirm your age. This video may be inappropriate for some users.",
+    "ERROR: [youtube] abcdefghijk: Video unavailable. This video contains content from SME, who has blocked it on copyright grounds",
+    "ERROR: [youtube] abcdefghijk: This video is no longer available due to a copyright claim by Someone",
+    "ERROR: [youtube] abcdefghijk: The uploader has not made this video available in your country",
+    "ERROR: [youtube] abcdefghijk: This video is not available",
+    "ERROR: [youtube] abcdefghijk: This live event will begin in 3 hours.",
+    "ERROR: Unsupported URL: https://example.com/",
+])
+def test_definitive_failures_are_unplayable(message):
+    assert classify(Exception(message)) == 'unplayable'
+
+
+@pytest.mark.parametrize('message', [
+    "ERROR: [youtube] abcdefghijk: Requested format is not available. Use --list-formats for a list of available formats",
+    "ERROR: [youtube] abcdefghijk: Unable to extract uploader id",
+    "ERROR: [youtube] abcdefghijk: Signature extraction failed: Some formats may be missing",
+    "ERROR: [youtube] abcdefghijk: nsig extraction failed: You may experience throttling for some formats",
+    "ERROR: [youtube] abcdefghijk: Failed to extract any player response",
+    "ERROR: [youtube] abcdefghijk: Unable to download API page: <urlopen error timed out>",
+    "ERROR: [youtube] abcdefghijk: Copyright notice page layout changed",
+    "ERROR: [youtube:tab] This channel does not exist",
+])
+def test_extractor_failures_are_errors(message):
+    assert classify(Exception(message)) == 'error'
+
+
+@pytest.mark.parametrize('message', [
+    "ERROR: [youtube] abcdefghijk: Sign in to confirm you're not a bot",
+    "ERROR: Unable to download webpage: HTTP Error 429: Too Many Requests",
+])
+def test_throttling_is_throttled(message):
+    assert classify(Exception(message)) == 'throttled'
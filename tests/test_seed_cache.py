@@ -0,0 +1,62 @@
+import importlib.util
+import json
+import os
+from utils import storage
+
+SCRIPT = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'scripts', 'seed_cache.py')
+
+
+def load_seed_cache():
+    spec = importlib.util.spec_from_file_location('seed_cache', SCRIPT)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def write(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'wb' if isinstance(data, bytes) else 'w') as f:
+        f.write(data)
+
+
+def test_imports_a_sharded_cache_under_its_ids(tmp_path, monkeypatch):
+    seed_cache = load_seed_cache()
+    video_id = 'dQw4w9WgXcQ'
+    info = {'id': video_id, 'title': 'Never Gonna Give You Up', 'ext': 'opus', 'duration': 213}
+
+    # Another node's songs/ tree, laid out like ours
+    source = tmp_path / 'node'
+    source.mkdir()
+    monkeypatch.chdir(source)
+    write(storage.audio_path(video_id, 'opus'), b'OggS audio')
+    write(storage.info_path(video_id), json.dumps(info))
+    write(storage.seek_path(video_id), '[[0,0]]')
+
+    (tmp_path / 'bot').mkdir()
+    monkeypatch.chdir(tmp_path / 'bot')
+    storage.ensure_dirs()
+    path = os.path.abspath(os.path.join(source, storage.audio_path(video_id, 'opus')))
+    status, seeded_id, title, size = seed_cache.seed_file(path, None, {})
+
+    assert (status, seeded_id, title, size) == ('seeded', video_id, info['title'], len(b'OggS audio'))
+    assert seed_cache.cached_audio(video_id) == storage.audio_path(video_id, 'opus')
+    with open(storage.seek_path(video_id)) as f:
+        assert f.read() == '[[0,0]]'
+
+    # A second run finds it cached
+    assert seed_cache.seed_file(path, None, {})[0] == 'cached'
+
+
+def test_imports_a_flat_cache_under_its_ids(tmp_path, monkeypatch):
+    seed_cache = load_seed_cache()
+    video_id = 'dQw4w9WgXcQ'
+    write(str(tmp_path / 'old' / f'{video_id}.webm'), b'webm audio')
+    write(str(tmp_path / 'old' / f'{video_id}.info.json'), json.dumps({'id': video_id, 'ext': 'webm'}))
+
+    (tmp_path / 'bot').mkdir()
+    monkeypatch.chdir(tmp_path / 'bot')
+    storage.ensure_dirs()
+    status, seeded_id, _, _ = seed_cache.seed_file(str(tmp_path / 'old' / f'{video_id}.webm'), None, {})
+
+    assert (status, seeded_id) == ('seeded', video_id)
+    assert storage.find_info(video_id) == storage.info_path(video_id)
@@ -0,0 +1,260 @@
+import os
+import threading
+from collections import deque
+import discord
+from utils.log import get_logger
+
+log = get_logger('music.broadcast')
+
+# Songs decoded through ffmpeg are encoded once per track and position and shared by every
+# guild playing them in step; BROADCAST=0 gives each guild its own ffmpeg and encoder again
+BROADCAST = os.getenv('BROADCAST', '1') != '0'
+
+# Seconds of encoded packets a feed keeps, so guilds starting a song up to this long after
+# another (or resuming from a short pause) still share its feed
+BROADCAST_BUFFER = float(os.getenv('BROADCAST_BUFFER', '10'))
+
+FRAME_SECONDS = 0.02
+
+
+class FellBehind(Exception):
+    """The packet a listener asked for already left the feed's ring buffer."""
+
+
+class Feed:
+    """One decode and Opus encode of a track from a start position, read by any number of guilds.
+
+    Packets are produced on demand by whichever listener is furthest ahead
+    (on its voice thread, like discord.py's own encoding) and kept in a ring
+    buffer of BROADCAST_BUFFER seconds for the listeners trailing behind.
+    """
+
+    def __init__(self, key, start, pcm, encoder):
+        self.key = key  # (track id, volume, bitrate)
+        self.start = start  # seconds into the track of packet 0
+        self.pcm = pcm
+        self.encoder = encoder
+        self.packets = deque()
+        self.first = 0  # index of packets[0]
+        self.produced = 0
+        self.ended = False
+        self.listeners = 0
+        self.size = 0  # bytes in the ring buffer
+        self.capacity = max(1, int(BROADCAST_BUFFER / FRAME_SECONDS))
+        self.lock = threading.Lock()
+
+    @property
+    def pid(self):
+        process = getattr(self.pcm.original, '_process', None)
+        return None if self.ended else getattr(process, 'pid', None)
+
+    def index_of(self, seconds):
+        return round((seconds - self.start) / FRAME_SECONDS)
+
+    def joinable(self, index):
+        # Within the ring buffer and not past what was decoded (catching up means waiting, not skipping)
+        return not self.ended and self.first <= index <= self.produced
+
+    def _produce(self):
+        data = self.pcm.read()
+        if not data:
+            self.ended = True
+            return
+        packet = self.encoder.encode(data, self.encoder.SAMPLES_PER_FRAME)
+        self.packets.append(packet)
+        self.size += len(packet)
+        self.produced += 1
+        if len(self.packets) > self.capacity:
+            self.size -= len(self.packets.popleft())
+            self.first += 1
+
+    def packet(self, index):
+        """Opus packet number `index`, b'' once the track ended. Raises FellBehind."""
+        with self.lock:
+            while index >= self.produced and not self.ended:
+                self._produce()
+            if index < self.first:
+                raise FellBehind(index)
+            if index >= self.produced:
+                return b''
+            return self.packets[index - self.first]
+
+    def close(self):
+        with self.lock:
+            self.ended = True
+            self.packets.clear()
+            self.size = 0
+        self.pcm.cleanup()
+
+
+class BroadcastSource(discord.AudioSource):
+    """A guild's place in a shared feed. Sends ready Opus packets, so voice clients don't encode.
+
+    Seeking, a volume change or falling behind the ring buffer (a long
+    stall) moves the guild to a feed at its new position, which may itself
+    be shared.
+    """
+
+    def __init__(self, hub, track_id, opener, start, volume, bitrate):
+        self.hub = hub
+        self.track_id = track_id
+        self.opener = opener  # opener(start) -> ffmpeg PCM source from `start` seconds
+        self.volume = volume
+        self.bitrate = bitrate
+        self.feed = None
+        self.index = 0
+        self.sent = start  # seconds into the track of the packet sent last
+        self._lock = threading.Lock()
+        self.move(start)
+
+    @property
+    def position_ms(self):
+        return round(self.sent * 1000)
+
+    @property
+    def pid(self):
+        feed = self.feed
+        return feed.pid if feed else None
+
+    def move(self, seconds):
+        """Continues from `seconds` on whichever feed suits (volume, bitrate), starting one if needed."""
+        feed, index = self.hub.join(self.track_id, self.opener, seconds, self.volume, self.bitrate)
+        with self._lock:
+            old, self.feed, self.index = self.feed, feed, index
+            self.sent = seconds
+        if old is not None:
+            self.hub.leave(old)
+
+    def seek(self, seconds):
+        self.move(seconds)
+
+    def set_volume(self, volume):
+        if volume != self.volume:
+            self.volume = volume
+            self.move(self.sent)
+
+    def read(self):
+        with self._lock:
+            feed, index = self.feed, self.index
+        if feed is None:
+            # Released while paused (see cleanup); rejoin where we stopped
+            self.move(self.sent)
+            with self._lock:
+                feed, index = self.feed, self.index
+        try:
+            data = feed.packet(index)
+        except FellBehind:
+            log.debug("Fell behind the shared feed, continuing on another", extra={'track_id': self.track_id})
+            self.move(feed.start + index * FRAME_SECONDS)
+            return self.read()
+        with self._lock:
+            # A seek on the event loop may have moved us meanwhile; its position wins
+            if self.feed is feed and self.index == index:
+                self.index += 1
+                self.sent = feed.start + index * FRAME_SECONDS
+        return data
+
+    def is_opus(self):
+        return True
+
+    def cleanup(self):
+        with self._lock:
+            feed, self.feed = self.feed, None
+        if feed is not None:
+            self.hub.leave(feed)
+
+
+class BroadcastHub:
+    """Shares ffmpeg decodes and Opus encodes between guilds playing the same track in step.
+
+    A guild asking for a track at some position joins a running feed of the
+    same track, volume and bitrate when that position is still in the feed's
+    ring buffer; otherwise a new feed starts there. A feed closes (and its
+    ffmpeg exits) when its last listener leaves, so CPU follows the number of
+    distinct songs playing rather than the number of guilds.
+    """
+
+    def __init__(self, enabled=BROADCAST):
+        self.enabled = enabled
+        self.feeds = {}  # key -> list of Feeds
+        self.started = 0
+        self.joined = 0
+        self._lock = threading.Lock()
+
+    def _find(self, key, seconds):
+        for feed in self.feeds.get(key, []):
+            index = feed.index_of(seconds)
+            if feed.joinable(index):
+                return feed, index
+        return None, None
+
+    def joinable(self, track_id, seconds, volume, bitrate=None):
+        """True if a song starting now would join a running feed (and so start no ffmpeg)."""
+        with self._lock:
+            return self._find((track_id, volume, bitrate), seconds)[0] is not None
+
+    def open(self, track_id, opener, start, volume, bitrate=None):
+        """A BroadcastSource for a track from `start` seconds, or None where Opus can't be encoded here."""
+        if not self.enabled:
+            return None
+        try:
+            return BroadcastSource(self, track_id, opener, start, volume, bitrate)
+        except discord.opus.OpusNotLoaded:
+            log.warning("libopus isn't available, songs won't share encodes")
+            self.enabled = False
+            return None
+
+    def join(self, track_id, opener, seconds, volume, bitrate):
+        """(feed, packet index) for a listener at `seconds`; counts it as listening."""
+        key = (track_id, volume, bitrate)
+        with self._lock:
+            feed, index = self._find(key, seconds)
+            if feed is not None:
+                feed.listeners += 1
+                self.joined += 1
+                return feed, index
+
+        # Starting ffmpeg and the encoder happens outside the lock; a second feed started
+        # meanwhile for the same position only costs what not sharing would have
+        encoder = discord.opus.Encoder(bitrate=bitrate or 128)
+        pcm = discord.PCMVolumeTransformer(opener(seconds), volume)
+        feed = Feed(key, seconds, pcm, encoder)
+        feed.listeners = 1
+        with self._lock:
+            self.feeds.setdefault(key, []).append(feed)
+            self.started += 1
+        return feed, 0
+
+    def leave(self, feed):
+        with self._lock:
+            feed.listeners -= 1
+            if feed.listeners > 0:
+                return
+            feeds = self.feeds.get(feed.key, [])
+            if feed in feeds:
+                feeds.remove(feed)
+            if not feeds:
+                self.feeds.pop(feed.key, None)
+        feed.close()
+
+    def usage(self):
+        """(feeds, bytes buffered), for the memory guard."""
+        with self._lock:
+            feeds = [feed for feeds in self.feeds.values() for feed in feeds]
+        return len(feeds), sum(feed.size for feed in feeds)
+
+    def status(self):
+        """Feeds and listeners for /debug budget."""
+        with self._lock:
+            feeds = [feed for feeds in self.feeds.values() for feed in feeds]
+        return {
+            'enabled': self.enabled,
+            'feeds': len(feeds),
+            'listeners': sum(feed.listeners for feed in feeds),
+            'buffered': sum(feed.size for feed in feeds),
+            'started': self.started,
+            'joined': self.joined,
+        }
+
+
+broadcast = BroadcastHub()
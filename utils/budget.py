@@ -0,0 +1,276 @@
+import asyncio
+import os
+import time
+from collections import deque
+from utils.log import get_logger
+
+log = get_logger('music.budget')
+
+# Max ffmpeg processes playing at once, across all guilds
+AUDIO_MAX_FFMPEG = int(os.getenv('AUDIO_MAX_FFMPEG', '8'))
+
+# Share of the CPU limit (the container's cgroup quota, else the core count) the bot may use
+# before new ffmpeg songs play at DEGRADED_BITRATE kbps instead of the full 128
+AUDIO_CPU_BUDGET = float(os.getenv('AUDIO_CPU_BUDGET', '0.8'))
+DEGRADED_BITRATE = int(os.getenv('DEGRADED_BITRATE', '64'))
+
+# Seconds a song waits for a free ffmpeg slot before the guild is told the bot is busy
+AUDIO_ADMIT_WAIT = int(os.getenv('AUDIO_ADMIT_WAIT', '30'))
+
+# Seconds between CPU samples, and the cost (cores) assumed for an ffmpeg song before any was measured
+BUDGET_SAMPLE_INTERVAL = 5
+DEFAULT_STREAM_COST = 0.05
+
+CLOCK_TICKS = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+
+PLAY, DEGRADED, BUSY = 'play', 'degraded', 'busy'
+
+
+def cpu_limit():
+    """Cores this process may use: the cgroup CPU quota when there is one, else the core count."""
+    try:
+        with open('/sys/fs/cgroup/cpu.max') as f:
+            quota, period = f.read().split()
+        if quota != 'max':
+            return int(quota) / int(period)
+    except (OSError, ValueError):
+        pass
+    try:
+        # cgroup v1
+        with open('/sys/fs/cgroup/cpu/cpu.cfs_quota_us') as f:
+            quota = int(f.read())
+        with open('/sys/fs/cgroup/cpu/cpu.cfs_period_us') as f:
+            period = int(f.read())
+        if quota > 0:
+            return quota / period
+    except (OSError, ValueError):
+        pass
+    return float(os.cpu_count() or 1)
+
+
+def cpu_seconds(pid='self'):
+    """User + system CPU time of a process from /proc, or None if it can't be read."""
+    try:
+        with open(f'/proc/{pid}/stat') as f:
+            stat = f.read()
+    except OSError:
+        return None
+    # The command name may contain spaces; the fields we want follow its closing parenthesis
+    fields = stat.rsplit(')', 1)[-1].split()
+    try:
+        return (int(fields[11]) + int(fields[12])) / CLOCK_TICKS
+    except (IndexError, ValueError):
+        return None
+
+
+class Pipeline:
+    """One guild's live audio: an ffmpeg process (maybe shared with other guilds) or passed-through Opus packets."""
+
+    def __init__(self, kind, degraded=False):
+        self.kind = kind  # 'ffmpeg', 'opus', or 'shared' until it is known which ffmpeg feed it joined
+        self.degraded = degraded
+        self.source = None  # set by attach(); None while the song is still being prepared
+        self.started = time.monotonic()
+        self.pid = None
+        self.cpu = None  # last cpu_seconds() of the ffmpeg process
+        self.usage = 0.0  # cores used since the previous sample
+
+    @property
+    def holds_slot(self):
+        # Reserved until the source exists; a released (long paused) source has no process
+        return self.kind == 'ffmpeg' and (self.source is None or getattr(self.source, 'pid', None) is not None)
+
+
+class AudioBudget:
+    """Counts live audio pipelines and decides whether another ffmpeg song may start.
+
+    Passed-through Opus costs next to nothing and is always admitted. An
+    ffmpeg song needs one of AUDIO_MAX_FFMPEG slots: acquire() queues for one
+    (first come, first served) for up to AUDIO_ADMIT_WAIT seconds, then
+    answers BUSY. When the measured CPU use plus what another ffmpeg song
+    costs would exceed AUDIO_CPU_BUDGET of the limit, the song is admitted
+    DEGRADED: a lower encoder bitrate, so existing streams don't stutter.
+    """
+
+    def __init__(self, max_ffmpeg=AUDIO_MAX_FFMPEG, cpu_budget=AUDIO_CPU_BUDGET):
+        self.max_ffmpeg = max_ffmpeg
+        self.limit = cpu_limit()
+        self.cpu_budget = cpu_budget
+        self.pipelines = {}  # guild_id -> Pipeline
+        self.usage = None  # cores used by the bot and its ffmpeg processes, None where /proc is missing
+        self.peak = 0.0
+        self.counts = {PLAY: 0, DEGRADED: 0, BUSY: 0, 'waited': 0}
+        self.waited_seconds = 0.0
+        self._waiters = deque()  # acquire() calls waiting for a slot, first come first served
+        self._changed = asyncio.Event()
+        self._sampled = None  # (monotonic, own cpu seconds)
+        self._task = None
+
+    def ffmpeg_count(self):
+        """ffmpeg processes running or reserved; guilds on one shared feed count once."""
+        reserved = 0
+        processes = set()
+        for pipeline in self.pipelines.values():
+            if not pipeline.holds_slot:
+                continue
+            pid = getattr(pipeline.source, 'pid', None)
+            if pid is None:
+                reserved += 1
+            else:
+                processes.add(pid)
+        return reserved + len(processes)
+
+    def processes(self):
+        """Measured cores per running ffmpeg process, each counted once however many guilds share it."""
+        return {p.pid: p.usage for p in self.pipelines.values() if p.kind == 'ffmpeg' and p.pid is not None}
+
+    def stream_cost(self):
+        """Measured cores per ffmpeg process: its own use plus its share of our own encoding work."""
+        measured = self.processes()
+        if not measured or self.usage is None:
+            return DEFAULT_STREAM_COST
+        children = sum(measured.values())
+        own = max(0.0, self.usage - children)
+        return (children + own) / len(measured)
+
+    def decide(self):
+        """What an ffmpeg song asking now gets: PLAY, DEGRADED or BUSY."""
+        if self.ffmpeg_count() >= self.max_ffmpeg:
+            return BUSY
+        if self.usage is not None and self.usage + self.stream_cost() > self.cpu_budget * self.limit:
+            return DEGRADED
+        return PLAY
+
+    async def acquire(self, guild_id, kind, timeout=AUDIO_ADMIT_WAIT):
+        """Reserves a pipeline for a guild's next song. Returns PLAY, DEGRADED or BUSY.
+
+        The reservation holds until release(); BUSY means nothing was reserved.
+        """
+        self.release(guild_id)
+        if kind != 'ffmpeg':
+            self.pipelines[guild_id] = Pipeline(kind)
+            self.counts[PLAY] += 1
+            return PLAY
+
+        decision = self.decide() if not self._waiters else BUSY
+        if decision == BUSY and timeout > 0:
+            self.counts['waited'] += 1
+            started = time.monotonic()
+            decision = await self._wait(timeout)
+            self.waited_seconds += time.monotonic() - started
+
+        self.counts[decision] += 1
+        if decision == BUSY:
+            log.warning("No audio slot free after %ds (%d/%d ffmpeg)", timeout, self.ffmpeg_count(), self.max_ffmpeg,
+                        extra={'guild_id': guild_id})
+            return BUSY
+        if decision == DEGRADED:
+            log.info("CPU over budget (%.2f of %.2f cores), playing at %d kbps", self.usage or 0,
+                     self.limit, DEGRADED_BITRATE, extra={'guild_id': guild_id})
+        self.pipelines[guild_id] = Pipeline(kind, degraded=decision == DEGRADED)
+        return decision
+
+    async def _wait(self, timeout):
+        """Waits in line until a slot frees up; BUSY on timeout."""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        token = object()
+        self._waiters.append(token)
+        try:
+            while True:
+                changed = self._changed
+                if self._waiters[0] is token:
+                    decision = self.decide()
+                    if decision != BUSY:
+                        return decision
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    return BUSY
+                # Woken by release() and by every sample (a long pause may have freed a process)
+                try:
+                    await asyncio.wait_for(changed.wait(), remaining)
+                except asyncio.TimeoutError:
+                    pass
+        finally:
+            self._waiters.remove(token)
+            self._wake()
+
+    def _wake(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def attach(self, guild_id, source):
+        """Ties a reservation to the source that plays it, so its process can be measured."""
+        pipeline = self.pipelines.get(guild_id)
+        if pipeline is None:
+            # Played without acquire() (e.g. a restored song); still counted
+            pipeline = self.pipelines[guild_id] = Pipeline('opus' if source.is_opus() else 'ffmpeg')
+        pipeline.kind = getattr(source, 'kind', None) or ('opus' if source.is_opus() else 'ffmpeg')
+        pipeline.source = source
+
+    def release(self, guild_id):
+        if self.pipelines.pop(guild_id, None) is not None:
+            self._wake()
+
+    def sample(self):
+        """Updates the CPU use of the bot and of every ffmpeg process."""
+        now = time.monotonic()
+        own = cpu_seconds()
+        for pipeline in self.pipelines.values():
+            pid = getattr(pipeline.source, 'pid', None)
+            if pid != pipeline.pid:
+                # New process (seek, reopen) or released; start measuring afresh
+                pipeline.pid, pipeline.cpu, pipeline.usage = pid, None, 0.0
+            if pid is None:
+                continue
+            used = cpu_seconds(pid)
+            if used is not None and pipeline.cpu is not None and self._sampled:
+                pipeline.usage = max(0.0, used - pipeline.cpu) / (now - self._sampled[0])
+            pipeline.cpu = used
+
+        if own is None:
+            return
+        if self._sampled is not None:
+            children = sum(self.processes().values())
+            self.usage = (own - self._sampled[1]) / (now - self._sampled[0]) + children
+            self.peak = max(self.peak, self.usage)
+        self._sampled = (now, own)
+        self._wake()
+
+    def start(self, loop):
+        if self._task is None:
+            self._task = loop.create_task(self.run())
+
+    async def run(self):
+        while True:
+            try:
+                self.sample()
+            except Exception as e:
+                log.warning("Audio budget sample failed: %s", e)
+            await asyncio.sleep(BUDGET_SAMPLE_INTERVAL)
+
+    def status(self):
+        """Budget state for /debug budget."""
+        kinds = [p.kind for p in self.pipelines.values()]
+        return {
+            'ffmpeg': self.ffmpeg_count(),
+            'ffmpeg_guilds': kinds.count('ffmpeg'),
+            'max_ffmpeg': self.max_ffmpeg,
+            'opus': kinds.count('opus'),
+            'degraded': sum(1 for p in self.pipelines.values() if p.degraded),
+            'usage': self.usage,
+            'peak': self.peak,
+            'limit': self.limit,
+            'budget': self.cpu_budget * self.limit,
+            'stream_cost': self.stream_cost(),
+            'queued': len(self._waiters),
+            'counts': dict(self.counts),
+            'waited_seconds': self.waited_seconds,
+            'streams': sorted(
+                ((guild_id, p.kind, p.usage, p.degraded) for guild_id, p in self.pipelines.items()),
+                key=lambda stream: stream[2], reverse=True
+            ),
+        }
+
+
+budget = AudioBudget()
@@ -0,0 +1,253 @@
+import asyncio
+import os
+import re
+import time
+from collections import OrderedDict, deque
+from utils.log import get_logger
+
+log = get_logger('ytdl.guard')
+
+# Seconds an unplayable or over-limit video is remembered, and max remembered ids
+NEGATIVE_CACHE_TTL = int(os.getenv('NEGATIVE_CACHE_TTL', '21600'))
+NEGATIVE_CACHE_SIZE = 5000
+
+# The breaker opens when at least BREAKER_THRESHOLD of the extractor calls in the
+# last BREAKER_WINDOW seconds failed (given at least BREAKER_MIN_CALLS calls), or
+# immediately on throttling. It stays open BREAKER_COOLDOWN seconds, doubling on
+# every failed probe up to BREAKER_MAX_COOLDOWN.
+BREAKER_WINDOW = int(os.getenv('BREAKER_WINDOW', '60'))
+BREAKER_THRESHOLD = float(os.getenv('BREAKER_THRESHOLD', '0.5'))
+BREAKER_MIN_CALLS = int(os.getenv('BREAKER_MIN_CALLS', '6'))
+BREAKER_COOLDOWN = int(os.getenv('BREAKER_COOLDOWN', '30'))
+BREAKER_MAX_COOLDOWN = int(os.getenv('BREAKER_MAX_COOLDOWN', '600'))
+
+# Substrings of yt-dlp errors, matched case-insensitively
+THROTTLE_MARKERS = ('http error 429', 'too many requests', "confirm you're not a bot", 'confirm you’re not a bot',
+                    'rate-limited', 'rate limited')
+# Failures of our side or of the extractor (formats, signatures, page layout changes): a
+# working video can fail like this, so they count towards the breaker instead of being
+# remembered. Checked before UNPLAYABLE_MARKERS, which must only be YouTube's definitive answers
+TRANSIENT_MARKERS = ('requested format is not available', 'unable to extract', 'signature', 'nsig',
+                     'failed to extract', 'unable to download', 'player response')
+UNPLAYABLE_MARKERS = ('video unavailable', 'private video', 'sign in to confirm your age', 'age-restricted',
+                      'inappropriate for some users', 'this video has been removed', 'members-only content',
+                      'not made this video available in your country', 'blocked it in your country',
+                      'blocked it on copyright grounds', 'due to a copyright claim', 'has been terminated',
+                      'premieres in', 'live event will begin', 'this video is not available', 'unsupported url')
+
+_ERROR_PREFIX = re.compile(r'^ERROR:\s*(\[[^\]]+\]\s*)?([\w-]+:\s*)?')
+
+
+class Unplayable(Exception):
+    """A video that can't be played, answered from the negative cache when seen again."""
+
+    def __init__(self, reason, duration=None):
+        super().__init__(reason)
+        self.reason = reason
+        self.duration = duration
+
+
+class ExtractorUnavailable(Exception):
+    """Extractor calls are paused because too many recent ones failed."""
+
+    def __init__(self, retry_after):
+        super().__init__(f"YouTube is refusing requests right now, try again in {int(retry_after) + 1}s")
+        self.retry_after = retry_after
+
+
+def classify(error):
+    """Returns 'throttled', 'unplayable' or 'error' for an extractor exception."""
+    message = str(error).lower()
+    if any(marker in message for marker in THROTTLE_MARKERS):
+        return 'throttled'
+    if any(marker in message for marker in TRANSIENT_MARKERS):
+        return 'error'
+    if any(marker in message for marker in UNPLAYABLE_MARKERS):
+        return 'unplayable'
+    return 'error'
+
+
+def short_reason(error):
+    """yt-dlp's error message without the 'ERROR: [youtube] <id>:' prefix."""
+    lines = str(error).strip().splitlines()
+    return (_ERROR_PREFIX.sub('', lines[0]) if lines else '') or 'unavailable'
+
+
+class NegativeCache:
+    """Remembers ids that failed permanently, so they are rejected without a network call."""
+
+    def __init__(self, ttl=NEGATIVE_CACHE_TTL, max_size=NEGATIVE_CACHE_SIZE):
+        self.ttl = ttl
+        self.max_size = max_size
+        self._entries = OrderedDict()  # key -> (expires, reason, duration)
+        self.hits = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def add(self, key, reason, duration=None):
+        if not key or self.ttl <= 0:
+            return
+        self._entries.pop(key, None)
+        self._entries[key] = (time.monotonic() + self.ttl, reason, duration)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def get(self, key):
+        """Returns an Unplayable for a remembered key, or None."""
+        entry = self._entries.get(key) if key else None
+        if entry is None:
+            return None
+        expires, reason, duration = entry
+        if expires < time.monotonic():
+            del self._entries[key]
+            return None
+        self.hits += 1
+        return Unplayable(reason, duration)
+
+    def discard(self, key):
+        self._entries.pop(key, None)
+
+
+class CircuitBreaker:
+    """Stops extractor calls for a while once they mostly fail.
+
+    closed: calls go through and outcomes are tracked over a sliding window.
+    open: calls are refused until the cooldown ends.
+    half-open: a single probe call is let through; success closes the breaker,
+    failure reopens it with a doubled cooldown.
+    """
+
+    def __init__(self, window=BREAKER_WINDOW, threshold=BREAKER_THRESHOLD, min_calls=BREAKER_MIN_CALLS,
+                 cooldown=BREAKER_COOLDOWN, max_cooldown=BREAKER_MAX_COOLDOWN):
+        self.window = window
+        self.threshold = threshold
+        self.min_calls = min_calls
+        self.base_cooldown = cooldown
+        self.max_cooldown = max_cooldown
+        self.cooldown = cooldown
+        self.state = 'closed'
+        self.opened_until = 0
+        self.trips = 0
+        self._probing = False
+        self._events = deque()  # (timestamp, ok)
+
+    def _prune(self, now):
+        while self._events and self._events[0][0] < now - self.window:
+            self._events.popleft()
+
+    def retry_after(self):
+        return max(0, self.opened_until - time.monotonic())
+
+    def allow(self):
+        """Reserves a call. Returns False while the breaker is open."""
+        if self.state == 'closed':
+            return True
+        if self.state == 'open':
+            if time.monotonic() < self.opened_until:
+                return False
+            self.state = 'half-open'
+        if self._probing:
+            return False
+        self._probing = True
+        return True
+
+    def release(self):
+        """Gives back a reserved call that ended without an outcome (e.g. cancelled)."""
+        self._probing = False
+
+    def success(self):
+        now = time.monotonic()
+        self._events.append((now, True))
+        self._prune(now)
+        if self.state != 'closed':
+            log.info("Extractor recovered, closing circuit breaker")
+            self.state = 'closed'
+            self.cooldown = self.base_cooldown
+            self._events.clear()
+        self._probing = False
+
+    def failure(self):
+        now = time.monotonic()
+        self._events.append((now, False))
+        self._prune(now)
+        if self.state == 'half-open':
+            self._open(double=True)
+            return
+        failures = sum(1 for _, ok in self._events if not ok)
+        if len(self._events) >= self.min_calls and failures / len(self._events) >= self.threshold:
+            self._open()
+
+    def trip(self):
+        """Opens the breaker immediately (throttling)."""
+        self._open(double=self.state != 'closed')
+
+    def _open(self, double=False):
+        if double:
+            self.cooldown = min(self.cooldown * 2, self.max_cooldown)
+        self.state = 'open'
+        self.opened_until = time.monotonic() + self.cooldown
+        self.trips += 1
+        self._probing = False
+        log.warning("Extractor failing, pausing calls for %ds", self.cooldown)
+
+    def error_rate(self):
+        self._prune(time.monotonic())
+        if not self._events:
+            return 0.0
+        return sum(1 for _, ok in self._events if not ok) / len(self._events)
+
+
+class ExtractorGuard:
+    """Runs extractor calls through the negative cache and the circuit breaker."""
+
+    def __init__(self):
+        self.negative = NegativeCache()
+        self.breaker = CircuitBreaker()
+
+    def check(self, *keys):
+        """Raises Unplayable for a remembered key, or ExtractorUnavailable while the breaker is open."""
+        for key in keys:
+            known = self.negative.get(key)
+            if known is not None:
+                raise known
+        if not self.breaker.allow():
+            raise ExtractorUnavailable(self.breaker.retry_after())
+
+    def reject(self, key, reason, duration=None):
+        """Remembers a video that extracted fine but can't be played (e.g. too long)."""
+        self.negative.add(key, reason, duration)
+
+    async def run(self, keys, call):
+        """Awaits `call()` for the video identified by `keys`, recording the outcome.
+
+        Unplayable videos are remembered and raised as Unplayable; throttling
+        trips the breaker and is raised as ExtractorUnavailable.
+        """
+        keys = [key for key in keys if key]
+        self.check(*keys)
+        try:
+            result = await call()
+        except asyncio.CancelledError:
+            self.breaker.release()
+            raise
+        except Exception as e:
+            kind = classify(e)
+            if kind == 'unplayable':
+                # A definite answer from YouTube, so it says nothing about extractor health
+                self.breaker.success()
+                reason = short_reason(e)
+                for key in keys:
+                    self.negative.add(key, reason)
+                log.info("Remembering %s as unplayable: %s", keys[0] if keys else '?', reason)
+                raise Unplayable(reason) from e
+            if kind == 'throttled':
+                self.breaker.trip()
+                raise ExtractorUnavailable(self.breaker.retry_after()) from e
+            self.breaker.failure()
+            raise
+        self.breaker.success()
+        return result
+
+
+guard = ExtractorGuard()
@@ -0,0 +1,146 @@
+import json
+import os
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from utils.log import get_logger
+
+log = get_logger('music.history')
+
+# Rewrite the history file once it grows past this many lines, keeping the newest.
+# Checked at load and after every flush, so a bot that runs for weeks stays bounded too
+HISTORY_MAX_LINES = 50_000
+HISTORY_KEEP_LINES = 20_000
+
+# Seconds between writes of new play events; they are buffered in memory until then
+HISTORY_FLUSH_INTERVAL = 10
+
+
+class PlayHistory:
+    """Play events per guild, appended to a JSON-lines file.
+
+    Aggregates are kept in memory so the cache warmer can ask "what does this
+    guild usually play around this hour" without rereading the file. New
+    events are buffered and appended by flush(), off the event loop, which
+    also trims the file to the newest HISTORY_KEEP_LINES once it grows past
+    HISTORY_MAX_LINES. The in-memory aggregates keep counting every play.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.plays = defaultdict(Counter)        # guild_id -> Counter(track_id)
+        self.hourly = defaultdict(Counter)       # (guild_id, hour) -> Counter(track_id)
+        self.urls = {}                           # track_id -> webpage_url
+        self.titles = {}                         # track_id -> title
+        self.lines = 0
+        self._unsaved = []                       # events recorded since the last flush()
+        self._file_lock = threading.Lock()       # flushes from the periodic task and shutdown may overlap
+
+    def load(self):
+        """Reads the history file. Blocking, run it in an executor."""
+        if not os.path.exists(self.path):
+            return
+        events = []
+        with open(self.path, 'r') as f:
+            for line in f:
+                try:
+                    events.append(json.loads(line))
+                except ValueError:
+                    continue
+        for event in events:
+            self._apply(event)
+        self.lines = len(events)
+        if self.lines > HISTORY_MAX_LINES:
+            self._compact(events[-HISTORY_KEEP_LINES:])
+        log.info("Loaded %d play events", self.lines)
+
+    def _apply(self, event):
+        guild_id = event.get('guild')
+        track_id = event.get('track')
+        if guild_id is None or not track_id:
+            return
+        self.plays[guild_id][track_id] += 1
+        self.hourly[(guild_id, event.get('hour'))][track_id] += 1
+        if event.get('url'):
+            self.urls[track_id] = event['url']
+        if event.get('title'):
+            self.titles[track_id] = event['title']
+
+    def _compact(self, events):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            for event in events:
+                f.write(json.dumps(event) + '\n')
+        os.replace(tmp_path, self.path)
+        self.lines = len(events)
+
+    def _compact_file(self):
+        """Rewrites the file with only its newest HISTORY_KEEP_LINES lines. Blocking."""
+        with open(self.path, 'r') as f:
+            lines = deque(f, maxlen=HISTORY_KEEP_LINES)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.writelines(lines)
+        os.replace(tmp_path, self.path)
+        self.lines = len(lines)
+        log.info("Compacted play history to %d events", self.lines)
+
+    def record(self, guild_id, track):
+        """Records that a song (a Track) started playing in a guild."""
+        track_id = track.id
+        if not track_id:
+            return
+        now = time.time()
+        event = {
+            'ts': int(now),
+            'hour': time.localtime(now).tm_hour,
+            'guild': guild_id,
+            'track': track_id,
+            'url': track.webpage_url,
+            'title': track.title,
+            'by': track.requested_by,
+        }
+        self._apply(event)
+        self._unsaved.append(event)
+
+    def flush(self):
+        """Appends the events recorded since the last flush to the file. Blocking."""
+        events, self._unsaved = self._unsaved, []
+        if not events:
+            return
+        with self._file_lock:
+            try:
+                with open(self.path, 'a') as f:
+                    f.write(''.join(json.dumps(event) + '\n' for event in events))
+                self.lines += len(events)
+            except OSError as e:
+                log.warning("Failed to record %d play events: %s", len(events), e)
+                return
+            if self.lines > HISTORY_MAX_LINES:
+                try:
+                    self._compact_file()
+                except OSError as e:
+                    log.warning("Failed to compact play history: %s", e)
+
+    def candidates(self, hour=None, per_guild=10, min_plays=2):
+        """Returns track ids likely to be requested soon, best first.
+
+        Each guild contributes its most played tracks, weighted towards what it
+        plays around `hour`. Tracks played fewer than `min_plays` times are
+        ignored, so one-off requests are not worth warming.
+        """
+        if hour is None:
+            hour = time.localtime().tm_hour
+        scores = Counter()
+        for guild_id, plays in self.plays.items():
+            guild_scores = Counter()
+            for track_id, count in plays.items():
+                if count >= min_plays:
+                    guild_scores[track_id] += count
+            for nearby in ((hour - 1) % 24, hour, (hour + 1) % 24):
+                for track_id, count in self.hourly.get((guild_id, nearby), {}).items():
+                    if track_id in guild_scores:
+                        guild_scores[track_id] += 2 * count
+            for track_id, score in guild_scores.most_common(per_guild):
+                scores[track_id] += score
+        return [track_id for track_id, _ in scores.most_common() if track_id in self.urls]
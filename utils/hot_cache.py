@@ -0,0 +1,136 @@
+import asyncio
+import os
+import shutil
+from utils import storage
+from utils.log import get_logger
+
+log = get_logger('music.hot_cache')
+
+# Hot tier location (a tmpfs / memory-backed volume) and size cap. Unset HOT_CACHE_DIR disables it
+HOT_CACHE_DIR = os.getenv('HOT_CACHE_DIR', '')
+HOT_CACHE_MB = int(os.getenv('HOT_CACHE_MB', '64'))
+
+
+class HotCache:
+    """Small, size-capped copy of the audio cache on tmpfs.
+
+    The disk cache under songs/ stays the cold tier and source of truth; the
+    hot tier only ever holds copies, so demoting a song is just deleting its
+    copy. rebalance() is given the songs that should be hot, best first (now
+    playing, next up, most played), and promotes/demotes to match within the
+    size cap. Files are replaced atomically, and a demoted file that is still
+    being played stays readable until the player closes it.
+    """
+
+    def __init__(self, root=HOT_CACHE_DIR, capacity=HOT_CACHE_MB * 1_048_576):
+        self.root = root
+        self.capacity = capacity
+        self.enabled = bool(root) and capacity > 0
+        self.files = {}  # video_id -> (path, size)
+        # Bytes in self.files, kept alongside it: the executor changes the dict while
+        # /debug and the memory guard read the total, so it is never summed by iterating
+        self.used = 0
+        self.hits = 0
+        self.misses = 0
+        self.promoted = 0
+        self._lock = asyncio.Lock()
+        if self.enabled:
+            self._scan()
+
+    def _scan(self):
+        """Picks up copies left by a previous process (the volume outlives container restarts)."""
+        try:
+            os.makedirs(self.root, exist_ok=True)
+            with os.scandir(self.root) as entries:
+                for entry in entries:
+                    if entry.name.startswith('.'):
+                        os.remove(entry.path)  # unfinished copy
+                        continue
+                    size = entry.stat().st_size
+                    self.files[entry.name.rsplit('.', 1)[0]] = (entry.path, size)
+                    self.used += size
+        except OSError as e:
+            log.warning("Hot cache at %s unavailable, playing from disk only: %s", self.root, e)
+            self.enabled = False
+            self.files = {}
+            self.used = 0
+
+    def lookup(self, video_id):
+        """Returns the hot copy of a song, or None."""
+        if not self.enabled:
+            return None
+        entry = self.files.get(video_id)
+        if entry is None or not os.path.exists(entry[0]):
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry[0]
+
+    def _promote(self, video_id, cold_path):
+        name = os.path.basename(cold_path)
+        path = os.path.join(self.root, name)
+        tmp_path = os.path.join(self.root, f".{name}.tmp")
+        try:
+            shutil.copyfile(cold_path, tmp_path)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            log.warning("Failed to promote %s: %s", video_id, e, extra={'track_id': video_id})
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            return
+        size = os.path.getsize(path)
+        self.files[video_id] = (path, size)
+        self.used += size
+        self.promoted += 1
+
+    def _demote(self, video_id):
+        path, size = self.files.pop(video_id)
+        self.used -= size
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            log.warning("Failed to demote %s: %s", video_id, e, extra={'track_id': video_id})
+
+    def _apply(self, wanted):
+        """Makes the hot tier hold the best songs of `wanted` that fit. Blocking.
+
+        `wanted` is a list of (video_id, ext), best first; songs that aren't
+        in the cold tier are skipped, and a song that doesn't fit doesn't stop
+        smaller, lower ranked ones from getting in.
+        """
+        keep = {}
+        budget = self.capacity
+        for video_id, ext in wanted:
+            if video_id in keep or not ext:
+                continue
+            if video_id in self.files:
+                cold_path, size = None, self.files[video_id][1]
+            else:
+                cold_path = storage.find_audio(video_id, ext)
+                if cold_path is None:
+                    continue
+                try:
+                    size = os.path.getsize(cold_path)
+                except OSError:
+                    continue
+            if size > budget:
+                continue
+            keep[video_id] = cold_path
+            budget -= size
+
+        # Demote first so the promotions have room
+        for video_id in [video_id for video_id in self.files if video_id not in keep]:
+            self._demote(video_id)
+        for video_id, cold_path in keep.items():
+            if video_id not in self.files:
+                self._promote(video_id, cold_path)
+
+    async def rebalance(self, loop, wanted):
+        if not self.enabled:
+            return
+        async with self._lock:
+            await loop.run_in_executor(None, self._apply, list(wanted))
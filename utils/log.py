@@ -0,0 +1,217 @@
+import atexit
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import threading
+import time
+
+# Guilds that get DEBUG output regardless of their logger's level
+_debug_guilds = set()
+
+_listener = None
+
+# Context fields copied from `extra` into the structured output
+CONTEXT_FIELDS = ('guild_id', 'track_id', 'user_id', 'command')
+
+
+class JSONFormatter(logging.Formatter):
+    """Formats records as one JSON object per line."""
+
+    def format(self, record):
+        payload = {
+            'ts': round(record.created, 3),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        for field in CONTEXT_FIELDS:
+            value = getattr(record, field, None)
+            if value is not None:
+                payload[field] = value
+        if record.exc_info:
+            payload['exc'] = self.formatException(record.exc_info)
+        return json.dumps(payload, ensure_ascii=False, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    """Human readable output for local runs, with the same context fields."""
+
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)-7s %(name)s: %(message)s')
+
+    def format(self, record):
+        text = super().format(record)
+        context = [f"{field}={getattr(record, field)}" for field in CONTEXT_FIELDS
+                   if getattr(record, field, None) is not None]
+        if context:
+            text += f" [{' '.join(context)}]"
+        return text
+
+
+class ContextLogger(logging.LoggerAdapter):
+    """Logger adapter carrying guild/track context.
+
+    Records for guilds in the debug set are emitted even when the underlying
+    logger is above DEBUG, so detail can be turned up for a single guild.
+    """
+
+    def process(self, msg, kwargs):
+        extra = kwargs.get('extra')
+        kwargs['extra'] = {**self.extra, **extra} if extra else self.extra
+        return msg, kwargs
+
+    def isEnabledFor(self, level, guild_id=None):
+        if self.logger.isEnabledFor(level):
+            return True
+        if guild_id is None:
+            guild_id = self.extra.get('guild_id')
+        return guild_id is not None and guild_id in _debug_guilds
+
+    def log(self, level, msg, *args, **kwargs):
+        extra = kwargs.get('extra')
+        guild_id = extra.get('guild_id') if extra else None
+        if self.isEnabledFor(level, guild_id):
+            msg, kwargs = self.process(msg, kwargs)
+            # Bypass the logger's own level check, isEnabledFor already decided
+            self.logger._log(level, msg, args, **kwargs)
+
+    def bind(self, **context):
+        """Returns a child adapter with extra context fields."""
+        return ContextLogger(self.logger, {**self.extra, **context})
+
+
+def get_logger(name, **context):
+    """Returns a context-aware logger for a subsystem (e.g. 'music.player')."""
+    return ContextLogger(logging.getLogger(name), context)
+
+
+def set_guild_debug(guild_id, enabled):
+    """Turns DEBUG output on or off for a single guild."""
+    if enabled:
+        _debug_guilds.add(guild_id)
+    else:
+        _debug_guilds.discard(guild_id)
+
+
+def guild_debug_enabled(guild_id):
+    return guild_id in _debug_guilds
+
+
+def parse_levels(spec):
+    """Parses 'music=DEBUG,ytdl=WARNING' into {'music': 10, 'ytdl': 30}."""
+    levels = {}
+    for part in (spec or '').split(','):
+        if '=' not in part:
+            continue
+        name, level = part.split('=', 1)
+        level = logging.getLevelName(level.strip().upper())
+        if isinstance(level, int):
+            levels[name.strip()] = level
+    return levels
+
+
+def set_level(name, level):
+    """Changes a subsystem's level at runtime."""
+    if isinstance(level, str):
+        level = logging.getLevelName(level.upper())
+    logging.getLogger(name).setLevel(level)
+
+
+def setup_logging():
+    """Configures non-blocking, structured logging for the whole process.
+
+    Every record is handed to a queue on the calling thread and written by a
+    background listener, so event loop and executor threads never block on
+    stdout. Configured via LOG_LEVEL, LOG_LEVELS, LOG_FORMAT and DEBUG_GUILDS.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    stream = logging.StreamHandler()
+    if os.getenv('LOG_FORMAT', 'json').lower() == 'text':
+        stream.setFormatter(TextFormatter())
+    else:
+        stream.setFormatter(JSONFormatter())
+
+    log_queue = queue.SimpleQueue()
+    root = logging.getLogger()
+    root.handlers.clear()
+    root.addHandler(logging.handlers.QueueHandler(log_queue))
+    root.setLevel(os.getenv('LOG_LEVEL', 'INFO').upper())
+
+    # Library defaults: discord.py's gateway chatter and yt-dlp stay quiet
+    logging.getLogger('discord').setLevel(logging.INFO)
+    logging.getLogger('discord.gateway').setLevel(logging.WARNING)
+    logging.getLogger('ytdl').setLevel(logging.WARNING)
+
+    for name, level in parse_levels(os.getenv('LOG_LEVELS')).items():
+        logging.getLogger(name).setLevel(level)
+
+    for guild_id in os.getenv('DEBUG_GUILDS', '').split(','):
+        if guild_id.strip().isdigit():
+            _debug_guilds.add(int(guild_id))
+
+    _listener = logging.handlers.QueueListener(log_queue, stream, respect_handler_level=True)
+    _listener.start()
+    atexit.register(flush_logging)
+
+
+def flush_logging():
+    """Writes out queued records and stops the listener; call before os._exit(), which skips atexit."""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+class YTDLLogger:
+    """Routes yt-dlp output into the 'ytdl' logger with rate limiting.
+
+    yt-dlp logs from executor threads and can produce hundreds of lines per
+    extraction, so each level gets a small token bucket and suppressed lines
+    are reported as a count once the bucket refills.
+    """
+
+    def __init__(self, name='ytdl', rate=5.0, burst=20):
+        self.logger = logging.getLogger(name)
+        self.rate = rate
+        self.burst = burst
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def _allow(self, level):
+        now = time.monotonic()
+        with self._lock:
+            tokens, last, dropped = self._buckets.get(level, (self.burst, now, 0))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens < 1:
+                self._buckets[level] = (tokens, now, dropped + 1)
+                return False, 0
+            self._buckets[level] = (tokens - 1, now, 0)
+            return True, dropped
+
+    def _emit(self, level, msg):
+        if not self.logger.isEnabledFor(level):
+            return
+        allowed, dropped = self._allow(level)
+        if not allowed:
+            return
+        if dropped:
+            self.logger.log(level, "(suppressed %d yt-dlp messages)", dropped)
+        self.logger.log(level, "%s", msg)
+
+    def debug(self, msg):
+        # yt-dlp sends both screen output and '[debug]' lines through debug()
+        self._emit(logging.DEBUG, msg[8:] if msg.startswith('[debug] ') else msg)
+
+    def info(self, msg):
+        self._emit(logging.INFO, msg)
+
+    def warning(self, msg):
+        self._emit(logging.WARNING, msg)
+
+    def error(self, msg):
+        self._emit(logging.ERROR, msg)
@@ -0,0 +1,321 @@
+import asyncio
+import json
+import os
+import re
+import time
+import aiohttp
+from urllib.parse import urlparse, parse_qs
+from utils.extract_guard import guard as extractor_guard, Unplayable, ExtractorUnavailable
+from utils.ytdl import ytdl, ytdl_warm
+from utils.opus_source import build_seek_index
+from utils.log import get_logger
+from utils import storage
+
+log = get_logger('media')
+
+# Where the media daemon (mediad.py) listens: unix:/path/to/mediad.sock or http://127.0.0.1:8765.
+# Unset runs extraction and downloads inside the bot process
+MEDIAD_URL = os.getenv('MEDIAD_URL', '')
+
+# Seconds one daemon request may take (downloads included), and seconds requests run in
+# process after the daemon couldn't be reached, before it is tried again
+MEDIAD_TIMEOUT = int(os.getenv('MEDIAD_TIMEOUT', '600'))
+MEDIAD_RETRY = 30
+
+# Unfinished downloads nothing is resuming are deleted once they are this old (seconds),
+# checked every PARTIAL_GC_INTERVAL seconds
+PARTIAL_MAX_AGE = int(os.getenv('PARTIAL_MAX_AGE', '86400'))
+PARTIAL_GC_INTERVAL = int(os.getenv('PARTIAL_GC_INTERVAL', '3600'))
+
+# Max song length in seconds (10 minutes)
+MAX_DURATION = 600
+
+# Metadata kept from an info dict; everything the bot needs to queue, play and index a song
+INFO_FIELDS = ('id', 'title', 'webpage_url', 'duration', 'thumbnail', 'uploader', 'channel', 'ext', 'url')
+
+
+def extract_video_id(query):
+    """Returns the YouTube video id in a URL, or None."""
+    match = re.search(r'(?:v=|\/)([0-9A-Za-z_-]{11}).*', query)
+    return match.group(1) if match else None
+
+
+def is_playlist_url(query):
+    """True for playlist links (e.g. youtube.com/playlist?list=...), not single videos in a playlist."""
+    parsed = urlparse(query)
+    params = parse_qs(parsed.query)
+    return 'list' in params and ('v' not in params or parsed.path.rstrip('/') == '/playlist')
+
+
+def split_queries(text):
+    """The songs in a /playmany argument, separated by | or newlines."""
+    return [query.strip() for query in re.split(r'[|\n]', text) if query.strip()]
+
+
+def compact(info):
+    """The fields of a yt-dlp info dict the bot uses; small enough to send over the socket."""
+    return {name: info[name] for name in INFO_FIELDS if info.get(name) is not None}
+
+
+def entry_summary(entry):
+    """A search result entry reduced to what the result buttons show."""
+    thumbnails = entry.get('thumbnails') or []
+    return {
+        'id': entry.get('id'),
+        'title': entry.get('title'),
+        'url': entry.get('url') or entry.get('webpage_url'),
+        'thumbnail': entry.get('thumbnail') or (thumbnails[-1].get('url') if thumbnails else None),
+    }
+
+
+def encode_error(error):
+    """The wire form of a failed request, see decode()."""
+    if isinstance(error, Unplayable):
+        return {'error': 'unplayable', 'reason': error.reason, 'duration': error.duration}
+    if isinstance(error, ExtractorUnavailable):
+        return {'error': 'unavailable', 'retry_after': error.retry_after}
+    return {'error': 'failed', 'message': str(error)}
+
+
+def decode(payload):
+    """Returns a daemon response's result, or raises the error it carries."""
+    error = payload.get('error')
+    if error is None:
+        return payload.get('result')
+    if error == 'unplayable':
+        raise Unplayable(payload.get('reason') or 'unavailable', payload.get('duration'))
+    if error == 'unavailable':
+        raise ExtractorUnavailable(payload.get('retry_after') or 0)
+    raise RuntimeError(payload.get('message') or 'media daemon request failed')
+
+
+def write_seek_index(video_id, ext):
+    """Builds and stores the seek index of a cached song, so seeking into it is a lookup. Blocking."""
+    path = storage.find_audio(video_id, ext)
+    index = build_seek_index(path) if path else None
+    if index is None:
+        return
+    target = storage.seek_path(video_id)
+    tmp_path = target + '.tmp'
+    try:
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        with open(tmp_path, 'w') as f:
+            json.dump(index, f, separators=(',', ':'))
+        os.replace(tmp_path, target)
+    except OSError as e:
+        log.warning("Failed to store seek index: %s", e, extra={'track_id': video_id})
+
+
+def guard_status():
+    breaker = extractor_guard.breaker
+    negative = extractor_guard.negative
+    return {
+        'state': breaker.state,
+        'retry_after': breaker.retry_after(),
+        'error_rate': breaker.error_rate(),
+        'trips': breaker.trips,
+        'negative': len(negative),
+        'negative_hits': negative.hits,
+    }
+
+
+class MediaPipeline:
+    """Extraction and downloads into the shared cache, in this process.
+
+    Requests for the same video share one call (single flight): while a URL
+    is being extracted or a video downloaded, later callers wait for that
+    result instead of starting their own. Run by the media daemon for all its
+    clients, or by the bot itself when no daemon is configured.
+    """
+
+    def __init__(self):
+        self.inflight = {}  # (kind, key) -> task
+        self.joined = 0
+
+    def _shared(self, kind, key, call):
+        task = self.inflight.get((kind, key))
+        if task is None:
+            task = asyncio.ensure_future(call())
+            self.inflight[(kind, key)] = task
+            task.add_done_callback(lambda t: self._done(kind, key, t))
+        else:
+            self.joined += 1
+        # One caller giving up mustn't cancel the work the others are waiting for
+        return asyncio.shield(task)
+
+    def _done(self, kind, key, task):
+        self.inflight.pop((kind, key), None)
+        # Retrieve the exception so a result nobody waits for doesn't warn
+        if not task.cancelled():
+            task.exception()
+
+    def active_downloads(self):
+        return frozenset(key for kind, key in self.inflight if kind == 'download')
+
+    async def extract(self, url):
+        """Extracts a video's metadata without downloading it.
+
+        Raises Unplayable straight away for videos that recently failed or were
+        too long, and ExtractorUnavailable while YouTube is throttling us.
+        """
+        return await self._shared('extract', url, lambda: self._extract(url))
+
+    async def _extract(self, url):
+        loop = asyncio.get_running_loop()
+        video_id = extract_video_id(url)
+        data = await extractor_guard.run(
+            (video_id, url),
+            lambda: loop.run_in_executor(None, lambda: ytdl.extract_info(url, download=False))
+        )
+        if 'entries' in data:
+            # take first item from a playlist
+            data = data['entries'][0]
+        self._check_duration(data, video_id, url)
+        return compact(data)
+
+    async def download(self, video_id, url, warm=False):
+        """Downloads a video into the cache and returns its metadata.
+
+        `warm` downloads are rate limited; a regular request for a video that is
+        already warming joins that download.
+        """
+        return await self._shared('download', video_id or url, lambda: self._download(video_id, url, warm))
+
+    async def _download(self, video_id, url, warm):
+        loop = asyncio.get_running_loop()
+        downloader = ytdl_warm if warm else ytdl
+        data = await extractor_guard.run(
+            (video_id, url),
+            lambda: loop.run_in_executor(None, lambda: downloader.extract_info(url, download=True))
+        )
+        if 'entries' in data:
+            data = data['entries'][0]
+        self._check_duration(data, video_id, url)
+        if data.get('id'):
+            await loop.run_in_executor(None, write_seek_index, data['id'], data.get('ext'))
+        return compact(data)
+
+    def _check_duration(self, data, video_id, url):
+        # Remember over-limit songs so asking again doesn't cost another lookup
+        duration = data.get('duration')
+        if duration and duration > MAX_DURATION:
+            for key in (data.get('id'), video_id, url):
+                extractor_guard.reject(key, f"too long ({int(duration//60)}m {int(duration%60):02d}s)", duration)
+
+    async def search(self, query, count=5):
+        """Top YouTube results for a search query, without resolving each video."""
+        return await self._shared('search', (query, count), lambda: self._search(query, count))
+
+    async def _search(self, query, count):
+        def run():
+            data = ytdl.extract_info(f"ytsearch{count}:{query}", download=False, process=False)
+            return [entry_summary(entry) for entry in (data.get('entries') or [])][:count]
+        return await asyncio.get_running_loop().run_in_executor(None, run)
+
+    async def status(self):
+        kinds = [kind for kind, _ in self.inflight]
+        return {
+            'daemon': False,
+            'downloads': kinds.count('download'),
+            'extractions': kinds.count('extract'),
+            'joined': self.joined,
+            **guard_status(),
+        }
+
+
+class MediaClient:
+    """Sends extraction and download requests to the media daemon.
+
+    Same interface as MediaPipeline. While the daemon can't be reached,
+    requests run in this process instead, so a daemon restart doesn't stop
+    playback; the daemon is tried again after MEDIAD_RETRY seconds.
+    """
+
+    def __init__(self, url, timeout=MEDIAD_TIMEOUT):
+        self.url = url
+        self.timeout = timeout
+        self.local = MediaPipeline()
+        self._session = None
+        self._down_until = 0
+        if url.startswith('unix:'):
+            self._socket = url[len('unix:'):]
+            self._base = 'http://mediad'
+        else:
+            self._socket = None
+            self._base = url.rstrip('/')
+
+    def _connect(self):
+        # Created lazily, inside the running loop
+        if self._session is None or self._session.closed:
+            connector = aiohttp.UnixConnector(path=self._socket) if self._socket else aiohttp.TCPConnector()
+            self._session = aiohttp.ClientSession(
+                connector=connector, timeout=aiohttp.ClientTimeout(total=self.timeout)
+            )
+        return self._session
+
+    async def _call(self, name, payload, fallback, keys=()):
+        if time.monotonic() < self._down_until:
+            return await fallback()
+        try:
+            async with self._connect().post(f"{self._base}/{name}", json=payload) as response:
+                result = await response.json()
+        except aiohttp.ClientConnectorError as e:
+            # Only failures to connect fall back: a request the daemon may still be running isn't repeated here
+            log.warning("Media daemon at %s unreachable, working in process for %ds: %s", self.url, MEDIAD_RETRY, e)
+            self._down_until = time.monotonic() + MEDIAD_RETRY
+            return await fallback()
+        try:
+            return decode(result)
+        except Unplayable as e:
+            # Mirrored locally, so playlist imports can skip the video without asking
+            for key in keys:
+                extractor_guard.reject(key, e.reason, e.duration)
+            raise
+
+    async def extract(self, url):
+        return await self._call('extract', {'url': url}, lambda: self.local.extract(url),
+                                keys=(extract_video_id(url), url))
+
+    async def download(self, video_id, url, warm=False):
+        return await self._call('download', {'id': video_id, 'url': url, 'warm': warm},
+                                lambda: self.local.download(video_id, url, warm), keys=(video_id, url))
+
+    async def search(self, query, count=5):
+        return await self._call('search', {'query': query, 'count': count}, lambda: self.local.search(query, count))
+
+    def active_downloads(self):
+        return self.local.active_downloads()
+
+    async def status(self):
+        async def local_status():
+            status = await self.local.status()
+            status['daemon'] = None  # configured but unreachable
+            return status
+        return await self._call('status', {}, local_status)
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+
+
+async def collect_partials(active_ids):
+    """Periodically deletes orphaned partial downloads older than PARTIAL_MAX_AGE.
+
+    Partials of running downloads (`active_ids()`), and recent ones an
+    interrupted download may still resume, are kept.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        try:
+            removed, freed = await loop.run_in_executor(
+                None, storage.collect_partials, active_ids(), PARTIAL_MAX_AGE
+            )
+            if removed:
+                log.info("Removed %d stale partial downloads (%.1f MB)", removed, freed / 1_048_576)
+        except Exception as e:
+            log.warning("Partial download cleanup failed: %s", e)
+        await asyncio.sleep(PARTIAL_GC_INTERVAL)
+
+
+# The bot's media backend: the daemon when MEDIAD_URL is set, otherwise this process
+media = MediaClient(MEDIAD_URL) if MEDIAD_URL else MediaPipeline()
@@ -0,0 +1,281 @@
+import asyncio
+import ctypes
+import ctypes.util
+import gc
+import os
+import sys
+import time
+import tracemalloc
+from collections import Counter, deque
+from utils.log import get_logger
+
+log = get_logger('memory')
+
+# Memory use (MB) at which caches are shed and background work pauses. Unset: 80% of the
+# container's memory limit, or no guard without one
+MEMORY_SOFT_LIMIT_MB = int(os.getenv('MEMORY_SOFT_LIMIT_MB', '0'))
+MEMORY_SOFT_LIMIT_SHARE = 0.8
+
+# Seconds between memory checks, and between two rounds of shedding while still over the limit.
+# The guard lets go again below this share of the soft limit
+MEMORY_CHECK_INTERVAL = 15
+MEMORY_SHED_INTERVAL = 60
+MEMORY_RELIEF_SHARE = 0.9
+
+# Stack frames kept per traced allocation, and objects visited by one approx_size() call
+TRACE_FRAMES = 1
+SIZE_WALK_LIMIT = 200_000
+
+_CGROUP_V2 = '/sys/fs/cgroup'
+_CGROUP_V1 = '/sys/fs/cgroup/memory'
+
+
+def _read(path):
+    try:
+        with open(path) as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def _stat_value(stat, key):
+    for line in (stat or '').splitlines():
+        name, _, value = line.partition(' ')
+        if name == key:
+            return int(value)
+    return 0
+
+
+def rss_bytes(pid='self'):
+    """Resident memory of a process from /proc, or None."""
+    for line in (_read(f'/proc/{pid}/status') or '').splitlines():
+        if line.startswith('VmRSS:'):
+            return int(line.split()[1]) * 1024
+    return None
+
+
+def cgroup_memory():
+    """(working set, limit) of the container in bytes, like the kubelet counts them; None where unknown.
+
+    The working set is usage minus inactive page cache, which the kernel can
+    drop; tmpfs files (the hot cache) are part of it.
+    """
+    current = _read(os.path.join(_CGROUP_V2, 'memory.current'))
+    if current is not None:
+        limit = _read(os.path.join(_CGROUP_V2, 'memory.max'))
+        inactive = _stat_value(_read(os.path.join(_CGROUP_V2, 'memory.stat')), 'inactive_file')
+        return int(current) - inactive, (int(limit) if limit and limit != 'max' else None)
+    current = _read(os.path.join(_CGROUP_V1, 'memory.usage_in_bytes'))
+    if current is not None:
+        limit = int(_read(os.path.join(_CGROUP_V1, 'memory.limit_in_bytes')) or 0)
+        inactive = _stat_value(_read(os.path.join(_CGROUP_V1, 'memory.stat')), 'total_inactive_file')
+        # v1 reports "no limit" as a huge number
+        return int(current) - inactive, (limit if 0 < limit < 1 << 60 else None)
+    return None, None
+
+
+def approx_size(obj, limit=SIZE_WALK_LIMIT):
+    """Bytes held by an object and everything it references, as (bytes, complete).
+
+    Follows containers and instance attributes, counting each object once;
+    gives up after `limit` objects (complete is then False). Modules, classes
+    and functions aren't followed, so shared code doesn't count.
+    """
+    seen = set()
+    pending = deque([obj])
+    total = 0
+    while pending:
+        if len(seen) >= limit:
+            return total, False
+        item = pending.popleft()
+        if id(item) in seen or isinstance(item, (type, type(sys), type(approx_size))):
+            continue
+        seen.add(id(item))
+        try:
+            total += sys.getsizeof(item)
+        except TypeError:
+            continue
+        if isinstance(item, dict):
+            pending.extend(item.keys())
+            pending.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset, deque)):
+            pending.extend(item)
+        elif not isinstance(item, (str, bytes, bytearray, int, float)):
+            if hasattr(item, '__dict__'):
+                pending.append(vars(item))
+            for name in getattr(type(item), '__slots__', ()):
+                if hasattr(item, name):
+                    pending.append(getattr(item, name))
+    return total, True
+
+
+def task_census(limit=8):
+    """The most common running asyncio tasks by coroutine, e.g. to spot leaked loops."""
+    counts = Counter()
+    for task in asyncio.all_tasks():
+        coro = task.get_coro()
+        counts[getattr(coro, '__qualname__', None) or type(coro).__name__] += 1
+    return counts.most_common(limit)
+
+
+def _location(stat):
+    frame = stat.traceback[0]
+    # The containing directory is enough to tell utils/ from cogs/ and site-packages
+    return f"{os.sep.join(frame.filename.rsplit(os.sep, 2)[-2:])}:{frame.lineno}"
+
+
+def release_freed_memory():
+    """Collects garbage and hands freed heap pages back to the OS (glibc only)."""
+    collected = gc.collect()
+    libc = ctypes.util.find_library('c')
+    if libc:
+        try:
+            ctypes.CDLL(libc).malloc_trim(0)
+        except (OSError, AttributeError):
+            pass
+    return collected
+
+
+class MemoryGuard:
+    """Accounts memory per subsystem and sheds caches before the OOM killer steps in.
+
+    Subsystems register how to measure themselves (account()) and what to
+    drop under pressure (on_pressure()). Every MEMORY_CHECK_INTERVAL seconds
+    the container's working set (the process RSS outside a container) is
+    compared with the soft limit; above it `shedding` is set, which pauses
+    prefetching and cache warming, and the shedders run, followed by a
+    garbage collection. Below MEMORY_RELIEF_SHARE of the limit it lets go.
+    """
+
+    def __init__(self, soft_limit_mb=MEMORY_SOFT_LIMIT_MB):
+        _, limit = cgroup_memory()
+        if soft_limit_mb:
+            self.soft_limit = soft_limit_mb * 1_048_576
+        else:
+            self.soft_limit = int(limit * MEMORY_SOFT_LIMIT_SHARE) if limit else None
+        self.limit = limit
+        self.accounts = {}  # name -> measure() returning (items, bytes)
+        self.shedders = []
+        self.shedding = False
+        self.sheds = 0
+        self.last_shed = 0
+        self.peak = 0
+        self.snapshot = None  # previous tracemalloc snapshot, for differences
+        self._task = None
+
+    def account(self, name, measure):
+        """Registers a subsystem; `measure()` returns (items, bytes or None), or
+        (items, approximate bytes, complete) as from approx_size().
+
+        Measures run on an executor thread (see measure()), so they must only read.
+        """
+        self.accounts[name] = measure
+
+    def on_pressure(self, shed):
+        """Registers a callable that frees memory; run each time the guard sheds."""
+        self.shedders.append(shed)
+
+    def usage(self):
+        """Bytes in use: the container's working set, else this process's RSS."""
+        working_set, _ = cgroup_memory()
+        return working_set if working_set is not None else rss_bytes()
+
+    def measure(self):
+        """Current (items, bytes, complete) per registered subsystem. Blocking: walking large
+        structures takes a while, so run it in an executor. `complete` is False when a size
+        walk stopped at SIZE_WALK_LIMIT objects, the bytes are then a lower bound."""
+        results = {}
+        for name, measure in list(self.accounts.items()):
+            try:
+                items, size, *complete = measure()
+                results[name] = (items, size, complete[0] if complete else True)
+            except Exception as e:
+                log.debug("Measuring %s failed: %s", name, e)
+                results[name] = (None, None, True)
+        return results
+
+    def shed(self):
+        """Runs every shedder, then returns freed memory to the OS."""
+        self.sheds += 1
+        self.last_shed = time.monotonic()
+        for shed in self.shedders:
+            try:
+                shed()
+            except Exception as e:
+                log.warning("Shedding memory failed: %s", e)
+        release_freed_memory()
+
+    def check(self):
+        used = self.usage()
+        if used is None:
+            return
+        self.peak = max(self.peak, used)
+        if self.soft_limit is None:
+            return
+        if used > self.soft_limit:
+            if not self.shedding:
+                log.warning("Memory at %.0f MB, over the %.0f MB soft limit: shedding caches, pausing prefetch",
+                            used / 1_048_576, self.soft_limit / 1_048_576)
+                self.shedding = True
+                self.shed()
+            elif time.monotonic() - self.last_shed > MEMORY_SHED_INTERVAL:
+                self.shed()
+        elif self.shedding and used < self.soft_limit * MEMORY_RELIEF_SHARE:
+            log.info("Memory back at %.0f MB, resuming prefetch and caching", used / 1_048_576)
+            self.shedding = False
+
+    def start(self, loop):
+        if self._task is None:
+            self._task = loop.create_task(self.run())
+
+    async def run(self):
+        while True:
+            try:
+                self.check()
+            except Exception as e:
+                log.warning("Memory check failed: %s", e)
+            await asyncio.sleep(MEMORY_CHECK_INTERVAL)
+
+    def take_snapshot(self, limit=10):
+        """Top allocators by file and line, and what grew since the previous snapshot. Blocking.
+
+        Starts tracing on first use; allocations made before that aren't seen.
+        Returns (top, growth, traced_bytes), top and growth as (location, bytes, count).
+        """
+        if not tracemalloc.is_tracing():
+            tracemalloc.start(TRACE_FRAMES)
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            tracemalloc.Filter(False, '<frozen importlib._bootstrap_external>'),
+        ))
+        top = [(_location(stat), stat.size, stat.count) for stat in snapshot.statistics('lineno')[:limit]]
+        growth = []
+        if self.snapshot is not None:
+            growth = [(_location(stat), stat.size_diff, stat.count_diff)
+                      for stat in snapshot.compare_to(self.snapshot, 'lineno')[:limit] if stat.size_diff > 0]
+        self.snapshot = snapshot
+        return top, growth, tracemalloc.get_traced_memory()[0]
+
+    def stop_tracing(self):
+        self.snapshot = None
+        if tracemalloc.is_tracing():
+            tracemalloc.stop()
+
+    def status(self):
+        """Memory state for /debug memory; cheap, the accounts come from measure()."""
+        working_set, limit = cgroup_memory()
+        return {
+            'rss': rss_bytes(),
+            'working_set': working_set,
+            'limit': limit,
+            'soft_limit': self.soft_limit,
+            'peak': self.peak,
+            'shedding': self.shedding,
+            'sheds': self.sheds,
+            'tracing': tracemalloc.is_tracing(),
+            'tasks': task_census(),
+        }
+
+
+memory_guard = MemoryGuard()
@@ -0,0 +1,236 @@
+import asyncio
+import logging
+import os
+import time
+from collections import defaultdict, deque
+import discord
+from utils.log import get_logger
+
+log = get_logger('messages')
+
+# Seconds an intermediate interaction edit waits for a newer one to replace it
+EDIT_DEBOUNCE = float(os.getenv('MESSAGE_EDIT_DEBOUNCE', '0.4'))
+
+# Minimum seconds between messages sent to one channel (Discord allows ~5 per 5s)
+CHANNEL_MIN_INTERVAL = float(os.getenv('CHANNEL_MIN_INTERVAL', '1.0'))
+
+# Channel send priorities, lower goes first
+PRIORITY_FINAL = 0
+PRIORITY_STATUS = 1
+
+
+class RateLimitStats:
+    """Counts the REST calls we make per bucket so usage can be inspected."""
+
+    WINDOW = 60
+
+    def __init__(self):
+        self.calls = defaultdict(deque)  # bucket -> call timestamps in the window
+        self.sent = defaultdict(int)
+        self.dropped = defaultdict(int)
+        self.rate_limited = 0
+        self.rate_limited_routes = defaultdict(int)
+
+    def record(self, bucket):
+        now = time.monotonic()
+        calls = self.calls[bucket]
+        calls.append(now)
+        while calls and calls[0] < now - self.WINDOW:
+            calls.popleft()
+        self.sent[bucket] += 1
+
+    def record_dropped(self, bucket):
+        self.dropped[bucket] += 1
+
+    def snapshot(self):
+        """Returns {bucket: (calls in window, sent total, dropped total)}."""
+        now = time.monotonic()
+        result = {}
+        for bucket in set(self.sent) | set(self.dropped):
+            calls = self.calls[bucket]
+            while calls and calls[0] < now - self.WINDOW:
+                calls.popleft()
+            result[bucket] = (len(calls), self.sent[bucket], self.dropped[bucket])
+        return result
+
+
+stats = RateLimitStats()
+
+
+class _RateLimitCounter(logging.Handler):
+    """Counts the 429 warnings discord.py logs from its HTTP client."""
+
+    def emit(self, record):
+        if record.levelno < logging.WARNING or 'rate limit' not in str(record.msg):
+            return
+        stats.rate_limited += 1
+        # discord.py logs (method, url, ...) as the first arguments
+        if record.args and len(record.args) >= 3:
+            method, url = record.args[0], str(record.args[1])
+            # Interaction webhook URLs embed the token, keep it out of the stats
+            path = '/'.join(':token' if len(part) > 40 else part for part in url.split('?')[0].split('/')[5:])
+            stats.rate_limited_routes[f"{method} /{path}"] += 1
+        else:
+            stats.rate_limited_routes['global'] += 1
+
+
+def install_rate_limit_counter():
+    http_logger = logging.getLogger('discord.http')
+    if not any(isinstance(h, _RateLimitCounter) for h in http_logger.handlers):
+        http_logger.addHandler(_RateLimitCounter())
+
+
+class InteractionStatus:
+    """Coalesces edits to one interaction response.
+
+    Intermediate states passed to update() are debounced: only the newest one
+    is sent, and not at all if a final state arrives first. An update made
+    while an edit is in flight is sent once that edit lands. finish() and
+    delete() apply the final state immediately.
+    """
+
+    def __init__(self, interaction, debounce=EDIT_DEBOUNCE):
+        self.interaction = interaction
+        self.debounce = debounce
+        self.bucket = f"webhook:{interaction.channel_id}"
+        self._pending = None
+        self._task = None
+        self._sending = False
+
+    def update(self, **kwargs):
+        if self._pending is not None:
+            stats.record_dropped(self.bucket)
+        self._pending = kwargs
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._flush_later())
+
+    async def _flush_later(self):
+        # Updates arriving during an edit are picked up by the next round, debounced again
+        while self._pending is not None:
+            await asyncio.sleep(self.debounce)
+            kwargs, self._pending = self._pending, None
+            if kwargs is None:
+                return
+            self._sending = True
+            try:
+                await self._edit(kwargs)
+            finally:
+                self._sending = False
+
+    async def _settle(self):
+        """Drops a still-debouncing update, or waits for one already being sent."""
+        if self._pending is not None:
+            stats.record_dropped(self.bucket)
+            self._pending = None
+        if self._task and not self._task.done():
+            if self._sending:
+                # An edit is in flight; let it land so the final state goes last.
+                # Nothing is pending any more, so the task ends after it
+                await self._task
+            else:
+                self._task.cancel()
+
+    async def _edit(self, kwargs):
+        stats.record(self.bucket)
+        try:
+            await self.interaction.edit_original_response(**kwargs)
+        except discord.NotFound:
+            # Fallback if original response is gone (rare)
+            if kwargs.get('content'):
+                await self.interaction.followup.send(kwargs['content'], ephemeral=True)
+        except discord.HTTPException as e:
+            log.warning("Failed to edit interaction response: %s", e, extra={'guild_id': self.interaction.guild_id})
+
+    async def finish(self, **kwargs):
+        """Replaces any pending update with the final state and sends it now."""
+        await self._settle()
+        await self._edit(kwargs)
+
+    async def delete(self, fallback=None):
+        """Deletes the response, dropping pending updates. Edits to `fallback` if deleting fails."""
+        await self._settle()
+        stats.record(self.bucket)
+        try:
+            await self.interaction.delete_original_response()
+        except Exception:
+            # Fallback if delete fails (e.g. too old), just edit
+            if fallback is not None:
+                await self._edit({'content': fallback, 'embed': None, 'view': None})
+
+
+class _Outgoing:
+    __slots__ = ('priority', 'seq', 'key', 'kwargs', 'future')
+
+    def __init__(self, priority, seq, key, kwargs, future):
+        self.priority = priority
+        self.seq = seq
+        self.key = key
+        self.kwargs = kwargs
+        self.future = future
+
+
+class ChannelPublisher:
+    """Per-channel outbox for bot messages.
+
+    Messages to one channel are sent by a single worker at most once per
+    CHANNEL_MIN_INTERVAL, in priority order. A message sent with a `key`
+    replaces any still-unsent message with the same key, so rapid skips do not
+    post a now-playing embed for every track that flew by.
+    """
+
+    def __init__(self, min_interval=CHANNEL_MIN_INTERVAL):
+        self.min_interval = min_interval
+        self._pending = {}  # channel id -> list of _Outgoing
+        self._workers = {}
+        self._last_sent = {}
+        self._seq = 0
+
+    def send(self, channel, *, key=None, priority=PRIORITY_FINAL, **kwargs):
+        """Queues a message; returns a future resolving to the Message (or None if superseded/failed)."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        pending = self._pending.setdefault(channel.id, [])
+        bucket = f"channel:{channel.id}"
+
+        if key is not None:
+            for item in pending:
+                if item.key == key:
+                    pending.remove(item)
+                    stats.record_dropped(bucket)
+                    if not item.future.done():
+                        item.future.set_result(None)
+                    break
+
+        self._seq += 1
+        pending.append(_Outgoing(priority, self._seq, key, kwargs, future))
+
+        worker = self._workers.get(channel.id)
+        if worker is None or worker.done():
+            self._workers[channel.id] = loop.create_task(self._drain(channel))
+        return future
+
+    async def _drain(self, channel):
+        pending = self._pending.get(channel.id)
+        bucket = f"channel:{channel.id}"
+        while pending:
+            wait = self._last_sent.get(channel.id, 0) + self.min_interval - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+                if not pending:
+                    break
+
+            item = min(pending, key=lambda o: (o.priority, o.seq))
+            pending.remove(item)
+
+            self._last_sent[channel.id] = time.monotonic()
+            stats.record(bucket)
+            try:
+                message = await channel.send(**item.kwargs)
+            except Exception as e:
+                log.warning("Failed to send to channel %s: %s", channel.id, e)
+                message = None
+            if not item.future.done():
+                item.future.set_result(message)
+
+        self._pending.pop(channel.id, None)
+        self._workers.pop(channel.id, None)
@@ -0,0 +1,577 @@
+import bisect
+import json
+import mmap
+import os
+import struct
+import discord
+from utils.log import get_logger
+
+log = get_logger('music.opus')
+
+# Set OPUS_PASSTHROUGH=0 to always decode through ffmpeg
+OPUS_PASSTHROUGH = os.getenv('OPUS_PASSTHROUGH', '1') == '1'
+
+# Discord expects one 20 ms Opus packet per read(): 960 samples at 48 kHz
+FRAME_SAMPLES = 960
+
+# Packets checked up front; any other frame size means we can't pass packets through
+PROBE_PACKETS = 50
+
+# Matroska/WebM element ids
+EBML = 0x1A45DFA3
+SEGMENT = 0x18538067
+INFO = 0x1549A966
+TIMECODE_SCALE = 0x2AD7B1
+TRACKS = 0x1654AE6B
+TRACK_ENTRY = 0xAE
+TRACK_NUMBER = 0xD7
+CODEC_ID = 0x86
+CLUSTER = 0x1F43B675
+CLUSTER_TIMECODE = 0xE7
+SIMPLE_BLOCK = 0xA3
+BLOCK_GROUP = 0xA0
+BLOCK = 0xA1
+CUES = 0x1C53BB6B
+CUE_POINT = 0xBB
+CUE_TIME = 0xB3
+CUE_TRACK_POSITIONS = 0xB7
+CUE_CLUSTER_POSITION = 0xF1
+
+# Elements that can follow a cluster of unknown size at segment level
+SEGMENT_CHILDREN = {CLUSTER, CUES, INFO, TRACKS, 0x114D9B74, 0x1254C367, 0x1941A469, 0x1043A770}
+
+
+class NotDemuxable(Exception):
+    """The file can't be played by passing its Opus packets straight through."""
+
+
+def opus_packet_samples(packet):
+    """Number of 48 kHz samples in an Opus packet, from its TOC byte (RFC 6716 3.1)."""
+    if not packet:
+        return 0
+    toc = packet[0]
+    config = toc >> 3
+    if config < 12:
+        frame = (480, 960, 1920, 2880)[config & 3]
+    elif config < 16:
+        frame = (480, 960)[config & 1]
+    else:
+        frame = (120, 240, 480, 960)[config & 3]
+    code = toc & 3
+    if code == 0:
+        count = 1
+    elif code in (1, 2):
+        count = 2
+    else:
+        if len(packet) < 2:
+            return 0
+        count = packet[1] & 0x3F
+    return frame * count
+
+
+def _read_id(buf, pos):
+    first = buf[pos]
+    length = 9 - first.bit_length()
+    if length > 4:
+        raise NotDemuxable("invalid EBML id")
+    return int.from_bytes(buf[pos:pos + length], 'big'), length
+
+
+def _read_vint(buf, pos):
+    """Reads an EBML variable size integer. Returns (value or None if unknown, length)."""
+    first = buf[pos]
+    if first == 0:
+        raise NotDemuxable("invalid EBML size")
+    length = 9 - first.bit_length()
+    value = first & (0xFF >> length)
+    for i in range(1, length):
+        value = (value << 8) | buf[pos + i]
+    if value == (1 << (7 * length)) - 1:
+        return None, length
+    return value, length
+
+
+def _read_uint(buf, pos, size):
+    return int.from_bytes(buf[pos:pos + size], 'big')
+
+
+class WebMDemuxer:
+    """Minimal Matroska/WebM reader for a single Opus audio track."""
+
+    def __init__(self, buf):
+        self.buf = buf
+        self.timescale = 1_000_000  # ns per timecode tick
+        self.track = None
+        self.first_cluster = None
+        self.cues = []  # (time_ms, absolute cluster offset)
+
+        pos = 0
+        element_id, length = _read_id(buf, pos)
+        if element_id != EBML:
+            raise NotDemuxable("not an EBML file")
+        size, size_length = _read_vint(buf, pos + length)
+        pos += length + size_length + size
+
+        element_id, length = _read_id(buf, pos)
+        if element_id != SEGMENT:
+            raise NotDemuxable("no segment")
+        size, size_length = _read_vint(buf, pos + length)
+        self.segment_start = pos + length + size_length
+        self.segment_end = len(buf) if size is None else min(len(buf), self.segment_start + size)
+
+        codec = None
+        pos = self.segment_start
+        while pos < self.segment_end:
+            element_id, length = _read_id(buf, pos)
+            size, size_length = _read_vint(buf, pos + length)
+            data_start = pos + length + size_length
+            if element_id == CLUSTER:
+                if self.first_cluster is None:
+                    self.first_cluster = pos
+                if size is None:
+                    break  # live-style file, no way to skip ahead to later elements
+            elif size is None:
+                raise NotDemuxable("unknown-size element")
+            elif element_id == INFO:
+                self._parse_info(data_start, data_start + size)
+            elif element_id == TRACKS:
+                codec = self._parse_tracks(data_start, data_start + size)
+            elif element_id == CUES:
+                self._parse_cues(data_start, data_start + size)
+            pos = data_start + size
+
+        if codec != 'A_OPUS' or self.track is None:
+            raise NotDemuxable(f"codec {codec!r} is not Opus")
+        if self.first_cluster is None:
+            raise NotDemuxable("no clusters")
+
+    def _children(self, start, end):
+        pos = start
+        while pos < end:
+            element_id, length = _read_id(self.buf, pos)
+            size, size_length = _read_vint(self.buf, pos + length)
+            if size is None:
+                raise NotDemuxable("unknown-size child element")
+            data_start = pos + length + size_length
+            yield element_id, data_start, size
+            pos = data_start + size
+
+    def _parse_info(self, start, end):
+        for element_id, data_start, size in self._children(start, end):
+            if element_id == TIMECODE_SCALE:
+                self.timescale = _read_uint(self.buf, data_start, size)
+
+    def _parse_tracks(self, start, end):
+        opus_tracks = []
+        audio_tracks = 0
+        for element_id, data_start, size in self._children(start, end):
+            if element_id != TRACK_ENTRY:
+                continue
+            number = codec = None
+            for child_id, child_start, child_size in self._children(data_start, data_start + size):
+                if child_id == TRACK_NUMBER:
+                    number = _read_uint(self.buf, child_start, child_size)
+                elif child_id == CODEC_ID:
+                    codec = bytes(self.buf[child_start:child_start + child_size]).rstrip(b'\0').decode('ascii', 'replace')
+            if codec and codec.startswith('A_'):
+                audio_tracks += 1
+                if codec == 'A_OPUS':
+                    opus_tracks.append(number)
+        if audio_tracks != 1 or len(opus_tracks) != 1:
+            return None
+        self.track = opus_tracks[0]
+        return 'A_OPUS'
+
+    def _parse_cues(self, start, end):
+        for element_id, data_start, size in self._children(start, end):
+            if element_id != CUE_POINT:
+                continue
+            time = position = None
+            for child_id, child_start, child_size in self._children(data_start, data_start + size):
+                if child_id == CUE_TIME:
+                    time = _read_uint(self.buf, child_start, child_size)
+                elif child_id == CUE_TRACK_POSITIONS:
+                    for pos_id, pos_start, pos_size in self._children(child_start, child_start + child_size):
+                        if pos_id == CUE_CLUSTER_POSITION:
+                            position = _read_uint(self.buf, pos_start, pos_size)
+            if time is not None and position is not None:
+                self.cues.append((time * self.timescale // 1_000_000, self.segment_start + position))
+        self.cues.sort()
+
+    def _block_packets(self, start, end, cluster_time):
+        buf = self.buf
+        track, length = _read_vint(buf, start)
+        if track != self.track:
+            return
+        pos = start + length
+        relative, flags = struct.unpack_from('>hB', buf, pos)
+        pos += 3
+        time_ms = (cluster_time + relative) * self.timescale // 1_000_000
+        lacing = (flags >> 1) & 3
+        if lacing == 0:
+            yield time_ms, buf[pos:end]
+            return
+
+        # Laced block: several frames in one block
+        count = buf[pos] + 1
+        pos += 1
+        sizes = []
+        if lacing == 1:  # Xiph
+            for _ in range(count - 1):
+                size = 0
+                while True:
+                    byte = buf[pos]
+                    pos += 1
+                    size += byte
+                    if byte != 255:
+                        break
+                sizes.append(size)
+        elif lacing == 3:  # EBML
+            size, length = _read_vint(buf, pos)
+            pos += length
+            sizes.append(size)
+            for _ in range(count - 2):
+                raw, length = _read_vint(buf, pos)
+                pos += length
+                size += raw - ((1 << (7 * length - 1)) - 1)
+                sizes.append(size)
+        else:  # fixed
+            sizes = [(end - pos) // count] * (count - 1)
+        sizes.append(end - pos - sum(sizes))
+        for size in sizes:
+            yield time_ms, buf[pos:pos + size]
+            pos += size
+
+    def packets(self, offset=None):
+        """Yields (time_ms, packet) for the Opus track, starting at a cluster offset."""
+        buf = self.buf
+        pos = self.first_cluster if offset is None else offset
+        end = self.segment_end
+        while pos < end:
+            element_id, length = _read_id(buf, pos)
+            size, size_length = _read_vint(buf, pos + length)
+            data_start = pos + length + size_length
+            if element_id != CLUSTER:
+                if size is None:
+                    return
+                pos = data_start + size
+                continue
+
+            cluster_end = end if size is None else data_start + size
+            cluster_time = 0
+            pos = data_start
+            while pos < cluster_end:
+                child_id, length = _read_id(buf, pos)
+                if size is None and child_id in SEGMENT_CHILDREN:
+                    break  # an unknown-size cluster ends where the next segment element starts
+                child_size, size_length = _read_vint(buf, pos + length)
+                child_start = pos + length + size_length
+                child_end = child_start + child_size
+                if child_id == CLUSTER_TIMECODE:
+                    cluster_time = _read_uint(buf, child_start, child_size)
+                elif child_id == SIMPLE_BLOCK:
+                    yield from self._block_packets(child_start, child_end, cluster_time)
+                elif child_id == BLOCK_GROUP:
+                    for group_id, group_start, group_size in self._children(child_start, child_end):
+                        if group_id == BLOCK:
+                            yield from self._block_packets(group_start, group_start + group_size, cluster_time)
+                pos = child_end
+
+    def _cluster_time(self, start, end):
+        """Timecode of the cluster whose children span start..end, in ms (None if it has none)."""
+        buf = self.buf
+        pos = start
+        while pos < end:
+            child_id, length = _read_id(buf, pos)
+            if child_id in SEGMENT_CHILDREN:
+                return None
+            child_size, size_length = _read_vint(buf, pos + length)
+            child_start = pos + length + size_length
+            if child_id == CLUSTER_TIMECODE:
+                return _read_uint(buf, child_start, child_size) * self.timescale // 1_000_000
+            if child_size is None:
+                return None
+            pos = child_start + child_size
+        return None
+
+    def _cluster_end(self, start):
+        """Where an unknown-size cluster starting its children at `start` ends."""
+        buf = self.buf
+        pos = start
+        while pos < self.segment_end:
+            child_id, length = _read_id(buf, pos)
+            if child_id in SEGMENT_CHILDREN:
+                break
+            child_size, size_length = _read_vint(buf, pos + length)
+            if child_size is None:
+                raise NotDemuxable("unknown-size cluster child")
+            pos += length + size_length + child_size
+        return pos
+
+    def seek_index(self):
+        """[time_ms, cluster offset, 0] for every cluster: the file's seek points.
+
+        Only element headers are read, never the blocks, so this is far
+        cheaper than demuxing and works for files without cues.
+        """
+        buf = self.buf
+        points = []
+        pos = self.first_cluster
+        while pos < self.segment_end:
+            element_id, length = _read_id(buf, pos)
+            size, size_length = _read_vint(buf, pos + length)
+            data_start = pos + length + size_length
+            end = self._cluster_end(data_start) if size is None else data_start + size
+            if element_id == CLUSTER:
+                time_ms = self._cluster_time(data_start, end)
+                if time_ms is not None:
+                    points.append([time_ms, pos, 0])
+            elif size is None:
+                break
+            pos = end
+        return points
+
+    def packets_from(self, start_ms, index=None):
+        """Yields packets from `start_ms`, starting at the nearest earlier seek point.
+
+        `index` (from seek_index()) has every cluster; without it the cues
+        are used, or the file is read from the start.
+        """
+        points = index if index is not None else self.cues
+        offset = None
+        found = bisect.bisect_right(points, start_ms, key=lambda point: point[0]) - 1
+        if found >= 0:
+            offset = points[found][1]
+        for time_ms, packet in self.packets(offset):
+            if time_ms >= start_ms:
+                yield time_ms, packet
+
+
+class OggDemuxer:
+    """Minimal Ogg reader for a single Opus logical stream."""
+
+    def __init__(self, buf):
+        self.buf = buf
+        self.serial = None
+        self.pre_skip = 0
+        self.first_audio_page = None
+
+        header_packets = 0
+        for page_offset, serial, granule, packets in self._pages(0):
+            if self.serial is None:
+                if not packets or not bytes(packets[0][:8]) == b'OpusHead':
+                    raise NotDemuxable("not an Ogg Opus stream")
+                self.serial = serial
+                self.pre_skip = struct.unpack_from('<H', packets[0], 10)[0]
+            if serial != self.serial:
+                continue
+            header_packets += len(packets)
+            if header_packets >= 2:
+                # OpusHead and OpusTags are done; audio starts on the next page
+                self.first_audio_page = self._next_page(page_offset)
+                break
+        if self.first_audio_page is None:
+            raise NotDemuxable("no audio in Ogg stream")
+
+    def _next_page(self, offset):
+        segments = self.buf[offset + 26]
+        table = self.buf[offset + 27:offset + 27 + segments]
+        return offset + 27 + segments + sum(table)
+
+    def _pages(self, offset):
+        """Yields (page offset, serial, granule, [complete packets]) for each page."""
+        buf = self.buf
+        carry = b''
+        while offset + 27 <= len(buf):
+            if buf[offset:offset + 4] != b'OggS':
+                raise NotDemuxable("lost Ogg sync")
+            granule, serial = struct.unpack_from('<qI', buf, offset + 6)
+            segments = buf[offset + 26]
+            table = buf[offset + 27:offset + 27 + segments]
+            pos = offset + 27 + segments
+            packets = []
+            start = pos
+            for lace in table:
+                pos += lace
+                if lace < 255:
+                    packets.append(carry + buf[start:pos] if carry else buf[start:pos])
+                    carry = b''
+                    start = pos
+            if start < pos:
+                carry += buf[start:pos]
+            yield offset, serial, granule, packets
+            offset = pos
+
+    def seek_index(self):
+        """[time_ms, page offset, first sample] for every page that starts with a new packet."""
+        buf = self.buf
+        points = []
+        offset = self.first_audio_page
+        previous_end = 0
+        while offset + 27 <= len(buf):
+            if buf[offset:offset + 4] != b'OggS':
+                raise NotDemuxable("lost Ogg sync")
+            continued = buf[offset + 5] & 1
+            granule, serial = struct.unpack_from('<qI', buf, offset + 6)
+            if serial == self.serial:
+                if not continued:
+                    points.append([max(0, previous_end - self.pre_skip) // 48, offset, previous_end])
+                if granule >= 0:
+                    previous_end = granule
+            offset = self._next_page(offset)
+        return points
+
+    def packets_from(self, start_ms=0, index=None):
+        """Yields (time_ms, packet) for the audio, starting at `start_ms`.
+
+        With an `index` (from seek_index()) this starts at the right page
+        directly; otherwise pages are scanned from the start.
+        """
+        start_sample = start_ms * 48 + self.pre_skip
+        offset = self.first_audio_page
+        sample = 0
+
+        if index:
+            found = bisect.bisect_right(index, start_sample, key=lambda point: point[2]) - 1
+            if found >= 0:
+                _, offset, sample = index[found]
+        elif start_sample > self.pre_skip:
+            # Skip whole pages whose last sample is before the target
+            previous_end = 0
+            for page_offset, serial, granule, packets in self._pages(self.first_audio_page):
+                if serial != self.serial or granule < 0:
+                    continue
+                if granule >= start_sample:
+                    offset, sample = page_offset, previous_end
+                    break
+                previous_end = granule
+
+        for page_offset, serial, granule, packets in self._pages(offset):
+            if serial != self.serial:
+                continue
+            for packet in packets:
+                duration = opus_packet_samples(packet)
+                if sample + duration > start_sample:
+                    # Rounded up, so packets_from(time) of a yielded time starts at that packet
+                    yield max(0, -(-(sample - self.pre_skip) // 48)), packet
+                sample += duration
+
+
+def open_demuxer(buf):
+    magic = buf[:4]
+    if magic == b'\x1a\x45\xdf\xa3':
+        return WebMDemuxer(buf)
+    if magic == b'OggS':
+        return OggDemuxer(buf)
+    raise NotDemuxable("unknown container")
+
+
+def build_seek_index(filename):
+    """Seek points of a cached Opus file, for storing next to it. Blocking.
+
+    Returns {'size': file size, 'points': [...]}, or None for files that are
+    played through ffmpeg anyway.
+    """
+    with open(filename, 'rb') as f:
+        try:
+            buf = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            return None
+        try:
+            points = open_demuxer(buf).seek_index()
+        except (NotDemuxable, IndexError, struct.error) as e:
+            log.debug("No seek index for %s: %s", filename, e)
+            return None
+        finally:
+            buf.close()
+    return {'size': os.path.getsize(filename), 'points': points}
+
+
+def load_seek_index(path, filename):
+    """Reads a stored seek index; None if there is none or it belongs to another version of the file."""
+    try:
+        with open(path, 'r') as f:
+            data = json.load(f)
+        if data.get('size') != os.path.getsize(filename):
+            return None
+        return data.get('points')
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+class OpusFileSource(discord.AudioSource):
+    """Plays a cached WebM/Ogg Opus file by handing its packets to the voice client unchanged.
+
+    The file is memory-mapped and demuxed in process, so no ffmpeg process is
+    spawned and nothing is decoded or re-encoded. Raises NotDemuxable for
+    anything that doesn't carry 20 ms Opus packets, so the caller can fall back
+    to FFmpegPCMAudio.
+    """
+
+    def __init__(self, filename, *, start=0, index=None):
+        self.filename = filename
+        self.index = index
+        self._file = open(filename, 'rb')
+        try:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        except ValueError:
+            self._file.close()
+            raise NotDemuxable("empty file")
+
+        try:
+            self.demuxer = open_demuxer(self._map)
+
+            # Every packet must be exactly 20 ms; check the head of the stream up front
+            for _, (_, packet) in zip(range(PROBE_PACKETS), self.demuxer.packets_from(0)):
+                if opus_packet_samples(packet) != FRAME_SAMPLES:
+                    raise NotDemuxable("packets are not 20 ms frames")
+
+            self._packets = self.demuxer.packets_from(round(start * 1000), index)
+        except (NotDemuxable, IndexError, struct.error) as e:
+            self.cleanup()
+            if isinstance(e, NotDemuxable):
+                raise
+            raise NotDemuxable(f"corrupt container: {e}")
+
+        self.position_ms = round(start * 1000)
+        self._warned = False
+
+    def read(self):
+        if self._packets is None:
+            return b''
+        try:
+            time_ms, packet = next(self._packets)
+        except (StopIteration, IndexError, NotDemuxable, struct.error):
+            return b''
+        self.position_ms = time_ms
+        if len(packet) and opus_packet_samples(packet) != FRAME_SAMPLES and not self._warned:
+            self._warned = True
+            log.warning("Non 20 ms Opus packet in %s, timing may drift", self.filename)
+        return bytes(packet)
+
+    def seek(self, seconds):
+        """Continues from `seconds` on the next read(). Safe to call while the player thread reads."""
+        if self.demuxer is None:
+            return
+        if self.index is None:
+            # Files downloaded before seek indexes existed; built once, from element headers only
+            self.index = self.demuxer.seek_index()
+        start_ms = max(0, round(seconds * 1000))
+        self._packets = self.demuxer.packets_from(start_ms, self.index)
+        self.position_ms = start_ms
+
+    def is_opus(self):
+        return True
+
+    def cleanup(self):
+        self._packets = None
+        self.demuxer = None
+        if getattr(self, '_map', None) is not None:
+            try:
+                self._map.close()
+            except BufferError:
+                pass  # a packet slice is still referenced; the map closes when it is released
+            self._map = None
+        if self._file:
+            self._file.close()
+            self._file = None
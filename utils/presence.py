@@ -0,0 +1,96 @@
+import asyncio
+import os
+import time
+import discord
+from utils.log import get_logger
+
+log = get_logger('presence')
+
+# Minimum seconds between presence updates sent to the gateway
+PRESENCE_MIN_INTERVAL = float(os.getenv('PRESENCE_MIN_INTERVAL', '15'))
+
+DEFAULT_STATUS = "The Don'ju | /help"
+
+
+class PresenceManager:
+    """Coalesces the bot's global presence across all guilds.
+
+    Presence is one value for the whole bot, so players only report what they
+    are doing and the manager decides what to show. Updates are sent at most
+    once per PRESENCE_MIN_INTERVAL, and only when the status actually changes.
+    """
+
+    def __init__(self, bot, min_interval=PRESENCE_MIN_INTERVAL):
+        self.bot = bot
+        self.min_interval = min_interval
+        self.now_playing = {}  # guild_id -> (title, started_at)
+        self.sent = 0
+        self.skipped = 0
+        self._last_key = None
+        self._last_sent_at = 0.0
+        self._task = None
+        self._dirty = False  # something changed since the running flush looked
+
+    def track_started(self, guild_id, title):
+        self.now_playing[guild_id] = (title or "music", time.monotonic())
+        self.request()
+
+    def track_stopped(self, guild_id):
+        if self.now_playing.pop(guild_id, None) is not None:
+            self.request()
+
+    def invalidate(self):
+        """Forgets what was last sent, e.g. after the gateway re-identified."""
+        self._last_key = None
+        self.request()
+
+    def describe(self):
+        """Picks the representative status for everything currently playing."""
+        if not self.now_playing:
+            return ('game', DEFAULT_STATUS)
+        if len(self.now_playing) == 1:
+            title, _ = next(iter(self.now_playing.values()))
+            return ('listening', title[:128])
+        return ('game', f"in {len(self.now_playing)} servers | /help")
+
+    def request(self):
+        """Schedules a presence refresh, merging with any already pending."""
+        self._dirty = True
+        if self._task and not self._task.done():
+            # The running flush checks the flag once it is done sending
+            return
+        delay = max(0.0, self._last_sent_at + self.min_interval - time.monotonic())
+        self._task = self.bot.loop.create_task(self._flush(delay))
+
+    async def _flush(self, delay):
+        while True:
+            if delay:
+                await asyncio.sleep(delay)
+            await self.bot.wait_until_ready()
+            self._dirty = False
+            await self._send(self.describe())
+            # Changes made while change_presence() was held back by the rate limiter go out next
+            if not self._dirty:
+                return
+            delay = max(0.0, self._last_sent_at + self.min_interval - time.monotonic())
+
+    async def _send(self, key):
+        if key == self._last_key:
+            self.skipped += 1
+            return
+
+        kind, name = key
+        if kind == 'listening':
+            activity = discord.Activity(type=discord.ActivityType.listening, name=name)
+        else:
+            activity = discord.Game(name=name)
+
+        try:
+            await self.bot.change_presence(activity=activity)
+        except Exception as e:
+            log.warning("Failed to update presence: %s", e)
+            return
+        self._last_key = key
+        self._last_sent_at = time.monotonic()
+        self.sent += 1
+        log.debug("Presence set to %s %r", kind, name)
@@ -0,0 +1,105 @@
+import json
+import os
+import statistics
+import time
+from utils.log import get_logger
+from utils import storage
+
+log = get_logger('restart')
+
+# Seconds the bot spends saving state and leaving voice on SIGTERM before it exits anyway.
+# Keep it below the pod's terminationGracePeriodSeconds
+SHUTDOWN_TIMEOUT = int(os.getenv('SHUTDOWN_TIMEOUT', '15'))
+
+# Seconds voice disconnects get during shutdown, and after startup until guilds that still
+# haven't resumed are reported as missing
+VOICE_DISCONNECT_TIMEOUT = 5
+RESTART_REPORT_AFTER = 120
+
+# Answer to commands and button clicks arriving between SIGTERM and exit
+RESTARTING_MESSAGE = "🔄 The bot is restarting, try again in a few seconds!"
+
+CHECKPOINT = 'shutdown.json'
+REPORTS = 'restarts.jsonl'
+
+
+def write_checkpoint(stopped_at, playing, downloads):
+    """Records a graceful shutdown: when the audio stopped, where, and which downloads were cut off."""
+    storage.write_json(storage.state_path(CHECKPOINT), {
+        'stopped_at': stopped_at,
+        'playing': playing,
+        'downloads': downloads,
+    })
+
+
+def read_checkpoint():
+    """The previous process's shutdown checkpoint, or None after a crash. Read once: the file is removed."""
+    path = storage.state_path(CHECKPOINT)
+    try:
+        with open(path, 'r') as f:
+            checkpoint = json.load(f)
+    except (OSError, ValueError):
+        return None
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+    return checkpoint if isinstance(checkpoint, dict) else None
+
+
+class RestartReport:
+    """Measures how long the audio was down across a restart, per guild.
+
+    Downtime runs from the moment the old process paused a guild's audio
+    to the moment the new one starts playing there again; the time until
+    the new process was ready is reported alongside, so slow pod starts
+    and slow restores can be told apart. Once every guild that was playing
+    is back (or after RESTART_REPORT_AFTER seconds) the result is logged
+    and appended to songs/state/restarts.jsonl.
+    """
+
+    def __init__(self, checkpoint, ready_at):
+        self.stopped_at = checkpoint.get('stopped_at') or ready_at
+        self.ready_at = ready_at
+        self.pending = {int(guild_id) for guild_id in checkpoint.get('playing', [])}
+        self.downtimes = {}
+        self.finished = False
+
+    def resumed(self, guild_id):
+        """Called when a guild's audio starts; returns its downtime if it was waiting for a restart."""
+        if guild_id not in self.pending:
+            return None
+        self.pending.discard(guild_id)
+        downtime = time.time() - self.stopped_at
+        self.downtimes[guild_id] = downtime
+        log.info("Audio back after %.1fs (%.1fs after startup)", downtime, time.time() - self.ready_at,
+                 extra={'guild_id': guild_id})
+        if not self.pending:
+            self.finish()
+        return downtime
+
+    def finish(self):
+        if self.finished:
+            return
+        self.finished = True
+        downtimes = sorted(self.downtimes.values())
+        report = {
+            'stopped_at': round(self.stopped_at, 3),
+            'ready_at': round(self.ready_at, 3),
+            'startup': round(self.ready_at - self.stopped_at, 2),
+            'resumed': len(downtimes),
+            'missing': sorted(self.pending),
+            'p50': round(statistics.median(downtimes), 2) if downtimes else None,
+            'max': round(downtimes[-1], 2) if downtimes else None,
+            'downtimes': {str(guild_id): round(downtime, 2) for guild_id, downtime in self.downtimes.items()},
+        }
+        if downtimes:
+            log.info("Restart downtime: %d guilds back, median %.1fs, max %.1fs (bot ready after %.1fs), %d missing",
+                     len(downtimes), report['p50'], report['max'], report['startup'], len(self.pending))
+        elif self.pending:
+            log.warning("Restart downtime: none of %d playing guilds resumed", len(self.pending))
+        try:
+            with open(storage.state_path(REPORTS), 'a') as f:
+                f.write(json.dumps(report) + '\n')
+        except OSError as e:
+            log.warning("Failed to write restart report: %s", e)
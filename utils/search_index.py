@@ -0,0 +1,297 @@
+import bisect
+import heapq
+import itertools
+import json
+import os
+import re
+import unicodedata
+from collections import defaultdict, deque
+from utils import storage
+from utils.log import get_logger
+
+log = get_logger('music.search')
+
+# Discord allows at most 25 autocomplete choices of up to 100 characters
+MAX_CHOICES = 25
+CHOICE_LENGTH = 100
+
+# Recent free-text searches remembered per guild
+RECENT_SEARCHES = 20
+
+# Below this many candidates, remaining terms are checked per entry instead of by set intersection
+FILTER_THRESHOLD = 256
+
+# Larger candidate sets (very short queries) are trimmed before ranking, so a lookup stays O(limit)
+RANK_POOL = 500
+
+_WORD = re.compile(r'\w+')
+
+
+def tokenize(text):
+    """Lowercased, accent-free word tokens of a title or query."""
+    text = unicodedata.normalize('NFKD', (text or '').casefold())
+    text = ''.join(c for c in text if not unicodedata.combining(c))
+    return _WORD.findall(text)
+
+
+class SearchIndex:
+    """In-memory prefix and token index over cached song titles and uploaders.
+
+    Every token maps to the ids containing it, and a sorted token list turns
+    "tokens starting with x" into a bisect range, so a lookup never touches the
+    disk or scans every entry. Entries are persisted as compact JSON lines next
+    to the bot state, so startup only parses .info.json files it hasn't seen.
+    New entries are buffered and appended by flush(), off the event loop.
+
+    The startup build happens off the event loop in a separate index (load())
+    that install() swaps in; until then searches find nothing and add() calls
+    are held back and replayed after the swap.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}                     # id -> (title, uploader, url, duration)
+        self._tokens = defaultdict(set)       # token -> ids
+        self._entry_tokens = {}               # id -> tuple of tokens
+        self._titles = {}                     # id -> normalized title, for ranking
+        self._sorted = []                     # every token, sorted, for prefix ranges
+        self._sorted_titles = []              # (normalized title, id), sorted, for title prefix ranges
+        self._recent = defaultdict(lambda: deque(maxlen=RECENT_SEARCHES))  # guild_id -> queries
+        self._pending = []                    # add() calls made before install()
+        self._unsaved = []                    # records indexed since the last flush()
+        self.ready = False
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, video_id):
+        return video_id in self.entries
+
+    # Building -------------------------------------------------------------
+
+    def _index(self, video_id, title, uploader, url, duration):
+        if video_id in self.entries:
+            self._unindex(video_id)
+        self.entries[video_id] = (title or video_id, uploader or '', url, duration)
+        title_tokens = tokenize(title)
+        self._titles[video_id] = ' '.join(title_tokens)
+        bisect.insort(self._sorted_titles, (self._titles[video_id], video_id))
+        tokens = tuple(dict.fromkeys(title_tokens + tokenize(uploader)))
+        self._entry_tokens[video_id] = tokens
+        for token in tokens:
+            ids = self._tokens[token]
+            if not ids:
+                bisect.insort(self._sorted, token)
+            ids.add(video_id)
+
+    def _unindex(self, video_id):
+        for token in self._entry_tokens.pop(video_id, ()):
+            ids = self._tokens.get(token)
+            if ids is None:
+                continue
+            ids.discard(video_id)
+            if not ids:
+                del self._tokens[token]
+                index = bisect.bisect_left(self._sorted, token)
+                if index < len(self._sorted) and self._sorted[index] == token:
+                    del self._sorted[index]
+        self.entries.pop(video_id, None)
+        title = self._titles.pop(video_id, None)
+        if title is not None:
+            index = bisect.bisect_left(self._sorted_titles, (title, video_id))
+            if index < len(self._sorted_titles) and self._sorted_titles[index] == (title, video_id):
+                del self._sorted_titles[index]
+
+    def add(self, info):
+        """Indexes a song from a yt-dlp info dict (or a Track's fields) and persists it."""
+        video_id = info.get('id')
+        if not video_id:
+            return
+        if not self.ready:
+            # The build is still running on another thread; indexed once it is installed
+            self._pending.append(info)
+            return
+        record = {
+            'id': video_id,
+            'title': info.get('title'),
+            'uploader': info.get('uploader') or info.get('channel'),
+            'url': info.get('webpage_url'),
+            'duration': info.get('duration'),
+        }
+        known = self.entries.get(video_id)
+        self._index(video_id, record['title'], record['uploader'], record['url'], record['duration'])
+        if known != self.entries[video_id]:
+            self._unsaved.append(record)
+
+    def flush(self):
+        """Appends the records indexed since the last flush to the file. Blocking."""
+        records, self._unsaved = self._unsaved, []
+        if not records:
+            return
+        try:
+            with open(self.path, 'a') as f:
+                f.write(''.join(json.dumps(record) + '\n' for record in records))
+        except OSError as e:
+            log.warning("Failed to persist %d search index entries: %s", len(records), e)
+
+    def load(self):
+        """Builds the index from the persisted entries plus cached metadata they don't cover. Blocking.
+
+        Runs in an executor and touches nothing the event loop uses: the result
+        is a separate SearchIndex, to be passed to install() on the loop.
+        """
+        built = SearchIndex(self.path)
+        built._build()
+        return built
+
+    def install(self, built):
+        """Takes over a load() result, then indexes songs added meanwhile. Call on the event loop."""
+        self.entries = built.entries
+        self._tokens = built._tokens
+        self._entry_tokens = built._entry_tokens
+        self._titles = built._titles
+        self._sorted = built._sorted
+        self._sorted_titles = built._sorted_titles
+        self.ready = True
+        pending, self._pending = self._pending, []
+        for info in pending:
+            self.add(info)
+
+    def _build(self):
+        if os.path.exists(self.path):
+            with open(self.path, 'r') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    if not record.get('id'):
+                        continue
+                    self._index(record['id'], record.get('title'), record.get('uploader'),
+                                record.get('url'), record.get('duration'))
+
+        missing = []
+        for video_id, path in storage.iter_info():
+            if video_id in self.entries:
+                continue
+            try:
+                with open(path, 'r') as f:
+                    info = json.load(f)
+            except (OSError, ValueError):
+                continue
+            record = {
+                'id': video_id,
+                'title': info.get('title'),
+                'uploader': info.get('uploader') or info.get('channel'),
+                'url': info.get('webpage_url'),
+                'duration': info.get('duration'),
+            }
+            self._index(video_id, record['title'], record['uploader'], record['url'], record['duration'])
+            missing.append(record)
+
+        # Rewrite when new entries were found, which also drops duplicate lines
+        if missing:
+            tmp_path = self.path + '.tmp'
+            with open(tmp_path, 'w') as f:
+                for video_id, (title, uploader, url, duration) in self.entries.items():
+                    f.write(json.dumps({'id': video_id, 'title': title, 'uploader': uploader,
+                                        'url': url, 'duration': duration}) + '\n')
+            os.replace(tmp_path, self.path)
+        log.info("Search index ready: %d songs (%d newly indexed)", len(self.entries), len(missing))
+
+    # Lookup ---------------------------------------------------------------
+
+    def _prefix_ids(self, prefix):
+        """Ids with any token starting with `prefix`."""
+        start = bisect.bisect_left(self._sorted, prefix)
+        ids = set()
+        for token in _with_prefix(self._sorted, start, prefix):
+            ids |= self._tokens.get(token, ())
+        return ids
+
+    def search(self, query, limit=MAX_CHOICES, plays=None):
+        """Returns ids where every term of `query` starts a word of the title or uploader, best first.
+
+        Titles that start with the query rank first, then songs with more
+        `plays` (a Counter of id -> play count), then shorter titles.
+        """
+        terms = tokenize(query)
+        if not terms or not self.ready:
+            return []
+
+        # Start from the most selective term; finish small candidate sets per entry
+        ordered = sorted(terms, key=len, reverse=True)
+        candidates = self._prefix_ids(ordered[0])
+        for term in ordered[1:]:
+            if not candidates:
+                return []
+            if len(candidates) <= FILTER_THRESHOLD:
+                candidates = {video_id for video_id in candidates
+                              if any(token.startswith(term) for token in self._entry_tokens[video_id])}
+            else:
+                candidates &= self._prefix_ids(term)
+
+        normalized = ' '.join(terms)
+        plays = plays or {}
+        titles = self._titles
+
+        if len(candidates) > RANK_POOL:
+            # Only titles starting with the query, played songs and a few others can make the cut
+            start = bisect.bisect_left(self._sorted_titles, (normalized,))
+            pool = set()
+            for title, video_id in itertools.islice(self._sorted_titles, start, start + RANK_POOL):
+                if not title.startswith(normalized):
+                    break
+                pool.add(video_id)
+            pool.update(video_id for video_id in plays if video_id in candidates)
+            pool.update(itertools.islice(candidates, limit))
+            candidates = pool
+
+        def rank(video_id):
+            title = titles[video_id]
+            return (not title.startswith(normalized), -plays.get(video_id, 0), len(title))
+
+        return heapq.nsmallest(limit, candidates, key=rank)
+
+    def top(self, plays, limit=MAX_CHOICES):
+        """The most played indexed songs, for an empty query."""
+        if not plays:
+            return []
+        return [video_id for video_id, _ in plays.most_common() if video_id in self.entries][:limit]
+
+    # Recent searches ------------------------------------------------------
+
+    def remember_search(self, guild_id, query):
+        recent = self._recent[guild_id]
+        if query in recent:
+            recent.remove(query)
+        recent.appendleft(query)
+
+    def recent_searches(self, guild_id, prefix=''):
+        prefix = prefix.casefold()
+        return [query for query in self._recent.get(guild_id, ()) if query.casefold().startswith(prefix)]
+
+    # Choices --------------------------------------------------------------
+
+    def choice(self, video_id):
+        """(name, value) for an autocomplete choice; the value is the song's URL."""
+        title, uploader, url, duration = self.entries[video_id]
+        length = f" • {int(duration // 60)}:{int(duration % 60):02d}" if duration else ""
+        suffix = f" — {uploader}" if uploader else ""
+        name = f"💾 {title}"
+        budget = CHOICE_LENGTH - len(length) - len(suffix)
+        if len(name) > budget:
+            name = name[:max(budget - 3, 10)] + "..."
+        name = (name + suffix)[:CHOICE_LENGTH - len(length)] + length
+        if not url or len(url) > CHOICE_LENGTH:
+            url = f"https://www.youtube.com/watch?v={video_id}"
+        return name, url
+
+
+def _with_prefix(tokens, start, prefix):
+    """Yields tokens[start:] while they start with `prefix`."""
+    for index in range(start, len(tokens)):
+        token = tokens[index]
+        if not token.startswith(prefix):
+            return
+        yield token
@@ -0,0 +1,271 @@
+import asyncio
+import hashlib
+import json
+import os
+import time
+from yt_dlp.postprocessor import PostProcessor
+from utils.log import get_logger
+
+log = get_logger('music.storage')
+
+# Cache layout:
+#   songs/audio/ab/cd/<id>.<ext>       audio, sharded by sha1(id)
+#   songs/meta/ab/cd/<id>.info.json    yt-dlp metadata, same sharding
+#   songs/meta/ab/cd/<id>.seek.json    seek points of the audio file
+#   songs/state/                       state.json, history and other bot state
+# Older caches keep everything flat in songs/, which migrate_flat_layout() converts.
+SONGS_DIR = 'songs'
+AUDIO_DIR = os.path.join(SONGS_DIR, 'audio')
+META_DIR = os.path.join(SONGS_DIR, 'meta')
+STATE_DIR = os.path.join(SONGS_DIR, 'state')
+
+# yt-dlp output templates; the shard fields are filled in by ShardPP
+OUTTMPL = {
+    'default': os.path.join(AUDIO_DIR, '%(cache_shard1)s', '%(cache_shard2)s', '%(id)s.%(ext)s'),
+    'infojson': os.path.join(META_DIR, '%(cache_shard1)s', '%(cache_shard2)s', '%(id)s.%(ext)s'),
+}
+
+# Unfinished downloads: yt-dlp's .part/.ytdl/.temp files, fragments and aria2c control files
+PARTIAL_SUFFIXES = ('.part', '.ytdl', '.temp', '.aria2')
+
+# Files in the flat songs/ directory are only considered until migration finished
+_legacy_layout = True
+
+
+def is_partial(name):
+    return name.endswith(PARTIAL_SUFFIXES) or '.part-Frag' in name
+
+
+def shard(video_id):
+    digest = hashlib.sha1(str(video_id).encode()).hexdigest()
+    return digest[:2], digest[2:4]
+
+
+def audio_path(video_id, ext):
+    """Where the audio for a video lives in the sharded layout."""
+    return os.path.join(AUDIO_DIR, *shard(video_id), f"{video_id}.{ext}")
+
+
+def info_path(video_id):
+    return os.path.join(META_DIR, *shard(video_id), f"{video_id}.info.json")
+
+
+def seek_path(video_id):
+    """Seek index of a cached audio file, next to its metadata."""
+    return os.path.join(META_DIR, *shard(video_id), f"{video_id}.seek.json")
+
+
+def state_path(name):
+    return os.path.join(STATE_DIR, name)
+
+
+def write_json(path, data):
+    """Writes JSON through a temporary file, so being killed mid-write never leaves half a file."""
+    temp = f"{path}.tmp"
+    with open(temp, 'w') as f:
+        json.dump(data, f)
+    os.replace(temp, path)
+
+
+def find_audio(video_id, ext):
+    """Returns the cached audio path for a video, or None."""
+    # The flat path is checked first: migration only moves files from flat to
+    # sharded, so this order can't miss a file that is being moved
+    if _legacy_layout:
+        legacy = os.path.join(SONGS_DIR, f"{video_id}.{ext}")
+        if os.path.exists(legacy):
+            return legacy
+    path = audio_path(video_id, ext)
+    return path if os.path.exists(path) else None
+
+
+def find_info(video_id):
+    """Returns the cached .info.json path for a video id, or None."""
+    if _legacy_layout:
+        legacy = os.path.join(SONGS_DIR, f"{video_id}.info.json")
+        if os.path.exists(legacy):
+            return legacy
+    path = info_path(video_id)
+    return path if os.path.exists(path) else None
+
+
+def _walk(root):
+    """Yields os.DirEntry objects for every file below root."""
+    try:
+        with os.scandir(root) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    yield from _walk(entry.path)
+                elif entry.is_file(follow_symlinks=False):
+                    yield entry
+    except FileNotFoundError:
+        return
+
+
+def _legacy_files(always=False):
+    if not (_legacy_layout or always):
+        return
+    try:
+        with os.scandir(SONGS_DIR) as entries:
+            for entry in entries:
+                if entry.is_file(follow_symlinks=False):
+                    yield entry
+    except FileNotFoundError:
+        return
+
+
+def iter_audio():
+    """Yields (video_id, path, size) for every cached audio file."""
+    for entry in _legacy_files():
+        name = entry.name
+        if name.endswith(('.json', '.jsonl', '.tmp')) or is_partial(name):
+            continue
+        yield name.rsplit('.', 1)[0], entry.path, entry.stat().st_size
+    for entry in _walk(AUDIO_DIR):
+        if is_partial(entry.name):
+            continue
+        yield entry.name.rsplit('.', 1)[0], entry.path, entry.stat().st_size
+
+
+def iter_info():
+    """Yields (video_id, path) for every cached .info.json."""
+    for entry in _legacy_files():
+        if entry.name.endswith('.info.json'):
+            yield entry.name[:-len('.info.json')], entry.path
+    for entry in _walk(META_DIR):
+        if entry.name.endswith('.info.json'):
+            yield entry.name[:-len('.info.json')], entry.path
+
+
+def iter_partials():
+    """Yields os.DirEntry objects for unfinished downloads."""
+    for entry in _legacy_files(always=True):
+        if is_partial(entry.name):
+            yield entry
+    for entry in _walk(AUDIO_DIR):
+        if is_partial(entry.name):
+            yield entry
+
+
+def collect_partials(active_ids, max_age):
+    """Deletes unfinished downloads that nothing is resuming. Blocking.
+
+    A partial is kept while a download of its video is running (`active_ids`)
+    or while it is younger than `max_age` seconds, so an interrupted download
+    can pick up where it stopped. Returns (files removed, bytes freed).
+    """
+    cutoff = time.time() - max_age
+    removed = freed = 0
+    for entry in iter_partials():
+        video_id = entry.name.split('.', 1)[0]
+        if video_id in active_ids:
+            continue
+        try:
+            stat = entry.stat()
+            if stat.st_mtime > cutoff:
+                continue
+            os.remove(entry.path)
+            removed += 1
+            freed += stat.st_size
+        except OSError as e:
+            log.warning("Failed to delete %s: %s", entry.name, e)
+    return removed, freed
+
+
+def total_size():
+    """Bytes used by everything under songs/ (audio, metadata, partials and state)."""
+    return sum(entry.stat().st_size for entry in _walk(SONGS_DIR))
+
+
+def ensure_dirs():
+    for path in (AUDIO_DIR, META_DIR, STATE_DIR):
+        os.makedirs(path, exist_ok=True)
+
+
+class ShardPP(PostProcessor):
+    """Adds the cache shard fields used by OUTTMPL to every extracted video."""
+
+    def run(self, info):
+        if info.get('id'):
+            info['cache_shard1'], info['cache_shard2'] = shard(info['id'])
+        return [], info
+
+
+# Bot state that used to live next to the audio
+STATE_FILES = ('state.json', 'history.jsonl')
+
+
+def migrate_state_files():
+    """Moves flat state files into songs/state/. Called once at startup, before anything writes state."""
+    ensure_dirs()
+    for name in STATE_FILES:
+        source = os.path.join(SONGS_DIR, name)
+        if os.path.exists(source) and not os.path.exists(state_path(name)):
+            os.replace(source, state_path(name))
+
+
+def _migrate_batch(names):
+    """Moves a batch of flat files into the sharded layout. Blocking."""
+    moved = 0
+    for name in names:
+        source = os.path.join(SONGS_DIR, name)
+        if name in STATE_FILES:
+            continue
+        elif name.endswith('.info.json'):
+            target = info_path(name[:-len('.info.json')])
+        elif is_partial(name) or name.startswith('.'):
+            continue
+        else:
+            video_id, ext = name.rsplit('.', 1) if '.' in name else (name, '')
+            target = audio_path(video_id, ext)
+        try:
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            # Rename is atomic on one filesystem; players holding the file open keep reading it
+            if not os.path.exists(target):
+                os.replace(source, target)
+            else:
+                os.remove(source)
+            moved += 1
+        except OSError as e:
+            log.warning("Failed to migrate %s: %s", name, e)
+    return moved
+
+
+def _flat_names():
+    """Names of the files still to migrate from the flat songs/ directory. Blocking."""
+    return [entry.name for entry in _legacy_files() if entry.name not in STATE_FILES]
+
+
+def _flat_leftover():
+    """Files the migration should have moved but didn't. Blocking."""
+    # Only partials (left to collect_partials) may be left in the flat directory
+    return [entry.name for entry in _legacy_files()
+            if not is_partial(entry.name) and entry.name not in STATE_FILES
+            and not entry.name.startswith('.')]
+
+
+async def migrate_flat_layout(loop, batch_size=100, pause=0.2):
+    """Moves a flat songs/ cache into the sharded layout without blocking playback.
+
+    The flat directory is listed and files are moved in small batches in the
+    executor, with a pause between batches; lookups check both layouts until
+    the migration completes.
+    """
+    global _legacy_layout
+    ensure_dirs()
+    names = await loop.run_in_executor(None, _flat_names)
+    if not names:
+        _legacy_layout = False
+        return 0
+
+    log.info("Migrating %d cache files to the sharded layout", len(names))
+    moved = 0
+    for start in range(0, len(names), batch_size):
+        moved += await loop.run_in_executor(None, _migrate_batch, names[start:start + batch_size])
+        await asyncio.sleep(pause)
+
+    leftover = await loop.run_in_executor(None, _flat_leftover)
+    if not leftover:
+        _legacy_layout = False
+    log.info("Cache migration finished: %d files moved, %d left", moved, len(leftover))
+    return moved
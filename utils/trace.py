@@ -0,0 +1,150 @@
+import hashlib
+import json
+import os
+import re
+import time
+import discord
+from utils.log import get_logger
+from utils.media import extract_video_id, is_playlist_url, split_queries
+
+log = get_logger('trace')
+
+# JSON-lines file the command trace is appended to, e.g. songs/state/trace.jsonl. Unset records nothing
+COMMAND_TRACE = os.getenv('COMMAND_TRACE', '')
+
+# Options whose text is what users typed (queries); recorded as hashes, see sanitize_query()
+QUERY_OPTIONS = {'search', 'songs', 'current'}
+
+# Other text options are kept when they look like this (positions, levels), hashed otherwise
+PLAIN_VALUE = re.compile(r'^[\w:+\-. ]{0,24}$')
+
+INTERACTION_KINDS = {
+    discord.InteractionType.application_command: 'command',
+    discord.InteractionType.autocomplete: 'autocomplete',
+    discord.InteractionType.component: 'component',
+}
+
+
+def _hash(salt, value):
+    return hashlib.sha1(salt + str(value).encode()).hexdigest()[:12]
+
+
+class CommandTrace:
+    """Appends a sanitised record of every interaction, for replaying real traffic shapes.
+
+    One line per interaction: arrival time, kind (command, autocomplete,
+    component), command name or button id, guild and a hashed user, and the
+    options. Video ids are kept so replays hit the cache the way the real
+    traffic did; search text and playlist ids are replaced by stable hashes
+    and user ids are hashed with a per-process salt, so nothing anyone typed
+    ends up in the file. scripts/replay_trace.py plays a trace back. Lines
+    are buffered and appended by flush(), off the event loop.
+    """
+
+    def __init__(self, path=COMMAND_TRACE):
+        self.path = path
+        self.enabled = bool(path)
+        self.recorded = 0
+        self._salt = os.urandom(8)
+        self._unsaved = []  # events recorded since the last flush()
+        if self.enabled:
+            log.info("Recording command trace to %s", path)
+
+    def sanitize_query(self, text):
+        """A query option without what was typed: video ids stay, everything else becomes a hash."""
+        text = str(text).strip()
+        if text.lower() == 'random':
+            return {'random': True}
+        if text.startswith(('http://', 'https://')):
+            if is_playlist_url(text):
+                return {'playlist': _hash(self._salt, text)}
+            video_id = extract_video_id(text)
+            return {'video': video_id} if video_id else {'url': _hash(self._salt, text)}
+        # The same text always maps to the same hash, so repeated searches stay repeated
+        return {'query': _hash(self._salt, text.lower()), 'length': len(text)}
+
+    def sanitize_value(self, name, value):
+        if isinstance(value, (bool, int, float)) or value is None:
+            return value
+        if name == 'songs':
+            return [self.sanitize_query(part) for part in split_queries(str(value))]
+        if name in QUERY_OPTIONS:
+            return self.sanitize_query(value)
+        value = str(value)
+        return value if PLAIN_VALUE.match(value) else {'hash': _hash(self._salt, value)}
+
+    def _options(self, options, path):
+        # Subcommands nest their options; their names become part of the command path
+        values = {}
+        for option in options or []:
+            if 'options' in option and 'value' not in option:
+                path.append(option['name'])
+                values.update(self._options(option['options'], path))
+            else:
+                values[option['name']] = self.sanitize_value(option['name'], option.get('value'))
+        return values
+
+    def event(self, interaction):
+        """The trace line for an interaction, or None for kinds that aren't recorded."""
+        kind = INTERACTION_KINDS.get(interaction.type)
+        data = interaction.data or {}
+        if kind is None:
+            return None
+        user = interaction.user
+        voice = getattr(user, 'voice', None)
+        event = {
+            't': round(time.time(), 3),
+            'kind': kind,
+            'guild': interaction.guild_id,
+            'user': _hash(self._salt, user.id) if user else None,
+            'voice': bool(voice and voice.channel),
+        }
+        if kind == 'component':
+            event['id'] = data.get('custom_id')
+        else:
+            path = [data.get('name')]
+            event['options'] = self._options(data.get('options'), path)
+            event['name'] = ' '.join(path)
+        return event
+
+    def record(self, interaction):
+        if not self.enabled:
+            return
+        try:
+            event = self.event(interaction)
+        except Exception as e:
+            log.debug("Couldn't trace interaction: %s", e)
+            return
+        if event is None:
+            return
+        self._unsaved.append(event)
+        self.recorded += 1
+
+    def flush(self):
+        """Appends the events recorded since the last flush to the trace file. Blocking."""
+        events, self._unsaved = self._unsaved, []
+        if not events:
+            return
+        try:
+            with open(self.path, 'a') as f:
+                f.write(''.join(json.dumps(event) + '\n' for event in events))
+        except OSError as e:
+            log.warning("Failed to record %d traced interactions: %s", len(events), e)
+
+
+def load_trace(path):
+    """Reads a trace file, oldest first. Unreadable lines are skipped."""
+    events = []
+    with open(path, 'r') as f:
+        for line in f:
+            try:
+                event = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(event, dict) and 't' in event and 'kind' in event:
+                events.append(event)
+    events.sort(key=lambda event: event['t'])
+    return events
+
+
+trace = CommandTrace()
@@ -0,0 +1,121 @@
+import json
+from utils import storage
+from utils.log import get_logger
+
+log = get_logger('music.track')
+
+
+def load_info(video_id):
+    """Reads a video's full cached yt-dlp metadata (.info.json), or returns None. Blocking."""
+    path = storage.find_info(video_id)
+    if path is None:
+        return None
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except Exception as e:
+        log.warning("Failed to load cache for %s: %s", video_id, e, extra={'track_id': video_id})
+        return None
+
+
+class Track:
+    """A queued song: only what the player, embeds and saved state need.
+
+    yt-dlp info dicts carry formats, thumbnails, subtitles and headers and
+    easily reach 100+ KB; they are converted to a Track once, when the song is
+    queued. The full metadata stays in the cache's .info.json and can be read
+    back with load_info().
+    """
+
+    __slots__ = ('id', 'title', 'webpage_url', 'duration', 'thumbnail', 'uploader',
+                 'requested_by', 'resume_position', 'ext', 'placeholder')
+
+    def __init__(self, id, title=None, webpage_url=None, duration=None, thumbnail=None, uploader=None,
+                 requested_by=None, resume_position=0, ext=None, placeholder=False):
+        self.id = id
+        self.title = title
+        self.webpage_url = webpage_url
+        self.duration = duration
+        self.thumbnail = thumbnail
+        self.uploader = uploader
+        self.requested_by = requested_by
+        self.resume_position = resume_position
+        self.ext = ext
+        self.placeholder = placeholder
+
+    def __repr__(self):
+        return f"<Track {self.id} {self.title!r}{' placeholder' if self.placeholder else ''}>"
+
+    @classmethod
+    def from_info(cls, info, requested_by=None):
+        """Builds a Track from a full yt-dlp info dict."""
+        return cls(
+            info.get('id'),
+            title=info.get('title'),
+            webpage_url=info.get('webpage_url'),
+            duration=info.get('duration'),
+            thumbnail=info.get('thumbnail'),
+            uploader=info.get('uploader'),
+            requested_by=requested_by,
+            ext=info.get('ext'),
+        )
+
+    @classmethod
+    def from_entry(cls, entry, requested_by=None):
+        """Builds a placeholder from a flat playlist entry; it is resolved before it plays."""
+        video_id = entry.get('id')
+        url = entry.get('url') or entry.get('webpage_url')
+        if video_id and (not url or not url.startswith(('http://', 'https://'))):
+            url = f"https://www.youtube.com/watch?v={video_id}"
+        thumbnails = entry.get('thumbnails') or []
+        return cls(
+            video_id,
+            title=entry.get('title') or url,
+            webpage_url=url,
+            duration=entry.get('duration'),
+            thumbnail=thumbnails[-1].get('url') if thumbnails else entry.get('thumbnail'),
+            uploader=entry.get('uploader') or entry.get('channel'),
+            requested_by=requested_by,
+            placeholder=True,
+        )
+
+    @classmethod
+    def from_dict(cls, data):
+        """Builds a Track from saved state, including older state files that stored full info dicts."""
+        return cls(
+            data.get('id'),
+            title=data.get('title'),
+            webpage_url=data.get('webpage_url'),
+            duration=data.get('duration'),
+            thumbnail=data.get('thumbnail'),
+            uploader=data.get('uploader'),
+            requested_by=data.get('requested_by'),
+            resume_position=data.get('resume_position', data.get('_resume_position', 0)),
+            ext=data.get('ext'),
+            placeholder=data.get('placeholder', data.get('_placeholder', False)),
+        )
+
+    def to_dict(self):
+        """Compact form for state.json; unset fields are left out."""
+        data = {}
+        for name in self.__slots__:
+            value = getattr(self, name)
+            if value:
+                data[name] = value
+        return data
+
+    def copy(self, **changes):
+        track = Track(*(getattr(self, name) for name in self.__slots__))
+        for name, value in changes.items():
+            setattr(track, name, value)
+        return track
+
+    def load_info(self):
+        """Reads the full yt-dlp metadata for this track from the cache. Blocking."""
+        return load_info(self.id)
+
+    def cached_path(self):
+        """The cached audio file for this track, or None."""
+        if not self.id or not self.ext:
+            return None
+        return storage.find_audio(self.id, self.ext)
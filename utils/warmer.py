@@ -0,0 +1,103 @@
+import asyncio
+import os
+import shutil
+import time
+from collections import deque
+from utils.log import get_logger
+
+log = get_logger('music.warmer')
+
+# Set CACHE_WARMER=0 to disable background pre-downloading
+WARMER_ENABLED = os.getenv('CACHE_WARMER', '1') == '1'
+
+# Seconds between warming rounds, and songs tried per round
+WARM_INTERVAL = int(os.getenv('WARM_INTERVAL', '600'))
+WARM_BATCH = int(os.getenv('WARM_BATCH', '5'))
+
+# Max MB pre-downloaded per hour, and free disk (MB) that must remain on the cache volume
+WARM_BUDGET_MB = int(os.getenv('WARM_BUDGET_MB', '200'))
+WARM_MIN_FREE_MB = int(os.getenv('WARM_MIN_FREE_MB', '2048'))
+
+
+class CacheWarmer:
+    """Pre-downloads songs guilds are likely to request, while the bot is idle.
+
+    Candidates come from PlayHistory. Each download is checked against an
+    hourly bandwidth budget and a free-disk floor, and the warmer backs off as
+    soon as `is_busy()` reports interactive work (user downloads, lookups).
+    """
+
+    def __init__(self, bot, history, *, is_busy, cached_path, download, cache_dir='songs'):
+        self.bot = bot
+        self.history = history
+        self.is_busy = is_busy
+        self.cached_path = cached_path
+        self.download = download
+        self.cache_dir = cache_dir
+        self.paused = False
+        self.warmed = 0
+        self._spent = deque()  # (timestamp, bytes) in the last hour
+        self._task = None
+
+    def start(self):
+        if WARMER_ENABLED and self._task is None:
+            self._task = self.bot.loop.create_task(self.run())
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+            self._task = None
+
+    def budget_left(self):
+        """Bytes still allowed this hour."""
+        cutoff = time.monotonic() - 3600
+        while self._spent and self._spent[0][0] < cutoff:
+            self._spent.popleft()
+        return WARM_BUDGET_MB * 1_048_576 - sum(size for _, size in self._spent)
+
+    def disk_ok(self):
+        try:
+            return shutil.disk_usage(self.cache_dir).free > WARM_MIN_FREE_MB * 1_048_576
+        except OSError:
+            return False
+
+    async def run(self):
+        await self.bot.wait_until_ready()
+        while not self.bot.is_closed():
+            await asyncio.sleep(WARM_INTERVAL)
+            try:
+                await self.warm_once()
+            except Exception as e:
+                log.exception("Cache warming round failed: %s", e)
+
+    async def warm_once(self):
+        """Downloads up to WARM_BATCH likely songs that are not cached."""
+        warmed = 0
+        for track_id in self.history.candidates():
+            if warmed >= WARM_BATCH:
+                break
+            if self.paused or self.is_busy():
+                log.debug("Interactive work pending, pausing warm-up")
+                return
+            if self.cached_path(track_id):
+                continue
+            if self.budget_left() <= 0 or not self.disk_ok():
+                log.debug("Warm-up budget exhausted")
+                return
+
+            url = self.history.urls[track_id]
+            try:
+                await self.download(track_id, url)
+            except Exception as e:
+                log.info("Warm-up download of %s failed: %s", track_id, e, extra={'track_id': track_id})
+                continue
+
+            path = self.cached_path(track_id)
+            size = os.path.getsize(path) if path else 0
+            self._spent.append((time.monotonic(), size))
+            warmed += 1
+            self.warmed += 1
+            log.info("Warmed %s (%.1f MB)", self.history.titles.get(track_id, track_id), size / 1_048_576,
+                     extra={'track_id': track_id})
+            # Leave room between downloads for anything interactive
+            await asyncio.sleep(5)
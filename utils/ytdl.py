@@ -0,0 +1,88 @@
+import os
+import shutil
+import yt_dlp
+from utils.log import YTDLLogger
+from utils import storage
+
+# Set YTDL_VERBOSE=1 to get yt-dlp's debug output (still rate limited)
+YTDL_VERBOSE = os.getenv('YTDL_VERBOSE', '0') == '1'
+
+# Downloads resume from partial files. DOWNLOAD_SEGMENTS ranged connections are used per
+# file when aria2c is installed (and for fragmented formats), otherwise DOWNLOAD_CHUNK_MB chunks
+DOWNLOAD_SEGMENTS = int(os.getenv('DOWNLOAD_SEGMENTS', '4'))
+DOWNLOAD_CHUNK_MB = int(os.getenv('DOWNLOAD_CHUNK_MB', '10'))
+ARIA2C = shutil.which('aria2c')
+
+# YouTube DL options, shared by the bot (in-process mode) and the media daemon
+ytdl_format_options = {
+    'format': 'bestaudio/best',
+    'outtmpl': storage.OUTTMPL,
+    'writeinfojson': True,
+    'restrictfilenames': True,
+    'noplaylist': True,
+    'nocheckcertificate': True,
+    'ignoreerrors': False,
+    'logtostderr': False,
+    'quiet': not YTDL_VERBOSE,
+    'noprogress': True,
+    'no_warnings': False,
+    'logger': YTDLLogger(),
+    'default_search': 'auto',
+    'source_address': '0.0.0.0',
+    'cookiefile': os.getenv('COOKIES_FILE_PATH', '/app/cookies.txt'),
+    'verbose': YTDL_VERBOSE,
+    'continuedl': True,
+    'http_chunk_size': DOWNLOAD_CHUNK_MB * 1_048_576,
+    'retries': 10,
+    'fragment_retries': 10,
+    'concurrent_fragment_downloads': DOWNLOAD_SEGMENTS,
+    'extractor_args': {
+        'youtube': {
+            'player_client': ['tv']
+        }
+    },
+    'js_runtimes': {
+        'node': {}
+    },
+    'remote_components': ['ejs:github']
+}
+
+if ARIA2C:
+    # Segmented downloads; aria2c keeps a .aria2 control file next to the .part to resume each segment
+    ytdl_format_options['external_downloader'] = {'http': 'aria2c'}
+    ytdl_format_options['external_downloader_args'] = {
+        'aria2c': ['-x', str(DOWNLOAD_SEGMENTS), '-s', str(DOWNLOAD_SEGMENTS), '-k', '1M']
+    }
+
+ytdl = yt_dlp.YoutubeDL(ytdl_format_options)
+ytdl.add_post_processor(storage.ShardPP(), when='pre_process')
+
+# Flat extractor for playlists: lists entries without resolving each video
+ytdl_flat = yt_dlp.YoutubeDL({
+    **ytdl_format_options,
+    'noplaylist': False,
+    'extract_flat': 'in_playlist',
+    'lazy_playlist': True,
+    'writeinfojson': False,
+})
+
+# Background cache warming downloads at a capped rate so it never competes with playback
+ytdl_warm = yt_dlp.YoutubeDL({
+    **ytdl_format_options,
+    'ratelimit': int(os.getenv('WARM_RATE_LIMIT_KB', '512')) * 1024,
+    # One connection is enough for a rate limited background download
+    'external_downloader': {},
+    'concurrent_fragment_downloads': 1,
+})
+ytdl_warm.add_post_processor(storage.ShardPP(), when='pre_process')
+
+
+
+def shed_caches():
+    """Drops the player code yt-dlp keeps in memory per extractor; it is fetched again when needed."""
+    for downloader in (ytdl, ytdl_flat, ytdl_warm):
+        for extractor in getattr(downloader, '_ies_instances', {}).values():
+            for name in ('_code_cache', '_player_cache'):
+                cache = getattr(extractor, name, None)
+                if isinstance(cache, dict):
+                    cache.clear()